@@ -0,0 +1,380 @@
+# api.py
+# Headless HTTP/JSON API for front ends and integrations, on stdlib asyncio (no
+# web framework). Handlers run the same code as the CLI scripts and the app
+# (repository, context_builder, simple_prompt_call, simple_ingest), with blocking
+# database and model work moved onto a bounded thread pool.
+#
+#   GET  /contacts?search=&limit=25&offset=0    contacts, most urgent first
+#   GET  /contacts/<id>/context                 what the prompt for a contact contains
+#   POST /contacts/<id>/generate[?mock=1]       suggestions (precomputed ones when current)
+#   POST /ingest?contact=Ravi[&key=...]         request body: CSV timestamp,direction,text
+#   GET  /status                                in-flight, queued, coalesced, rejected counts
+#   GET  /metrics                               Prometheus text (see tracing.py)
+#
+# Each request runs against one user's shard: the X-BondKeeper-User header or
+# ?workspace= (default: BONDKEEPER_USER / BONDKEEPER_DB, as for the CLI scripts).
+# Only POST /ingest creates a shard; other requests for a workspace without a
+# database file get 404 (create shards with ingest or shards.py split).
+#
+# Load handling:
+#   - at most MAX_INFLIGHT requests are worked on at once; up to MAX_QUEUED more
+#     wait for a slot (at most QUEUE_TIMEOUT seconds). Beyond that, or after the
+#     wait, the answer is 503 with Retry-After, so clients back off instead of
+#     piling up behind a slow model. Admission is decided when the request
+#     arrives, and a freed slot passes straight to the oldest waiter, so a burst
+#     never holds more than MAX_INFLIGHT + MAX_QUEUED requests.
+#   - generate requests for the same shard, contact and prompt (by hash) that
+#     arrive while one is being generated share its result: one model call
+#     serves them all. At most MAX_GENERATIONS model calls run at once.
+#
+# Run:
+#   python api.py --port 8080
+#   python api.py --fake                        # local fake model, no API calls
+#   curl -X POST localhost:8080/contacts/1/generate -H "X-BondKeeper-User: alice"
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import context_builder
+import health
+import precompute
+import repository
+import simple_prompt_call as spc
+import tracing
+from simple_ingest import ingest
+
+MAX_INFLIGHT = int(os.getenv("API_MAX_INFLIGHT", "32"))
+MAX_QUEUED = int(os.getenv("API_MAX_QUEUED", "64"))
+QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "5"))
+MAX_GENERATIONS = int(os.getenv("API_MAX_GENERATIONS", "8"))
+MAX_BODY_BYTES = int(os.getenv("API_MAX_BODY_MB", "64")) * 1024 * 1024
+WORKER_THREADS = MAX_INFLIGHT           # every admitted request can hold one thread
+IDLE_TIMEOUT = 30.0                     # seconds a keep-alive connection may sit idle
+RETRY_AFTER_SECONDS = 1
+USER_HEADER = "x-bondkeeper-user"
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           408: "Request Timeout", 411: "Length Required", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int_param(query, name, default, low=0, high=None):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+    return max(low, value if high is None else min(value, high))
+
+
+def _flag(query, name):
+    return query.get(name, [""])[0].lower() in ("1", "true", "yes")
+
+
+def _contact_exists(contact_id):
+    if repository.get_contact(contact_id) is None:
+        raise HTTPError(404, f"No contact found with ID {contact_id}.")
+
+
+def _result_json(result):
+    return {**result.as_dict(), "model": result.model, "source": result.source,
+            "fallback_reason": result.fallback_reason, "error": result.error, "route": result.route,
+            "trace_id": (result.trace or {}).get("trace_id")}
+
+
+# --- Blocking handlers (run on the thread pool, in the request's shard)
+
+def list_contacts(query):
+    search = query.get("search", [""])[0]
+    limit = _int_param(query, "limit", 25, 1, 500)
+    offset = _int_param(query, "offset", 0)
+    page = repository.contact_previews(search, limit=limit, offset=offset)
+    contacts = [{"contact_id": cid, "name": name,
+                 "urgency": health.urgency(info["urgency_key"]) if info["urgency_key"] is not None else None,
+                 "health": info,
+                 "latest": [{"timestamp": ts, "direction": d, "text": text} for ts, d, text in messages]}
+                for cid, name, messages, info in page]
+    return {"total": repository.count_contacts(search), "offset": offset, "contacts": contacts}
+
+
+def contact_context(contact_id):
+    _contact_exists(contact_id)
+    name, notes, summary, turns, relevant = context_builder.build_context(contact_id)
+    prompt = context_builder.build_prompt_text(name, notes, summary, turns, relevant)
+    return {"contact_id": contact_id, "name": name, "notes": notes, "summary": summary, "turns": turns,
+            "relevant": relevant, "prompt_tokens_est": context_builder.estimate_tokens(prompt)}
+
+
+def ingest_csv(body, contact, key):
+    report = ingest(io.BytesIO(body), contact, contact_key=key)
+    trace = report.pop("trace")
+    return {**report, "trace_id": trace["trace_id"], "duration_ms": trace["duration_ms"]}
+
+
+class Api:
+    """Request routing plus the shared admission, single-flight and generation limits."""
+
+    def __init__(self, call=None, model_name=None, max_inflight=MAX_INFLIGHT, max_queued=MAX_QUEUED,
+                 queue_timeout=QUEUE_TIMEOUT, max_generations=MAX_GENERATIONS):
+        self.call = call
+        self.model_name = model_name
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._waiters = deque()  # futures of queued requests, oldest first
+        self._generations = asyncio.Semaphore(max_generations)
+        self._in_flight = {}    # (shard, contact_id, prompt hash, mock) -> Task
+        self.stats = {"inflight": 0, "queued": 0, "requests": 0, "rejected": 0,
+                      "generations": 0, "coalesced": 0}
+        self.routes = [
+            ("GET", re.compile(r"/contacts"), self.contacts),
+            ("GET", re.compile(r"/contacts/(\d+)/context"), self.context),
+            ("POST", re.compile(r"/contacts/(\d+)/generate"), self.generate),
+            ("POST", re.compile(r"/ingest"), self.ingest),
+        ]
+
+    async def contacts(self, query, body):
+        return await asyncio.to_thread(list_contacts, query)
+
+    async def context(self, query, body, contact_id):
+        return await asyncio.to_thread(contact_context, int(contact_id))
+
+    async def ingest(self, query, body):
+        contact = query.get("contact", [""])[0].strip()
+        if not contact:
+            raise HTTPError(400, "give the contact name as ?contact=")
+        if not body:
+            raise HTTPError(400, "request body must be a CSV with columns timestamp,direction,text")
+        try:
+            return await asyncio.to_thread(ingest_csv, body, contact, query.get("key", [None])[0])
+        except ValueError as e:  # pandas: missing columns, unparsable CSV
+            raise HTTPError(400, str(e))
+
+    async def generate(self, query, body, contact_id):
+        contact_id = int(contact_id)
+        use_mock = _flag(query, "mock") or spc.USE_MOCK
+        if not use_mock:
+            ready = await asyncio.to_thread(precompute.get_ready, contact_id)
+            if ready is not None:
+                return _result_json(ready)
+        try:
+            prompt = await asyncio.to_thread(spc.build_prompt, contact_id)
+        except ValueError as e:
+            raise HTTPError(404, str(e))
+        # same prompt => same question to the model; concurrent askers share one call
+        key = (repository.current_db_path(), contact_id, hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+               use_mock)
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.stats["coalesced"] += 1
+        else:
+            task = self._in_flight[key] = asyncio.ensure_future(self._generate(contact_id, use_mock, prompt))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: a client that disconnects must not cancel the call others wait on
+        try:
+            result = await asyncio.shield(task)
+        except ValueError as e:  # the contact was removed meanwhile
+            raise HTTPError(404, str(e))
+        return {**_result_json(result), "coalesced": coalesced}
+
+    async def _generate(self, contact_id, use_mock, prompt):
+        async with self._generations:
+            self.stats["generations"] += 1
+            return await asyncio.to_thread(spc.get_suggestions, contact_id, use_mock, self.call, self.model_name,
+                                           prompt)
+
+    def _route(self, method, path):
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            m = pattern.fullmatch(path)
+            if m:
+                if route_method == method:
+                    return handler, m.groups()
+                allowed = True
+        raise HTTPError(405 if allowed else 404, f"{method} {path} is not supported")
+
+    async def _admit(self):
+        """Take a request slot, queueing for one if all are busy; raises 503 when the queue
+        is full or the wait is too long. The request counts as inflight once this returns."""
+        stats = self.stats
+        # decided before the first await: concurrent arrivals cannot all pass the check
+        if stats["inflight"] + stats["queued"] >= self.max_inflight + self.max_queued:
+            raise HTTPError(503, "server busy, retry later")
+        if stats["inflight"] < self.max_inflight and not stats["queued"]:
+            stats["inflight"] += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        stats["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.cancelled():  # no slot was handed over; _release skips this waiter
+                stats["queued"] -= 1
+                if isinstance(e, asyncio.TimeoutError):
+                    raise HTTPError(503, "server busy, retry later")
+                raise
+            if isinstance(e, asyncio.CancelledError):  # cancelled just as the slot arrived
+                self._release()
+                raise
+
+    def _release(self):
+        """Free a request slot: hand it to the oldest waiter still waiting, if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.stats["queued"] -= 1  # the slot moves over; inflight stays the same
+                waiter.set_result(None)
+                return
+        self.stats["inflight"] -= 1
+
+    async def handle(self, method, target, headers, body):
+        """Dispatch one request; returns (status, content type, body bytes)."""
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = parse_qs(url.query)
+        if method == "GET" and path == "/status":
+            return 200, "application/json", json.dumps({**self.stats, "in_flight_generations": len(self._in_flight)})
+        if method == "GET" and path == "/metrics":
+            return 200, "text/plain; version=0.0.4", tracing.prometheus_text()
+        user = headers.get(USER_HEADER) or query.get("workspace", [None])[0]
+        try:
+            handler, args = self._route(method, path)
+            if user and handler != self.ingest and not os.path.exists(repository.shard_path(user)):
+                # reads must not create a database file per made-up workspace name
+                raise HTTPError(404, f"unknown workspace {user!r}")
+            await self._admit()
+        except HTTPError as e:
+            if e.status == 503:
+                self.stats["rejected"] += 1
+            return e.status, "application/json", json.dumps({"error": str(e)})
+        self.stats["requests"] += 1
+        # the shard is a contextvar: asyncio.to_thread and the generation task inherit it
+        shard = repository.use_shard(user) if user is not None else contextlib.nullcontext()
+        try:
+            with shard:
+                status, payload = 200, await handler(query, body, *args)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self._release()
+        return status, "application/json", json.dumps(payload, default=str)
+
+
+# --- HTTP/1.1 over asyncio streams
+
+async def _read_request(reader):
+    """(method, target, headers, body), or None when the client closed the connection."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "request headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "send a Content-Length instead of chunked encoding")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"request body is larger than {MAX_BODY_BYTES // (1024 * 1024)} MB")
+    try:
+        body = await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT) if length else b""
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        raise HTTPError(408, "request body incomplete")
+    return method.upper(), target, headers, body
+
+
+def _response(status, content_type, body, keep_alive):
+    body = body.encode("utf-8") if isinstance(body, str) else body
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if status == 503:
+        head.append(f"Retry-After: {RETRY_AFTER_SECONDS}")
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+def connection_handler(api):
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    writer.write(_response(e.status, "application/json", json.dumps({"error": str(e)}), False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, content_type, payload = await api.handle(method, target, headers, body)
+                writer.write(_response(status, content_type, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return on_connection
+
+
+async def serve(host="127.0.0.1", port=8080, api=None):
+    """Serve `api` (default: Api() with the real model) until cancelled."""
+    loop = asyncio.get_running_loop()
+    # asyncio.to_thread runs on the default executor and copies the request's
+    # context (its shard) into the worker thread
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="api"))
+    api = api or Api()
+    server = await asyncio.start_server(connection_handler(api), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless HTTP/JSON API for BondKeeper.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fake", action="store_true", help="use the local fake model instead of Gemini")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    call = model_name = None
+    if args.fake:
+        from fake_model import FakeModel
+        call = FakeModel(latency=args.fake_latency)
+        model_name = "fake/bondkeeper-fake"
+    print(f"BondKeeper API on http://{args.host}:{args.port} (Ctrl+C to stop)")
+    try:
+        asyncio.run(serve(args.host, args.port, Api(call, model_name)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,297 @@
+# archive.py
+# The cold tier: conversations moved out of SQLite by compact.py, one pair of
+# files per contact under <db>.archive/:
+#   <id>.g<gen>.cols  columnar and uncompressed, read through a memory map:
+#                     header, conv_id[n], ts[n], block offsets, inbound[n]
+#   <id>.g<gen>.text  (timestamp, direction, text) in zlib-compressed blocks of
+#                     BLOCK_ROWS messages, decompressed only when a read needs them
+# Rows are sorted by (ts, conv_id). The archived_contacts row for the contact
+# names the current generation and summarises it (count, time range, max conv_id),
+# so readers can tell without touching the files whether the cold tier matters
+# for a query. A compaction writes a new generation and switches to it in the
+# same transaction that deletes the hot rows; old generations are removed after.
+#
+# The helpers below take an open connection and hot rows shaped
+# (conv_id, ts, timestamp, direction, text), and merge in the cold rows.
+
+import heapq
+import json
+import os
+import re
+import zlib
+from functools import lru_cache
+
+MAGIC = b"BKARCH01"
+HEADER_BYTES = 16          # MAGIC + row count (int64)
+BLOCK_ROWS = 1024
+ZLIB_LEVEL = 6
+
+SQL_SUMMARY = """
+    SELECT generation, messages, inbound, first_ts, last_ts, max_conv_id, file_bytes
+    FROM archived_contacts WHERE contact_id=?
+"""
+SQL_SUMMARIES_BETWEEN = """
+    SELECT contact_id, generation, messages FROM archived_contacts
+    WHERE contact_id BETWEEN ? AND ? ORDER BY contact_id
+"""
+SQL_ALL_SUMMARIES = "SELECT contact_id, generation, messages FROM archived_contacts ORDER BY last_ts DESC"
+SUMMARY_FIELDS = ("generation", "messages", "inbound", "first_ts", "last_ts", "max_conv_id", "file_bytes")
+
+
+def archive_dir(conn):
+    """<database file>.archive for the main database of `conn`."""
+    path = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+    return f"{path or 'bondkeeper.db'}.archive"
+
+
+def segment_base(directory, contact_id, generation):
+    return os.path.join(directory, f"{contact_id}.g{generation}")
+
+
+def write_segment(directory, contact_id, generation, rows, inbound):
+    """Write a generation for `rows` ((conv_id, ts, timestamp, direction, text), sorted by
+    (ts, conv_id)) with their `inbound` flags. Returns the bytes written.
+
+    Files are written under temporary names and renamed into place, so a crash
+    never leaves a half-written generation under its real name.
+    """
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    base = segment_base(directory, contact_id, generation)
+    n = len(rows)
+    offsets = [0]
+    with open(base + ".text.tmp", "wb") as f:
+        for start in range(0, n, BLOCK_ROWS):
+            block = [[timestamp, direction, text] for _, _, timestamp, direction, text in rows[start:start + BLOCK_ROWS]]
+            f.write(zlib.compress(json.dumps(block, ensure_ascii=False).encode("utf-8"), ZLIB_LEVEL))
+            offsets.append(f.tell())
+        f.flush()
+        os.fsync(f.fileno())
+    with open(base + ".cols.tmp", "wb") as f:
+        f.write(MAGIC + np.int64(n).tobytes())
+        f.write(np.fromiter((r[0] for r in rows), dtype=np.int64, count=n).tobytes())
+        f.write(np.fromiter((r[1] for r in rows), dtype=np.int64, count=n).tobytes())
+        f.write(np.asarray(offsets, dtype=np.int64).tobytes())
+        f.write(np.asarray(inbound, dtype=np.uint8).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(base + ".text.tmp", base + ".text")
+    os.replace(base + ".cols.tmp", base + ".cols")
+    return os.path.getsize(base + ".text") + os.path.getsize(base + ".cols")
+
+
+def remove_segment(directory, contact_id, generation):
+    base = segment_base(directory, contact_id, generation)
+    for suffix in (".cols", ".text", ".cols.tmp", ".text.tmp"):
+        try:
+            os.remove(base + suffix)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            pass  # still mapped by a reader (Windows); the next compaction retries
+
+
+def remove_stale(directory, contact_id, keep_generation):
+    """Delete every generation of the contact other than `keep_generation`."""
+    pattern = re.compile(rf"^{contact_id}\.g(\d+)\.")
+    if not os.path.isdir(directory):
+        return
+    for generation in {int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m}:
+        if generation != keep_generation:
+            remove_segment(directory, contact_id, generation)
+
+
+class Segment:
+    """One contact's cold rows, memory-mapped; text blocks are decompressed on demand."""
+
+    def __init__(self, base, n):
+        import numpy as np
+
+        self.base = base
+        self.n = n
+        n_blocks = (n + BLOCK_ROWS - 1) // BLOCK_ROWS
+        cols = np.memmap(base + ".cols", dtype=np.uint8, mode="r")
+        if bytes(cols[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{base}.cols is not an archive file")
+        body = HEADER_BYTES
+        self.conv_ids = cols[body:body + 8 * n].view(np.int64)
+        self.ts = cols[body + 8 * n:body + 16 * n].view(np.int64)
+        self.offsets = cols[body + 16 * n:body + 16 * n + 8 * (n_blocks + 1)].view(np.int64)
+        self.inbound = cols[body + 16 * n + 8 * (n_blocks + 1):].view(np.bool_)
+        self._text = None
+
+    def block(self, b):
+        """The decoded [timestamp, direction, text] rows of text block `b`."""
+        return _decompress(self, b)
+
+    def _read_block(self, b):
+        if self._text is None:
+            import numpy as np
+            self._text = np.memmap(self.base + ".text", dtype=np.uint8, mode="r")
+        data = bytes(self._text[self.offsets[b]:self.offsets[b + 1]])
+        return json.loads(zlib.decompress(data).decode("utf-8"))
+
+    def rows(self, indices):
+        """(conv_id, ts, timestamp, direction, text) for row positions, in the given order."""
+        out = []
+        for i in indices:
+            i = int(i)
+            timestamp, direction, text = self.block(i // BLOCK_ROWS)[i % BLOCK_ROWS]
+            out.append((int(self.conv_ids[i]), int(self.ts[i]), timestamp, direction, text))
+        return out
+
+    def position(self, key):
+        """Number of rows sorted before (ts, conv_id) `key`."""
+        import numpy as np
+
+        ts, conv_id = key
+        lo = int(np.searchsorted(self.ts, ts, side="left"))
+        hi = int(np.searchsorted(self.ts, ts, side="right"))
+        return lo + int(np.searchsorted(self.conv_ids[lo:hi], conv_id, side="left")) if hi > lo else lo
+
+
+@lru_cache(maxsize=64)
+def _decompress(seg, b):
+    return seg._read_block(b)
+
+
+@lru_cache(maxsize=64)
+def _open_segment(base, n, mtime_ns):
+    return Segment(base, n)
+
+
+def _order(row):
+    # rows without a parsed ts sort oldest, as NULLs do in the hot table's ts order
+    return (row[1] if row[1] is not None else -2**63, row[0])
+
+
+def summary(conn, contact_id):
+    """The contact's archived_contacts row as a dict, or None if nothing is archived."""
+    row = conn.execute(SQL_SUMMARY, (contact_id,)).fetchone()
+    return dict(zip(SUMMARY_FIELDS, row)) if row else None
+
+
+def segment(conn, contact_id, info=None):
+    """The contact's current Segment, or None. Re-reads the summary once if a concurrent
+    compaction replaced the generation between the lookup and the open."""
+    for _ in range(2):
+        info = info or summary(conn, contact_id)
+        if info is None or not info["messages"]:
+            return None
+        try:
+            base = segment_base(archive_dir(conn), contact_id, info["generation"])
+            # the mtime keeps a recreated database from hitting an old cached mapping
+            return _open_segment(base, info["messages"], os.stat(base + ".cols").st_mtime_ns)
+        except FileNotFoundError:
+            info = None
+    return None
+
+
+def newest(conn, contact_id, hot, limit):
+    """Merge the newest cold rows into `hot` (newest first, at most `limit` rows)."""
+    info = summary(conn, contact_id)
+    if info is None or (len(hot) >= limit and hot[limit - 1][1] is not None and hot[limit - 1][1] > info["last_ts"]):
+        return hot
+    seg = segment(conn, contact_id, info)
+    if seg is None:
+        return hot
+    cold = seg.rows(range(seg.n - 1, max(seg.n - limit, 0) - 1, -1))
+    return list(heapq.merge(hot, cold, key=_order, reverse=True))[:limit]
+
+
+def between(conn, contact_id, hot, after, before, limit):
+    """Merge cold rows with after < (ts, conv_id) < before into `hot` (oldest first, at most `limit`)."""
+    info = summary(conn, contact_id)
+    if info is None or info["last_ts"] < after[0]:
+        return hot
+    seg = segment(conn, contact_id, info)
+    if seg is None:
+        return hot
+    start = seg.position((after[0], after[1] + 1))
+    stop = min(seg.position(before), start + limit)
+    cold = seg.rows(range(start, stop))
+    return list(heapq.merge(hot, cold, key=_order))[:limit]
+
+
+def by_ids(conn, contact_id, conv_ids):
+    """{conv_id: row} for those of `conv_ids` that are archived."""
+    import numpy as np
+
+    seg = segment(conn, contact_id)
+    if seg is None or not conv_ids:
+        return {}
+    positions = np.flatnonzero(np.isin(seg.conv_ids, np.asarray(list(conv_ids), dtype=np.int64)))
+    return {row[0]: row for row in seg.rows(positions)}
+
+
+def after_conv_id(conn, contact_id, last_conv_id, limit):
+    """Up to `limit` cold (conv_id, text) with conv_id > last_conv_id, by conv_id."""
+    import numpy as np
+
+    info = summary(conn, contact_id)
+    if info is None or info["max_conv_id"] <= last_conv_id:
+        return []
+    seg = segment(conn, contact_id, info)
+    if seg is None:
+        return []
+    positions = np.flatnonzero(seg.conv_ids > last_conv_id)
+    positions = positions[np.argsort(seg.conv_ids[positions], kind="stable")[:limit]]
+    return [(conv_id, text) for conv_id, _, _, _, text in seg.rows(positions)]
+
+
+def message_arrays(conn, contact_ids):
+    """(contact_ids, ts, inbound, conv_ids) NumPy arrays of the cold rows of `contact_ids`.
+
+    Only the memory-mapped columns are read, no text.
+    """
+    import numpy as np
+
+    wanted = set(contact_ids)
+    parts = ([], [], [], [])
+    if wanted:
+        for cid, generation, messages in conn.execute(SQL_SUMMARIES_BETWEEN, (min(wanted), max(wanted))):
+            if cid not in wanted:
+                continue
+            seg = segment(conn, cid, {"generation": generation, "messages": messages})
+            if seg is None:
+                continue
+            parts[0].append(np.full(seg.n, cid, dtype=np.int64))
+            parts[1].append(np.asarray(seg.ts))
+            parts[2].append(np.asarray(seg.inbound))
+            parts[3].append(np.asarray(seg.conv_ids))
+    if not parts[0]:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.bool_), np.empty(0, np.int64)
+    return tuple(np.concatenate(p) for p in parts)
+
+
+def search(conn, patterns, contact_id=None, limit=20):
+    """Cold rows whose text matches every compiled regex in `patterns`, newest first.
+
+    Returns [(conv_id, contact_id, ts, timestamp, direction, text)]. Contacts are
+    scanned most recently archived first and their blocks newest to oldest,
+    decompressing only until `limit` matches are found.
+    """
+    if contact_id is not None:
+        info = summary(conn, contact_id)
+        targets = [(contact_id, info["generation"], info["messages"])] if info else []
+    else:
+        targets = conn.execute(SQL_ALL_SUMMARIES).fetchall()
+    found = []
+    for cid, generation, messages in targets:
+        seg = segment(conn, cid, {"generation": generation, "messages": messages})
+        if seg is None:
+            continue
+        for b in range((seg.n - 1) // BLOCK_ROWS, -1, -1):
+            block = seg.block(b)
+            for j in range(len(block) - 1, -1, -1):
+                timestamp, direction, text = block[j]
+                if text and all(p.search(text) for p in patterns):
+                    i = b * BLOCK_ROWS + j
+                    found.append((int(seg.conv_ids[i]), cid, int(seg.ts[i]), timestamp, direction, text))
+            if len(found) >= limit:
+                break
+        if len(found) >= limit:
+            break
+    found.sort(key=lambda r: (r[2], r[0]), reverse=True)
+    return found[:limit]
@@ -0,0 +1,243 @@
+# batch_generate.py
+# Generate suggestions for many contacts at once.
+# Contacts are processed concurrently on a thread pool. All workers share one
+# token bucket sized to the API quota, and quota errors (429) are retried with
+# jittered exponential backoff, which also pauses the bucket so the other workers
+# back off too. Every finished contact is checkpointed to batch_items, so an
+# interrupted run picks up where it stopped with --resume RUN_ID.
+#
+# Run:
+#   python batch_generate.py                     # all contacts
+#   python batch_generate.py --contacts 1,2,3
+#   python batch_generate.py --resume 4
+#   python batch_generate.py --fake --fake-error-rate 0.2   # no API calls
+
+import argparse
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import repository
+import simple_prompt_call as spc
+import suggestion_cache
+
+# Requests per minute allowed by the API key's quota
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+MAX_WORKERS = 8
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0   # seconds
+BACKOFF_CAP = 60.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (used after a quota error)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class GenerationFailed(Exception):
+    """generate_one gave up on a contact after `attempts` model calls."""
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def create_run(contact_ids, model_name):
+    now = time.time()
+    with repository.transaction() as conn:
+        run_id = conn.execute("INSERT INTO batch_runs(model, status, created_at) VALUES (?,?,?)",
+                              (model_name, "running", now)).lastrowid
+        conn.executemany("""
+            INSERT INTO batch_items(run_id, contact_id, status, updated_at) VALUES (?,?,?,?)
+        """, ((run_id, cid, "pending", now) for cid in contact_ids))
+    return run_id
+
+
+def pending_items(run_id):
+    with repository.connection() as conn:
+        rows = conn.execute("""
+            SELECT contact_id, attempts FROM batch_items
+            WHERE run_id=? AND status != 'done' ORDER BY contact_id
+        """, (run_id,)).fetchall()
+    return rows
+
+
+def _checkpoint(run_id, contact_id, status, attempts, result=None, error=None):
+    with repository.transaction() as conn:
+        conn.execute("""
+            UPDATE batch_items SET status=?, attempts=?, result=?, error=?, updated_at=?
+            WHERE run_id=? AND contact_id=?
+        """, (status, attempts, json.dumps(result) if result is not None else None,
+              error, time.time(), run_id, contact_id))
+
+
+def generate_one(contact_id, model_name, call, bucket, max_retries=MAX_RETRIES):
+    """Return (suggestion dict, attempts).
+
+    Raises GenerationFailed (with the number of model calls made) after the last
+    failed attempt; errors before the first call (e.g. an unknown contact) propagate.
+    """
+    user_prompt = spc.build_prompt(contact_id)
+    key = suggestion_cache.cache_key(model_name, spc.SYSTEM_INSTRUCTION, user_prompt)
+    cached = suggestion_cache.get(key)
+    if cached is not None:
+        return cached, 0
+
+    attempt = 0
+    while True:
+        bucket.acquire()
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            text = call(model_name, user_prompt)
+        except Exception as e:
+            if not spc.record_failure(model_name, start, e) or attempt > max_retries:
+                raise GenerationFailed(str(e), attempt) from e
+            delay = backoff_delay(attempt - 1)
+            bucket.pause(delay)
+            time.sleep(delay)
+            continue
+        spc.record_call(model_name, start, "ok")
+        try:
+            parsed = spc.parse_suggestion_json(text)
+        except ValueError:
+            raise GenerationFailed(f"model returned non-JSON output: {text[:200]!r}", attempt)
+        suggestion_cache.put(key, contact_id, model_name, parsed)
+        return parsed, attempt
+
+
+def run_batch(contact_ids=None, run_id=None, model_name=None, call=None,
+              workers=MAX_WORKERS, rpm=GEMINI_RPM, max_retries=MAX_RETRIES, progress=print):
+    """Generate suggestions for `contact_ids` (default: all contacts), or resume `run_id`.
+
+    `call(model_name, user_prompt) -> text` defaults to the real Gemini call.
+    Returns a summary dict with the run id and done/failed counts.
+    """
+    call = call or spc.call_model
+    if run_id is None:
+        if model_name is None:
+            model_name = spc.choose_best_model()
+            if not model_name:
+                raise RuntimeError("No suitable model discovered (check GEMINI_API_KEY).")
+        if contact_ids is None:
+            contact_ids = [cid for cid, _ in repository.list_contacts()]
+        run_id = create_run(contact_ids, model_name)
+    else:
+        with repository.connection() as conn:
+            row = conn.execute("SELECT model FROM batch_runs WHERE run_id=?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"No batch run with ID {run_id}.")
+        model_name = model_name or row[0]
+
+    items = pending_items(run_id)
+    bucket = TokenBucket(rpm / 60.0)
+    done = failed = 0
+    started = time.perf_counter()
+    progress(f"Run {run_id}: {len(items)} contacts to process with {model_name}")
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # each worker call runs in a copy of this context, so it reads the caller's shard
+        futures = {pool.submit(contextvars.copy_context().run, generate_one, cid, model_name, call, bucket,
+                               max_retries): (cid, attempts)
+                   for cid, attempts in items}
+        for fut in as_completed(futures):
+            cid, prior_attempts = futures[fut]
+            try:
+                result, attempts = fut.result()
+            except Exception as e:
+                failed += 1
+                attempts = e.attempts if isinstance(e, GenerationFailed) else 0
+                _checkpoint(run_id, cid, "failed", prior_attempts + attempts, error=str(e))
+                progress(f"  contact {cid}: failed ({e})")
+            else:
+                done += 1
+                _checkpoint(run_id, cid, "done", prior_attempts + attempts, result=result)
+            finished = done + failed
+            if finished % 10 == 0 or finished == len(items):
+                progress(f"  {finished}/{len(items)} done ({failed} failed)")
+    except KeyboardInterrupt:
+        # drop queued contacts; they stay pending in batch_items for --resume
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    status = "done" if failed == 0 else "partial"
+    with repository.transaction() as conn:
+        conn.execute("UPDATE batch_runs SET status=?, finished_at=? WHERE run_id=?",
+                     (status, time.time(), run_id))
+    elapsed = time.perf_counter() - started
+    progress(f"Run {run_id} {status}: {done} done, {failed} failed in {elapsed:.1f}s")
+    return {"run_id": run_id, "status": status, "done": done, "failed": failed, "elapsed": elapsed}
+
+
+def run_results(run_id):
+    """Return {contact_id: suggestion dict} for the finished items of a run."""
+    with repository.connection() as conn:
+        rows = conn.execute("""
+            SELECT contact_id, result FROM batch_items WHERE run_id=? AND status='done'
+        """, (run_id,)).fetchall()
+    return {cid: json.loads(result) for cid, result in rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate suggestions for many contacts concurrently.")
+    parser.add_argument("--contacts", help="comma-separated contact ids (default: all)")
+    parser.add_argument("--resume", type=int, metavar="RUN_ID", help="continue an interrupted run")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rpm", type=float, default=GEMINI_RPM, help="requests per minute quota")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--fake", action="store_true", help="use the local fake model instead of Gemini")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    call = model_name = None
+    if args.fake:
+        from fake_model import FakeModel
+        call = FakeModel(latency=args.fake_latency, error_rate=args.fake_error_rate)
+        model_name = "fake/bondkeeper-fake"
+    contact_ids = [int(c) for c in args.contacts.split(",")] if args.contacts else None
+
+    try:
+        run_batch(contact_ids, run_id=args.resume, model_name=model_name, call=call,
+                  workers=args.workers, rpm=args.rpm, max_retries=args.retries)
+    except KeyboardInterrupt:
+        print("Interrupted. Finished contacts are saved; continue with --resume.")
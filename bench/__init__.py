@@ -0,0 +1,3 @@
+# bench
+# Benchmarks for BondKeeper: synthetic data (synthetic.py), the benchmark runner
+# (run.py) and a JSON result comparer (compare.py). See run.py for usage.
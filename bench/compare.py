@@ -0,0 +1,60 @@
+# bench/compare.py
+# Compare two benchmark result files (e.g. from two commits).
+#
+# Run:
+#   python -m bench.compare bench_results/old.json bench_results/new.json
+#   python -m bench.compare old.json new.json --threshold 0.10   # exit 1 on >10% regression
+
+import argparse
+import json
+import sys
+
+# For these metrics bigger is better; for everything else (latencies, sizes) smaller is.
+HIGHER_IS_BETTER = ("rows_per_sec",)
+
+
+def flatten(data, prefix=""):
+    out = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = value
+    return out
+
+
+def compare(old, new, threshold):
+    """Return [(metric, old, new, relative change, regressed)] for metrics in both runs."""
+    a, b = flatten(old["results"]), flatten(new["results"])
+    rows = []
+    for metric in sorted(set(a) & set(b)):
+        if not a[metric]:
+            continue
+        change = (b[metric] - a[metric]) / abs(a[metric])
+        worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+        rows.append((metric, a[metric], b[metric], change, worse > threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two bench.run result files.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{old['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    regressions = 0
+    for metric, before, after, change, regressed in compare(old, new, args.threshold):
+        if metric.endswith((".n", "rows", "contacts")):
+            continue
+        flag = "  REGRESSION" if regressed else ""
+        regressions += regressed
+        print(f"{metric:55s} {before:14.3f} {after:14.3f} {change:+8.1%}{flag}")
+    sys.exit(1 if regressions else 0)
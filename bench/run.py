@@ -0,0 +1,286 @@
+# bench/run.py
+# Repeatable BondKeeper benchmarks. Results are written as JSON so runs from
+# different commits can be compared with bench/compare.py.
+#
+# Run from the repository root:
+#   python -m bench.run                      # small preset, all benchmarks
+#   python -m bench.run --preset large       # 10k contacts / 10M messages
+#   python -m bench.run --only ingest,context --fake-latency 0.5 --fake-error-rate 0.1
+#   python -m bench.run --only imports       # cold-start import cost of the entry points
+#
+# Generated databases are kept in --workdir (default bench_data/) and reused by
+# later runs with the same preset and seed.
+
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import health
+import repository
+import similarity
+import simple_ingest
+import simple_prompt_call as spc
+from bench import synthetic
+from fake_model import FakeModel
+
+PRESETS = {
+    # ingest_rows: CSV size for the ingest benchmark
+    # sizes: (contacts, messages) databases for the query benchmarks
+    "small": {"ingest_rows": 100_000, "sizes": [(1_000, 10_000), (1_000, 100_000)],
+              "lookups": 500, "pages": 50, "generate_calls": 50, "import_repeats": 5},
+    "medium": {"ingest_rows": 1_000_000, "sizes": [(5_000, 100_000), (5_000, 1_000_000)],
+               "lookups": 1_000, "pages": 100, "generate_calls": 100, "import_repeats": 10},
+    "large": {"ingest_rows": 5_000_000, "sizes": [(10_000, 1_000_000), (10_000, 10_000_000)],
+              "lookups": 2_000, "pages": 200, "generate_calls": 200, "import_repeats": 10},
+}
+
+BENCHMARKS = ["imports", "ingest", "context", "panel", "generate"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_imports(path=os.path.join(ROOT, "streamlit_app.py")):
+    """The repository modules `path` imports at top level, in order (streamlit itself is not one)."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return [name for name in dict.fromkeys(names)
+            if os.path.exists(os.path.join(ROOT, name.split(".")[0] + ".py"))]
+
+
+# Entry points timed by the imports benchmark, each in a fresh interpreter.
+# "app" is what streamlit_app.py imports besides streamlit, read from the app so it
+# stays in sync.
+IMPORT_TARGETS = {
+    "simple_prompt_call": ["simple_prompt_call"],
+    "simple_ingest": ["simple_ingest"],
+    "app": app_imports(),
+}
+# heavy dependencies whose presence after import is reported
+HEAVY_MODULES = ["google.generativeai", "grpc", "google.protobuf", "pandas", "numpy"]
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    __import__(name)
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "loaded": [m for m in sys.argv[1].split(",") if m in sys.modules]}))
+"""
+
+
+def latency_stats(samples):
+    """Summarise a list of durations (seconds) in milliseconds."""
+    ms = np.asarray(samples, dtype=float) * 1000
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def use_db(path):
+    """Point the repository (and everything built on it) at `path`."""
+    repository.set_db_path(path)
+    return repository.get_pool(path)
+
+
+def dataset(workdir, contacts, messages, seed):
+    """Path of a synthetic DB with the given shape, generating it on first use."""
+    path = os.path.join(workdir, f"synthetic-{contacts}c-{messages}m-s{seed}.db")
+    if not os.path.exists(path):
+        print(f"Generating {path} ...")
+        synthetic.populate_db(path, contacts, messages, seed=seed, progress=lambda msg: None)
+    return path
+
+
+def bench_ingest(workdir, rows, seed):
+    csv_path = os.path.join(workdir, f"ingest-{rows}-s{seed}.csv")
+    if not os.path.exists(csv_path):
+        synthetic.write_csv(csv_path, rows, seed=seed)
+    db_path = os.path.join(workdir, "ingest-target.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    use_db(db_path)
+    simple_ingest.init_db()
+    elapsed = timed(simple_ingest.ingest, csv_path, "Bench Contact")
+    # importing the same file again should only hash and skip
+    reimport = timed(simple_ingest.ingest, csv_path, "Bench Contact")
+    return {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed,
+            "reimport_seconds": reimport, "reimport_rows_per_sec": rows / reimport,
+            "db_bytes": os.path.getsize(db_path)}
+
+
+def bench_context(db_path, lookups, seed):
+    use_db(db_path)
+    contact_ids = [cid for cid, _ in repository.list_contacts()]
+    rng = random.Random(seed)
+    spc.get_context(contact_ids[0])  # warm the pool
+    samples = [timed(spc.get_context, rng.choice(contact_ids)) for _ in range(lookups)]
+    # full prompt assembly: token-budgeted turns + rolling summary (first call per
+    # contact folds its history; later calls are measured separately)
+    picks = [rng.choice(contact_ids) for _ in range(lookups)]
+    first = [timed(spc.build_prompt, cid) for cid in picks]
+    warm = [timed(spc.build_prompt, cid) for cid in picks]
+    if not os.path.isdir(similarity.vector_dir()):
+        similarity.rebuild(progress=None)  # databases generated before the index existed
+    # the index must be this database's, or the similarity numbers time empty scans
+    assert any(similarity.load(cid) is not None for cid in set(picks)), \
+        f"no similarity vectors for {db_path} in {similarity.vector_dir()}"
+    queries = ["coffee soon?", "how did the interview go", "happy birthday!", "call this weekend"]
+    similar = [timed(similarity.search, cid, rng.choice(queries)) for cid in picks]
+    return {"get_context": latency_stats(samples), "build_prompt_first": latency_stats(first),
+            "build_prompt_warm": latency_stats(warm), "similarity_search": latency_stats(similar)}
+
+
+def bench_panel(db_path, pages, seed, page_size=25):
+    use_db(db_path)
+    total = repository.count_contacts()
+    n_pages = max(1, (total + page_size - 1) // page_size)
+    rng = random.Random(seed)
+    health_rebuild = timed(health.rebuild, progress=None)
+    # an empty page would make every number below meaningless
+    assert repository.contact_previews(limit=page_size), f"no contact previews in {db_path}"
+    first = [timed(repository.contact_previews, limit=page_size) for _ in range(pages)]
+    random_pages = [timed(repository.contact_previews, limit=page_size,
+                          offset=rng.randrange(n_pages) * page_size) for _ in range(pages)]
+    search = [timed(repository.contact_previews, search=str(rng.randrange(10)), limit=page_size)
+              for _ in range(pages)]
+    return {"contacts": total, "first_page": latency_stats(first),
+            "random_page": latency_stats(random_pages), "search": latency_stats(search),
+            "count": latency_stats([timed(repository.count_contacts) for _ in range(pages)]),
+            "health_rebuild_s": health_rebuild}
+
+
+def bench_generate(db_path, calls, latency, error_rate, seed):
+    pool = use_db(db_path)
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM suggestion_cache")  # measure the uncached path
+    fake = FakeModel(latency=latency, jitter=latency / 10, error_rate=error_rate, seed=seed)
+    contact_ids = [cid for cid, _ in repository.list_contacts()][:calls]
+    sources = {}
+    samples = []
+    for cid in contact_ids:
+        start = time.perf_counter()
+        result = spc.get_suggestions(cid, use_mock=False, call=fake, model_name="fake/bondkeeper-fake")
+        samples.append(time.perf_counter() - start)
+        key = result.fallback_reason or result.source
+        sources[key] = sources.get(key, 0) + 1
+    stats = latency_stats(samples)
+    stats.update({"fake_latency_ms": latency * 1000, "fake_error_rate": error_rate,
+                  "overhead_p50_ms": stats["p50_ms"] - latency * 1000, "outcomes": sources})
+    return stats
+
+
+def bench_imports(repeats):
+    """Cold import time per entry point (median over fresh interpreters) and which
+    heavy dependencies each one drags in."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for label, modules in IMPORT_TARGETS.items():
+        samples = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", IMPORT_PROBE, ",".join(HEAVY_MODULES), *modules],
+                                 capture_output=True, text=True, check=True, cwd=root).stdout
+            probe = json.loads(out.strip().splitlines()[-1])
+            samples.append(probe["seconds"])
+        stats = latency_stats(samples)
+        stats["loaded"] = probe["loaded"]
+        results[label] = stats
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run BondKeeper benchmarks.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--only", help=f"comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--out", default="bench_results", help="directory for the JSON result")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="fake model latency (s)")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    preset = PRESETS[args.preset]
+    selected = args.only.split(",") if args.only else BENCHMARKS
+    os.makedirs(args.workdir, exist_ok=True)
+    os.makedirs(args.out, exist_ok=True)
+
+    results = {}
+    if "imports" in selected:
+        print(f"imports: {preset['import_repeats']} cold starts per entry point")
+        results["imports"] = bench_imports(preset["import_repeats"])
+    if "ingest" in selected:
+        print(f"ingest: {preset['ingest_rows']:,} rows")
+        results["ingest"] = bench_ingest(args.workdir, preset["ingest_rows"], args.seed)
+    for contacts, messages in preset["sizes"]:
+        label = f"{contacts}c_{messages}m"
+        if not set(selected) & {"context", "panel", "generate"}:
+            break
+        db_path = dataset(args.workdir, contacts, messages, args.seed)
+        if "context" in selected:
+            print(f"context: {label}")
+            results.setdefault("context", {})[label] = bench_context(db_path, preset["lookups"], args.seed)
+        if "panel" in selected:
+            print(f"panel: {label}")
+            results.setdefault("panel", {})[label] = bench_panel(db_path, preset["pages"], args.seed)
+    if "generate" in selected:
+        contacts, messages = preset["sizes"][0]
+        print(f"generate: {preset['generate_calls']} calls")
+        results["generate"] = bench_generate(dataset(args.workdir, contacts, messages, args.seed),
+                                             preset["generate_calls"], args.fake_latency,
+                                             args.fake_error_rate, args.seed)
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "revision": revision,
+            "preset": args.preset,
+            "seed": args.seed,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    out_path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{revision or 'norev'}-{args.preset}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
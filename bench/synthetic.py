@@ -0,0 +1,152 @@
+# bench/synthetic.py
+# Synthetic contacts and conversations for benchmarks.
+# Everything is generated with NumPy from a seed, so runs are repeatable, and
+# written in chunks, so 10k contacts / 10M messages fit in bounded memory.
+#
+# Run:
+#   python -m bench.synthetic db  bench.db  --contacts 10000 --messages 10000000
+#   python -m bench.synthetic csv big.csv   --messages 1000000
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import health
+import repository
+import similarity
+import suggestion_cache
+from schema import contact_key, message_hashes
+
+TEMPLATES = np.array([
+    "Hey, how have you been?",
+    "Sorry I've been so busy lately.",
+    "Great meeting today! Coffee soon?",
+    "Did you see the game last night?",
+    "Happy birthday!! Hope it's a great one",
+    "I've been stressed and not keeping up.",
+    "It's okay, take your time.",
+    "Are we still on for Friday?",
+    "Just landed, will call you later.",
+    "Thanks so much for the help yesterday.",
+    "Long time no see — we should catch up.",
+    "Can you send me that article you mentioned?",
+    "Congrats on the new job!",
+    "How is your mom doing?",
+    "Running late, be there in 10.",
+    "That sounds amazing, tell me more.",
+], dtype=object)
+DIRECTIONS = np.array(["inbound", "outbound"], dtype=object)
+
+START_TS = 1_577_836_800          # 2020-01-01
+HISTORY_SECONDS = 5 * 365 * 86400  # each contact's history spans about five years
+
+
+def contact_sizes(n_contacts, n_messages, rng):
+    """Split n_messages over contacts with a skewed (lognormal) distribution."""
+    weights = rng.lognormal(mean=0.0, sigma=1.2, size=n_contacts)
+    return rng.multinomial(n_messages, weights / weights.sum())
+
+
+def message_frame(n, rng, start_ts=START_TS, mean_gap=None):
+    """One contact's history: n messages with increasing timestamps."""
+    mean_gap = mean_gap or HISTORY_SECONDS / max(n, 1)
+    ts = start_ts + np.cumsum(rng.exponential(mean_gap, size=n)).astype(np.int64)
+    text = TEMPLATES[rng.integers(0, len(TEMPLATES), size=n)]
+    # a numeric suffix keeps texts distinct enough for search/dedup benchmarks
+    suffix = rng.integers(0, 1_000_000, size=n).astype(str)
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(ts, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+        "ts": ts,
+        "direction": DIRECTIONS[rng.integers(0, 2, size=n)],
+        "text": text + " #" + suffix.astype(object),
+    })
+
+
+def write_csv(path, n_messages, seed=0, chunksize=100_000):
+    """Write one contact's export (timestamp,direction,text) with n_messages rows."""
+    rng = np.random.default_rng(seed)
+    start = START_TS
+    written = 0
+    while written < n_messages:
+        n = min(chunksize, n_messages - written)
+        frame = message_frame(n, rng, start, mean_gap=HISTORY_SECONDS / n_messages)
+        start = int(frame["ts"].iloc[-1])
+        frame[["timestamp", "direction", "text"]].to_csv(
+            path, mode="w" if written == 0 else "a", header=written == 0, index=False)
+        written += n
+    return path
+
+
+def populate_db(db_path, n_contacts, n_messages, seed=0, chunksize=100_000, progress=print):
+    """Fill db_path with n_contacts contacts and about n_messages messages.
+
+    Writes through the repository insert path (one transaction per chunk), so the
+    resulting database has the same schema and indexes as a real one. Everything,
+    including the health and similarity rebuilds, runs against db_path.
+    """
+    with repository.use_db_path(db_path):
+        return _populate(n_contacts, n_messages, seed, chunksize, progress)
+
+
+def _populate(n_contacts, n_messages, seed, chunksize, progress):
+    rng = np.random.default_rng(seed)
+    sizes = contact_sizes(n_contacts, n_messages, rng)
+    started = time.perf_counter()
+    pending = []
+    pending_rows = 0
+    written = 0
+
+    def flush():
+        nonlocal pending, pending_rows, written
+        with repository.transaction() as conn:
+            for cid, frame in pending:
+                ts = frame["ts"].tolist()
+                hashes = message_hashes(ts, frame["timestamp"], frame["direction"], frame["text"])
+                repository.insert_messages(conn, zip([cid] * len(frame), frame["timestamp"], ts,
+                                                     frame["direction"], frame["text"], hashes))
+                suggestion_cache.invalidate_contact(conn, cid)
+            repository.bump_data_version(conn)
+        written += pending_rows
+        pending, pending_rows = [], 0
+        progress(f"  {written:,}/{int(sizes.sum()):,} messages")
+
+    with repository.transaction() as conn:
+        first = conn.execute("SELECT COALESCE(MAX(contact_id), 0) FROM contacts").fetchone()[0] + 1
+        conn.executemany("INSERT INTO contacts(contact_id, name, notes, contact_key) VALUES (?,?,?,?)",
+                         ((first + i, f"Contact {first + i}", "", contact_key(f"Contact {first + i}"))
+                          for i in range(n_contacts)))
+        # every contact has a health row, as repository.create_contact guarantees
+        conn.executemany(repository.SQL_ADD_HEALTH_ROW, ((first + i,) for i in range(n_contacts)))
+    for i, size in enumerate(sizes):
+        if size == 0:
+            continue
+        pending.append((first + i, message_frame(int(size), rng)))
+        pending_rows += int(size)
+        if pending_rows >= chunksize:
+            flush()
+    if pending:
+        flush()
+    health.rebuild(progress=None)
+    similarity.rebuild(progress=None)
+
+    elapsed = time.perf_counter() - started
+    progress(f"Generated {n_contacts:,} contacts / {written:,} messages in {elapsed:.1f}s")
+    return list(range(first, first + n_contacts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic BondKeeper data.")
+    parser.add_argument("kind", choices=["db", "csv"])
+    parser.add_argument("path")
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind == "db":
+        populate_db(args.path, args.contacts, args.messages, seed=args.seed)
+    else:
+        write_csv(args.path, args.messages, seed=args.seed)
+        print(f"Wrote {args.messages:,} messages to {args.path}")
@@ -0,0 +1,132 @@
+# compact.py
+# Move old conversations out of SQLite into the cold tier (archive.py), so the hot
+# table, its indexes and the FTS index only carry recent history.
+# For each contact with messages older than the cutoff, in one transaction:
+#   - the contact's current archive generation and the newly old hot rows are
+#     merged into a new generation (written to temporary files, then renamed)
+#   - archived_contacts is pointed at the new generation, the message hashes go
+#     to archived_hashes (so re-imports skip them), and the hot rows are deleted
+# Old generations are removed afterwards. Reads (get_context, prompt context,
+# search, health, the similarity index) merge both tiers.
+#
+# The newest row by conv_id is never archived: SQLite would hand its rowid out
+# again, and conv_ids must stay unique across both tiers.
+#
+# Run:
+#   python compact.py --older-than-days 365
+#   python compact.py --before 2024-01-01 --contact 4 --vacuum
+#   python compact.py --stats
+
+import argparse
+import os
+import time
+
+import archive
+import repository
+import similarity
+from context_builder import INBOUND_DIRECTIONS
+from schema import to_epoch
+
+SQL_CANDIDATES = "SELECT DISTINCT contact_id FROM conversations WHERE ts < ? ORDER BY contact_id"
+SQL_OLD_ROWS = """
+    SELECT conv_id, ts, timestamp, direction, text, msg_hash FROM conversations
+    WHERE contact_id=? AND ts < ? AND conv_id < (SELECT MAX(conv_id) FROM conversations)
+    ORDER BY ts, conv_id
+"""
+SQL_UPSERT_SUMMARY = """
+    INSERT INTO archived_contacts(contact_id, generation, messages, inbound, first_ts, last_ts,
+                                  max_conv_id, file_bytes, archived_at)
+    VALUES (?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(contact_id) DO UPDATE SET
+        generation=excluded.generation, messages=excluded.messages, inbound=excluded.inbound,
+        first_ts=excluded.first_ts, last_ts=excluded.last_ts, max_conv_id=excluded.max_conv_id,
+        file_bytes=excluded.file_bytes, archived_at=excluded.archived_at
+"""
+SQL_ADD_HASH = "INSERT OR IGNORE INTO archived_hashes(contact_id, msg_hash) VALUES (?,?)"
+SQL_TIER_STATS = """
+    SELECT (SELECT COUNT(*) FROM conversations),
+           (SELECT COUNT(*) FROM archived_contacts),
+           (SELECT COALESCE(SUM(messages), 0) FROM archived_contacts),
+           (SELECT COALESCE(SUM(file_bytes), 0) FROM archived_contacts)
+"""
+
+
+def compact_contact(conn, contact_id, cutoff_ts):
+    """Archive the contact's hot messages older than `cutoff_ts`. Returns how many moved."""
+    # vectors are built from the hot table first; archived rows keep theirs
+    similarity.index_contact(conn, contact_id)
+    directory = archive.archive_dir(conn)
+    with repository.transaction_on(conn):
+        rows = conn.execute(SQL_OLD_ROWS, (contact_id, cutoff_ts)).fetchall()
+        if not rows:
+            return 0
+        info = archive.summary(conn, contact_id)
+        seg = archive.segment(conn, contact_id, info)
+        merged = sorted((seg.rows(range(seg.n)) if seg else []) + [r[:5] for r in rows],
+                        key=lambda r: (r[1], r[0]))
+        generation = info["generation"] + 1 if info else 1
+        inbound = [(direction or "").lower() in INBOUND_DIRECTIONS for _, _, _, direction, _ in merged]
+        try:
+            file_bytes = archive.write_segment(directory, contact_id, generation, merged, inbound)
+            conn.execute(SQL_UPSERT_SUMMARY, (contact_id, generation, len(merged), sum(inbound),
+                                              merged[0][1], merged[-1][1], max(r[0] for r in merged),
+                                              file_bytes, time.time()))
+            conn.executemany(SQL_ADD_HASH, [(contact_id, r[5]) for r in rows if r[5] is not None])
+            repository.delete_messages(conn, [r[0] for r in rows])
+            repository.bump_data_version(conn)
+        except Exception:
+            archive.remove_segment(directory, contact_id, generation)
+            raise
+    archive.remove_stale(directory, contact_id, generation)
+    return len(rows)
+
+
+def compact(cutoff_ts, contact_ids=None, progress=print):
+    """Archive messages older than `cutoff_ts` for `contact_ids` (default: every contact)."""
+    moved = 0
+    with repository.connection() as conn:
+        if contact_ids is None:
+            contact_ids = [r[0] for r in conn.execute(SQL_CANDIDATES, (cutoff_ts,))]
+        for i, cid in enumerate(contact_ids, 1):
+            moved += compact_contact(conn, cid, cutoff_ts)
+            if progress and (i % 100 == 0 or i == len(contact_ids)):
+                progress(f"  {i:,}/{len(contact_ids):,} contacts, {moved:,} messages archived")
+    return moved
+
+
+def tier_stats():
+    with repository.connection() as conn:
+        hot, contacts, cold, cold_bytes = conn.execute(SQL_TIER_STATS).fetchone()
+    return {"hot_messages": hot, "archived_contacts": contacts, "cold_messages": cold,
+            "cold_bytes": cold_bytes, "db_bytes": os.path.getsize(repository.current_db_path())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old conversations to compressed per-contact archives.")
+    cutoff = parser.add_mutually_exclusive_group()
+    cutoff.add_argument("--before", help="archive messages older than this date (e.g. 2024-01-01)")
+    cutoff.add_argument("--older-than-days", type=float, help="archive messages older than this many days")
+    parser.add_argument("--contact", type=int, action="append", help="only this contact id (repeatable)")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink the database file")
+    parser.add_argument("--stats", action="store_true", help="only show how messages are split across tiers")
+    args = parser.parse_args()
+
+    if not args.stats:
+        if args.before:
+            cutoff_ts = to_epoch([args.before])[0]
+            if cutoff_ts is None:
+                parser.error(f"could not parse --before {args.before!r}")
+        elif args.older_than_days is not None:
+            cutoff_ts = int(time.time() - args.older_than_days * 86400)
+        else:
+            parser.error("give --before or --older-than-days (or --stats)")
+        start = time.perf_counter()
+        moved = compact(cutoff_ts, args.contact)
+        print(f"Archived {moved:,} messages in {time.perf_counter() - start:.2f}s")
+        if args.vacuum:
+            with repository.connection() as conn:
+                conn.execute("VACUUM")
+    s = tier_stats()
+    print(f"Hot: {s['hot_messages']:,} messages in SQLite ({s['db_bytes'] / 1e6:.1f} MB). "
+          f"Cold: {s['cold_messages']:,} messages for {s['archived_contacts']:,} contacts "
+          f"({s['cold_bytes'] / 1e6:.1f} MB).")
@@ -0,0 +1,50 @@
+# conftest.py
+# Shared pytest fixtures. Every test gets its own database, shard directory and
+# (through them) vector and archive directories under tmp_path; nothing touches
+# bondkeeper.db or the metrics file.
+
+import os
+import sqlite3
+
+os.environ["BONDKEEPER_METRICS_PATH"] = ""  # before tracing is imported
+
+import pytest
+
+import repository
+import schema
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the repository at a fresh database in tmp_path; returns its path."""
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(repository, "DB_PATH", path)
+    monkeypatch.setattr(repository, "SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(repository, "DEFAULT_USER", "")
+    token = repository._current_shard.set(None)
+    yield path
+    repository._current_shard.reset(token)
+    with repository._pools_lock:
+        for pool in repository._pools.values():
+            pool.close()
+        repository._pools.clear()
+
+
+def write_csv(path, rows):
+    """Write (timestamp, direction, text) rows as an export CSV; returns the path."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("timestamp,direction,text\n")
+        for timestamp, direction, text in rows:
+            f.write(f"{timestamp},{direction},{text}\n")
+    return str(path)
+
+
+def old_database(path, version):
+    """Create a database at `path` migrated only up to schema `version`; returns an open connection."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    schema.current_version(conn)
+    for number, description, step in schema.MIGRATIONS[:version]:
+        step(conn)
+        conn.execute("INSERT INTO schema_migrations(version, description, applied_at) VALUES (?,?,0)",
+                     (number, description))
+    return conn
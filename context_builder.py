@@ -0,0 +1,240 @@
+# context_builder.py
+# Token-budgeted prompt context for a contact.
+# The prompt gets as many recent turns as fit in CONTEXT_TOKEN_BUDGET, newest
+# first, plus a rolling summary of everything older. The summary lives in
+# contact_summaries and is folded forward incrementally: each call only reads
+# the messages that slid out of the recent window since the last call, so prompt
+# size and build time stay flat however long a conversation gets.
+#
+# The summary is extractive (counts, date range and a few notable messages such
+# as questions and plans), so it costs no model calls and is deterministic.
+#
+# Messages moved to the cold tier (archive.py) are merged into every read here.
+#
+# Older messages similar to the latest exchange (similarity.py) get a small
+# share of the budget of their own, so a relevant thread from months ago can
+# still reach the prompt.
+
+import json
+import os
+import re
+import time
+
+import archive
+import repository
+import similarity
+import tracing
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# never consider more than this many recent turns, whatever the budget
+MAX_RECENT_TURNS = 200
+MAX_HIGHLIGHTS = 6
+HIGHLIGHT_CHARS = 120
+FOLD_BATCH = 5000
+RELEVANT_K = 3  # older messages similar to their latest message added to the prompt
+
+INBOUND_DIRECTIONS = {"inbound", "friend", "them", "received", "in"}
+PLAN_WORDS = re.compile(r"\b(coffee|call|meet|dinner|lunch|drinks|visit|birthday|congrat\w*|sorry|"
+                        r"stress\w*|help|plan\w*|weekend|tomorrow|friday|saturday|sunday)\b", re.I)
+SQL_MESSAGES_BY_ID = "SELECT conv_id, ts, timestamp, direction, text FROM conversations WHERE conv_id IN ({})"
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def format_turn(timestamp, direction, text):
+    return f"[{timestamp}] {direction}: {(text or '').strip()}"
+
+
+def _score(text):
+    """How worth remembering a message is: questions and plans rank highest."""
+    text = text or ""
+    score = 0
+    if "?" in text:
+        score += 2
+    if PLAN_WORDS.search(text):
+        score += 2
+    if 20 <= len(text) <= 300:
+        score += 1
+    return score
+
+
+def _date(ts):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts)) if ts is not None else "?"
+
+
+def load_summary(conn, contact_id):
+    row = conn.execute("""
+        SELECT covered_ts, covered_conv_id, message_count, inbound_count,
+               first_ts, last_ts, highlights
+        FROM contact_summaries WHERE contact_id=?
+    """, (contact_id,)).fetchone()
+    if row is None:
+        return {"covered_ts": -2**63, "covered_conv_id": 0, "message_count": 0, "inbound_count": 0,
+                "first_ts": None, "last_ts": None, "highlights": []}
+    keys = ("covered_ts", "covered_conv_id", "message_count", "inbound_count", "first_ts", "last_ts")
+    summary = dict(zip(keys, row[:6]))
+    summary["highlights"] = json.loads(row[6] or "[]")
+    return summary
+
+
+def fold_into_summary(conn, contact_id, summary, until_ts, until_conv_id):
+    """Fold messages between the summary's watermark and (until_ts, until_conv_id) into it.
+
+    Only messages newer than the watermark are read, so repeated calls with an
+    unchanged window cost nothing. Returns the number of messages folded.
+    """
+    folded = 0
+    while True:
+        after = (summary["covered_ts"], summary["covered_conv_id"])
+        rows = conn.execute("""
+            SELECT conv_id, ts, timestamp, direction, text FROM conversations
+            WHERE contact_id=? AND (ts, conv_id) > (?, ?) AND (ts, conv_id) < (?, ?)
+            ORDER BY ts, conv_id LIMIT ?
+        """, (contact_id, *after, until_ts, until_conv_id, FOLD_BATCH)).fetchall()
+        rows = archive.between(conn, contact_id, rows, after, (until_ts, until_conv_id), FOLD_BATCH)
+        if not rows:
+            break
+        candidates = list(summary["highlights"])
+        for conv_id, ts, timestamp, direction, text in rows:
+            summary["message_count"] += 1
+            if (direction or "").lower() in INBOUND_DIRECTIONS:
+                summary["inbound_count"] += 1
+            if summary["first_ts"] is None:
+                summary["first_ts"] = ts
+            summary["last_ts"] = ts
+            score = _score(text)
+            if score >= 3:
+                candidates.append({"ts": ts, "score": score,
+                                   "line": format_turn(timestamp, direction, (text or "")[:HIGHLIGHT_CHARS])})
+        # keep the best highlights, preferring recent ones among equals
+        candidates.sort(key=lambda h: (h["score"], h["ts"]), reverse=True)
+        summary["highlights"] = sorted(candidates[:MAX_HIGHLIGHTS], key=lambda h: h["ts"])
+        summary["covered_ts"], summary["covered_conv_id"] = rows[-1][1], rows[-1][0]
+        folded += len(rows)
+
+    if folded:
+        conn.execute("""
+            INSERT OR REPLACE INTO contact_summaries(contact_id, covered_ts, covered_conv_id, message_count,
+                inbound_count, first_ts, last_ts, highlights, updated_at)
+            VALUES (?,?,?,?,?,?,?,?,?)
+        """, (contact_id, summary["covered_ts"], summary["covered_conv_id"], summary["message_count"],
+              summary["inbound_count"], summary["first_ts"], summary["last_ts"],
+              json.dumps(summary["highlights"]), time.time()))
+    return folded
+
+
+def render_summary(summary):
+    if not summary["message_count"]:
+        return ""
+    n, inbound = summary["message_count"], summary["inbound_count"]
+    text = (f"{n} earlier messages ({inbound} from them, {n - inbound} from you), "
+            f"{_date(summary['first_ts'])} to {_date(summary['last_ts'])}.")
+    if summary["highlights"]:
+        text += " Notable: " + " | ".join(h["line"] for h in summary["highlights"])
+    return text
+
+
+def find_relevant(conn, contact_id, recent, boundary, budget):
+    """Formatted lines for older messages similar to the latest inbound one in `recent`.
+
+    Only messages older than `boundary` (the oldest included turn) qualify, best
+    match first, without repeats and within `budget` estimated tokens; returned
+    oldest first.
+    """
+    query = next((text for _, _, _, direction, text in recent
+                  if (direction or "").lower() in INBOUND_DIRECTIONS), recent[0][4])
+    with tracing.span("similarity"):
+        hits = similarity.search(contact_id, query, k=RELEVANT_K * 3)
+    if not hits:
+        return []
+    rows = {r[0]: r for r in conn.execute(SQL_MESSAGES_BY_ID.format(",".join("?" * len(hits))),
+                                          [conv_id for conv_id, _ in hits])}
+    if len(rows) < len(hits):
+        rows.update(archive.by_ids(conn, contact_id, {conv_id for conv_id, _ in hits} - rows.keys()))
+    picked = []
+    for conv_id, _ in hits:
+        row = rows.get(conv_id)
+        if row is None or row[1] is None or (row[1], conv_id) >= boundary:
+            continue
+        line = format_turn(*row[2:])
+        if estimate_tokens(line) > budget or any(row[4] == text for *_, text in picked):
+            continue
+        budget -= estimate_tokens(line)
+        picked.append((row[1], conv_id, line, row[4]))
+        if len(picked) == RELEVANT_K:
+            break
+    tracing.annotate(context_relevant=len(picked))
+    return [line for _, _, line, _ in sorted(picked)]
+
+
+def build_context(contact_id, budget=CONTEXT_TOKEN_BUDGET):
+    """Return (name, notes, summary_text, turns, relevant) for a contact's prompt.
+
+    turns are formatted lines, oldest first; relevant are older messages similar
+    to the latest turns. Together with the summary they fit within `budget`
+    estimated tokens.
+    """
+    row = repository.get_contact(contact_id)
+    if row is None:
+        raise ValueError(f"No contact found with ID {contact_id}. Please run ingestion first.")
+    name, notes = row
+
+    with repository.connection() as conn:
+        # messages whose timestamp could not be parsed (ts NULL) sort oldest
+        recent = conn.execute("""
+            SELECT conv_id, ts, timestamp, direction, text FROM conversations
+            WHERE contact_id=?
+            ORDER BY ts DESC, conv_id DESC LIMIT ?
+        """, (contact_id, MAX_RECENT_TURNS)).fetchall()
+        recent = archive.newest(conn, contact_id, recent, MAX_RECENT_TURNS)
+
+        # the summary gets at most a quarter of the budget and relevant older
+        # messages an eighth; turns take the rest
+        summary = load_summary(conn, contact_id)
+        summary_chars = (budget // 4) * 4
+        relevant_budget = budget // 8
+        remaining = budget - budget // 4 - relevant_budget
+        turns = []
+        boundary = None
+        for conv_id, ts, timestamp, direction, text in recent:
+            line = format_turn(timestamp, direction, text)
+            cost = estimate_tokens(line)
+            if turns and cost > remaining:
+                break
+            turns.append(line)
+            remaining -= cost
+            if ts is not None:
+                # the summary and relevant messages cover what is older than the
+                # oldest dated turn; undated ones sort after all dated ones
+                boundary = (ts, conv_id)
+
+        if boundary is not None:
+            # messages older than the oldest included turn belong to the summary;
+            # a fold is idempotent, so concurrent callers need no transaction
+            with tracing.span("summary_fold"):
+                folded = fold_into_summary(conn, contact_id, summary, *boundary)
+            if folded:
+                tracing.annotate(summary_folded=folded)
+        summary_text = render_summary(summary)[:summary_chars]
+        relevant = find_relevant(conn, contact_id, recent, boundary, relevant_budget) if boundary else []
+
+    turns.reverse()
+    tracing.annotate(context_turns=len(turns))
+    return name, notes, summary_text, turns, relevant
+
+
+def build_prompt_text(name, notes, summary_text, turns, relevant=()):
+    parts = [f"Contact: {name}", f"Notes: {notes or ''}"]
+    if summary_text:
+        parts.append(f"Earlier history (summary): {summary_text}")
+    if relevant:
+        parts.append("Related earlier messages:")
+        parts.extend(relevant)
+    parts.append("Recent messages (oldest first):")
+    parts.extend(turns or ["(none)"])
+    parts.append("")
+    parts.append("Task: return JSON with short, neutral, warm, action.")
+    return "\n".join(parts)
@@ -0,0 +1,44 @@
+# fake_model.py
+# Local stand-in for the Gemini API, for batch runs, benchmarks and demos without
+# spending quota. A FakeModel is called like simple_prompt_call.call_model
+# (model_name, user_prompt) and answers with suggestion JSON after a configurable
+# latency, failing a configurable fraction of calls with a 429-style quota error.
+
+import json
+import random
+import threading
+import time
+
+
+class FakeQuotaError(Exception):
+    """Raised by FakeModel to simulate HTTP 429 / ResourceExhausted."""
+
+
+class FakeModel:
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def __call__(self, model_name, user_prompt):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            raise FakeQuotaError("429 Resource has been exhausted (e.g. check quota).")
+        first_line = user_prompt.splitlines()[0] if user_prompt else ""
+        name = first_line.replace("Contact:", "").strip() or "there"
+        return json.dumps({
+            "short": f"Hey {name} — checking in. Coffee this week?",
+            "neutral": f"Hi {name}, I know things have been busy. Happy to help break things into smaller steps if that's useful.",
+            "warm": f"{name}, I've been thinking about you. I'm here whenever you want to talk — maybe Friday evening?",
+            "action": "Propose a 30-minute check-in call.",
+        })
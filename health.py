@@ -0,0 +1,234 @@
+# health.py
+# Relationship-health scores per contact, materialised in contact_health.
+# The metrics are computed with NumPy over a contact-ordered scan of
+# conversations (no per-contact Python loops):
+#   - last_ts: the latest message either way (-> days since last contact)
+#   - unanswered_inbound: inbound messages after the last outbound one
+#   - inbound / outbound counts (-> inbound/outbound ratio)
+#   - median_reply_secs: median time from the first message of an inbound run to
+#     the outbound reply that ends it
+#
+# Ingest recomputes the contacts it touched; rebuild() recomputes everything in
+# contact batches. Archived messages (archive.py) count too; only their ts and
+# inbound columns are read. The Contacts panel pages through contact_health by
+# urgency with one indexed query (see repository.SQL_CONTACT_PREVIEWS).
+#
+# Urgency, in days, is days_since_last + bonus, where bonus grows with unanswered
+# messages, a lopsided ratio and slow replies. Only the first term depends on the
+# clock, so the stored urgency_key = bonus * 86400 - last_ts orders contacts the
+# same way at any moment and never goes stale; urgency(now) = (key + now) / 86400.
+#
+# Run:
+#   python health.py --rebuild        # recompute every contact
+#   python health.py                  # top contacts by urgency
+
+import argparse
+import time
+
+import archive
+import repository
+from context_builder import INBOUND_DIRECTIONS
+
+DAY = 86400
+UNANSWERED_WEIGHT_DAYS = 3.0     # per unanswered inbound message...
+MAX_UNANSWERED_COUNTED = 5       # ...up to this many
+RATIO_WEIGHT_DAYS = 2.0          # per unit of inbound/outbound above 1...
+MAX_RATIO_EXCESS = 3.0           # ...capped
+MAX_REPLY_LATENCY_DAYS = 7.0     # median reply latency counts day for day, capped
+REBUILD_BATCH_CONTACTS = 5000
+
+HEALTH_FIELDS = ("last_ts", "messages", "inbound", "outbound", "unanswered_inbound",
+                 "median_reply_secs", "urgency_key")
+
+SQL_MESSAGES_FOR = """
+    SELECT contact_id, ts, direction, conv_id FROM conversations
+    WHERE contact_id IN ({}) AND ts IS NOT NULL
+"""
+SQL_MESSAGES_RANGE = """
+    SELECT contact_id, ts, direction, conv_id FROM conversations
+    WHERE contact_id BETWEEN ? AND ? AND ts IS NOT NULL
+"""
+SQL_UPSERT_HEALTH = """
+    INSERT INTO contact_health(contact_id, last_ts, messages, inbound, outbound, unanswered_inbound,
+                               median_reply_secs, urgency_key, updated_at)
+    VALUES (?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(contact_id) DO UPDATE SET
+        last_ts=excluded.last_ts, messages=excluded.messages, inbound=excluded.inbound,
+        outbound=excluded.outbound, unanswered_inbound=excluded.unanswered_inbound,
+        median_reply_secs=excluded.median_reply_secs, urgency_key=excluded.urgency_key,
+        updated_at=excluded.updated_at
+"""
+SQL_STALE = "SELECT contact_id FROM contact_health WHERE updated_at IS NULL"
+SQL_TOP = """
+    SELECT h.contact_id, c.name, h.last_ts, h.messages, h.inbound, h.outbound,
+           h.unanswered_inbound, h.median_reply_secs, h.urgency_key
+    FROM contact_health h JOIN contacts c ON c.contact_id = h.contact_id
+    ORDER BY h.urgency_key DESC, h.contact_id DESC LIMIT ?
+"""
+
+
+def compute_health(contact_ids, ts, directions):
+    """Health metrics for every contact present in the (unordered) message arrays.
+
+    Returns {contact_id: {field: value}} with the HEALTH_FIELDS.
+    """
+    import numpy as np
+    import pandas as pd  # deferred like schema.to_epoch: only ingest and rebuilds need them
+
+    cids = np.asarray(contact_ids, dtype=np.int64)
+    if cids.size == 0:
+        return {}
+    ts = np.asarray(ts, dtype=np.int64)
+    inbound = pd.Series(directions, dtype=object).str.lower().isin(INBOUND_DIRECTIONS).to_numpy()
+
+    order = np.lexsort((ts, cids))
+    cids, ts, inbound = cids[order], ts[order], inbound[order]
+    n = cids.size
+    idx = np.arange(n)
+
+    starts = np.flatnonzero(np.r_[True, cids[1:] != cids[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    sizes = ends - starts + 1
+    group_start = np.repeat(starts, sizes)  # start of each row's contact
+
+    # position of the latest outbound message at or before each row (-1 if none)
+    last_out = np.maximum.accumulate(np.where(inbound, -1, idx))
+    last_out_in_group = np.where(last_out >= group_start, last_out, -1)
+
+    n_inbound = np.add.reduceat(inbound.astype(np.int64), starts)
+    tail_out = last_out_in_group[ends]
+    unanswered = np.where(tail_out < 0, sizes, ends - tail_out)
+
+    # an outbound row right after an inbound one (same contact) replies to the run
+    # of inbound messages that began just after the previous outbound
+    replies = np.flatnonzero(~inbound[1:] & inbound[:-1] & (cids[1:] == cids[:-1])) + 1
+    run_start = np.maximum(last_out_in_group[replies - 1] + 1, group_start[replies])
+    latency = pd.Series(ts[replies] - ts[run_start], dtype="float64")
+    median_latency = latency.groupby(cids[replies]).median()
+
+    out = {}
+    for i, cid in enumerate(cids[starts].tolist()):
+        inb, total = int(n_inbound[i]), int(sizes[i])
+        outb = total - inb
+        median = median_latency.get(cid)
+        median = None if median is None or np.isnan(median) else float(median)
+        metrics = {
+            "last_ts": int(ts[ends[i]]),
+            "messages": total,
+            "inbound": inb,
+            "outbound": outb,
+            "unanswered_inbound": int(unanswered[i]),
+            "median_reply_secs": median,
+        }
+        metrics["urgency_key"] = urgency_bonus(metrics) * DAY - metrics["last_ts"]
+        out[cid] = metrics
+    return out
+
+
+def urgency_bonus(metrics):
+    """The clock-independent part of urgency, in days."""
+    bonus = UNANSWERED_WEIGHT_DAYS * min(metrics["unanswered_inbound"], MAX_UNANSWERED_COUNTED)
+    ratio = inbound_ratio(metrics)
+    if ratio is not None:
+        bonus += RATIO_WEIGHT_DAYS * min(max(ratio - 1, 0.0), MAX_RATIO_EXCESS)
+    elif metrics["inbound"]:
+        bonus += RATIO_WEIGHT_DAYS * MAX_RATIO_EXCESS  # they write, we never have
+    if metrics["median_reply_secs"] is not None:
+        bonus += min(metrics["median_reply_secs"] / DAY, MAX_REPLY_LATENCY_DAYS)
+    return bonus
+
+
+def inbound_ratio(metrics):
+    return metrics["inbound"] / metrics["outbound"] if metrics["outbound"] else None
+
+
+def urgency(urgency_key, now=None):
+    """Urgency in days for a stored urgency_key (None for contacts without messages)."""
+    if urgency_key is None:
+        return None
+    return (urgency_key + (now if now is not None else time.time())) / DAY
+
+
+def _write(conn, contact_ids, computed):
+    now = time.time()
+    empty = dict.fromkeys(HEALTH_FIELDS)
+    conn.executemany(SQL_UPSERT_HEALTH, [
+        (cid, *(computed.get(cid, empty)[f] for f in HEALTH_FIELDS), now) for cid in contact_ids
+    ])
+
+
+def _with_archived(conn, contact_ids, rows):
+    """(contact_ids, ts, directions) of the hot `rows` plus the contacts' archived messages."""
+    import numpy as np
+
+    cids, ts, directions, conv_ids = zip(*rows) if rows else ((), (), (), ())
+    cold_cids, cold_ts, cold_inbound, cold_conv_ids = archive.message_arrays(conn, contact_ids)
+    # in conv_id order, so messages sharing a timestamp are ordered the same way
+    # whichever tier they are in and whatever index the query used
+    order = np.argsort(np.concatenate([np.asarray(conv_ids, dtype=np.int64), cold_conv_ids]), kind="stable")
+    return (np.concatenate([np.asarray(cids, dtype=np.int64), cold_cids])[order],
+            np.concatenate([np.asarray(ts, dtype=np.int64), cold_ts])[order],
+            np.asarray(list(directions) + np.where(cold_inbound, "inbound", "outbound").tolist(),
+                       dtype=object)[order])
+
+
+def update_contacts(conn, contact_ids):
+    """Recompute health for `contact_ids` on `conn` (inside the caller's transaction)."""
+    contact_ids = sorted(set(contact_ids))
+    if not contact_ids:
+        return
+    rows = conn.execute(SQL_MESSAGES_FOR.format(",".join("?" * len(contact_ids))), contact_ids).fetchall()
+    _write(conn, contact_ids, compute_health(*_with_archived(conn, contact_ids, rows)))
+
+
+def rebuild(batch_contacts=REBUILD_BATCH_CONTACTS, progress=print):
+    """Recompute every contact, one transaction per batch of contact ids."""
+    with repository.connection() as conn:
+        ids = [r[0] for r in conn.execute("SELECT contact_id FROM contacts ORDER BY contact_id")]
+        for i in range(0, len(ids), batch_contacts):
+            batch = ids[i:i + batch_contacts]
+            with repository.transaction_on(conn):
+                rows = conn.execute(SQL_MESSAGES_RANGE, (batch[0], batch[-1])).fetchall()
+                _write(conn, batch, compute_health(*_with_archived(conn, batch, rows)))
+                repository.bump_data_version(conn)
+            if progress:
+                progress(f"  {min(i + batch_contacts, len(ids)):,}/{len(ids):,} contacts")
+    return len(ids)
+
+
+def refresh_stale():
+    """Fill in rows that were created empty (new contacts, or the migration). Returns how many."""
+    with repository.connection() as conn:
+        stale = [r[0] for r in conn.execute(SQL_STALE)]
+        if stale:
+            with repository.transaction_on(conn):
+                update_contacts(conn, stale)
+                repository.bump_data_version(conn)
+    return len(stale)
+
+
+def top_contacts(limit=10):
+    with repository.connection() as conn:
+        return conn.execute(SQL_TOP, (limit,)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relationship-health scores.")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every contact")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        count = rebuild()
+        print(f"Recomputed {count} contacts in {time.perf_counter() - start:.2f}s")
+    else:
+        refresh_stale()
+    now = time.time()
+    for cid, name, last_ts, messages, inb, outb, unanswered, median, key in top_contacts(args.limit):
+        if key is None:
+            print(f"{name} (id={cid}): no messages")
+            continue
+        reply = f"{median / 3600:.1f}h" if median is not None else "n/a"
+        print(f"{name} (id={cid}): urgency {urgency(key, now):.1f} · {(now - last_ts) / DAY:.0f}d since last · "
+              f"{unanswered} unanswered · {inb}/{outb} in/out · median reply {reply}")
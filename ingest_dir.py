@@ -0,0 +1,216 @@
+# ingest_dir.py
+# Import a whole directory of exports (one CSV or gzip'd CSV per contact).
+# Files are parsed and normalised (timestamps, content hashes) in a process pool;
+# the parsed chunks travel through a bounded queue to this process, which is the
+# only one writing to SQLite. Parsing scales with cores, the database never sees
+# two writers, and the queue bound keeps memory flat when parsing outruns writes.
+#
+#   python ingest_dir.py exports/ --workers 4
+#   python ingest_dir.py exports/ravi_kumar.csv.gz
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import health
+import repository
+import similarity
+import simple_ingest
+import tracing
+
+EXTENSIONS = (".csv", ".csv.gz")
+# parsed chunks allowed in flight per worker before parsers block on the queue
+QUEUE_CHUNKS_PER_WORKER = 2
+POLL_SECONDS = 0.5
+
+# set in each worker by _init_worker
+_queue = None
+_stop = None
+
+
+def discover_files(path):
+    """All importable files under `path` (or `path` itself), sorted for a stable order."""
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def contact_name_for(path):
+    """Contact name from the file name: exports/ravi_kumar.csv.gz -> "ravi kumar"."""
+    name = os.path.basename(path)
+    for ext in sorted(EXTENSIONS, key=len, reverse=True):
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+            break
+    return " ".join(name.replace("_", " ").split()) or name
+
+
+def _init_worker(out_queue, stop):
+    global _queue, _stop
+    _queue, _stop = out_queue, stop
+    # Ctrl-C is handled by the writer, which tells workers to stop via `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parse_file(path, chunksize):
+    """Worker: parse `path` chunk by chunk onto the queue, then report done/failed."""
+    rows = 0
+    seen = {}  # repeated-message counts across the file's chunks
+    try:
+        for chunk in simple_ingest.iter_chunks(path, chunksize):
+            if _stop.is_set():
+                _queue.put(("failed", path, rows, "cancelled"))
+                return
+            batch = simple_ingest.normalize_chunk(chunk, seen)
+            _queue.put(("rows", path, len(batch), batch))
+            rows += len(batch)
+    except Exception as e:
+        _queue.put(("failed", path, rows, f"{type(e).__name__}: {e}"))
+        return
+    _queue.put(("done", path, rows, None))
+
+
+class FileResult:
+    def __init__(self, path):
+        self.path = path
+        self.contact = contact_name_for(path)
+        self.contact_id = None
+        self.rows = 0
+        self.inserted = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def as_dict(self):
+        return {"path": self.path, "contact": self.contact, "contact_id": self.contact_id,
+                "rows": self.rows, "inserted": self.inserted, "skipped": self.rows - self.inserted,
+                "error": self.error, "seconds": self.elapsed}
+
+
+def _report(result, n_done, n_files):
+    prefix = f"[{n_done}/{n_files}] {result.path}"
+    if result.error:
+        print(f"{prefix} FAILED after {result.rows} rows ({result.inserted} written): {result.error}")
+    else:
+        print(f"{prefix} -> {result.contact} (ID={result.contact_id}): {result.inserted} new, "
+              f"{result.rows - result.inserted} skipped in {result.elapsed:.2f}s")
+
+
+def ingest_paths(paths, workers=None, chunksize=simple_ingest.CHUNK_SIZE, queue_size=None):
+    """Parse `paths` in a process pool and write them from this process.
+
+    Returns one dict per file (see FileResult.as_dict), in completion order. A file
+    that fails part-way keeps the chunks already written; re-running is safe since
+    re-imported messages are skipped.
+    """
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * QUEUE_CHUNKS_PER_WORKER
+    ctx = mp.get_context()
+    out_queue = ctx.Queue(maxsize=queue_size)
+    stop = ctx.Event()
+    results = {path: FileResult(path) for path in paths}
+    finished = []
+
+    def finish(result, error=None):
+        result.error = result.error or error
+        if result.contact_id is not None:
+            # once per file, after its last chunk (also for files that failed part-way)
+            with repository.transaction_on(conn):
+                health.update_contacts(conn, [result.contact_id])
+            if result.inserted:
+                similarity.index_contact(conn, result.contact_id)
+        result.elapsed = time.perf_counter() - result.started
+        finished.append(result)
+        _report(result, len(finished), len(paths))
+
+    with tracing.trace("ingest_dir", files=len(paths), workers=workers):
+        start = time.perf_counter()
+        with repository.connection() as conn, \
+                ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                    initargs=(out_queue, stop)) as pool:
+            futures = {pool.submit(parse_file, path, chunksize): path for path in paths}
+            try:
+                while len(finished) < len(paths):
+                    try:
+                        kind, path, rows, payload = out_queue.get(timeout=POLL_SECONDS)
+                    except queue.Empty:
+                        # a worker that died (killed, out of memory) never reports back
+                        for future, path in futures.items():
+                            result = results[path]
+                            if future.done() and future.exception() and result.elapsed is None:
+                                finish(result, f"worker crashed: {future.exception()!r}")
+                        continue
+                    result = results[path]
+                    if result.elapsed is not None:
+                        continue
+                    if kind == "rows":
+                        try:
+                            if result.contact_id is None:
+                                with repository.transaction_on(conn):
+                                    result.contact_id, created = repository.resolve_contact(conn, result.contact)
+                                    if created:
+                                        repository.bump_data_version(conn)
+                            result.inserted += simple_ingest.write_chunk(conn, result.contact_id, payload)
+                            result.rows += rows
+                        except Exception as e:
+                            finish(result, f"write failed: {type(e).__name__}: {e}")
+                    elif kind == "done":
+                        if result.contact_id is None:
+                            # empty file: still make sure the contact exists
+                            with repository.transaction_on(conn):
+                                result.contact_id, _ = repository.resolve_contact(conn, result.contact)
+                        finish(result)
+                    else:
+                        finish(result, payload)
+            except KeyboardInterrupt:
+                print("Interrupted: stopping workers...")
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                # keep draining so workers blocked on a full queue can see `stop` and exit
+                while not all(f.done() for f in futures):
+                    try:
+                        out_queue.get(timeout=POLL_SECONDS)
+                    except queue.Empty:
+                        pass
+                for result in results.values():
+                    if result.elapsed is None:
+                        finish(result, "cancelled")
+
+        elapsed = time.perf_counter() - start
+        rows = sum(r.rows for r in finished)
+        failed = sum(1 for r in finished if r.error)
+        rate = rows / elapsed if elapsed > 0 else float("inf")
+        tracing.annotate(rows=rows, inserted=sum(r.inserted for r in finished), failed=failed,
+                         rows_per_sec=rate)
+    print(f"{len(paths) - failed}/{len(paths)} files imported, {rows:,} rows in {elapsed:.2f}s "
+          f"({rate:,.0f} rows/sec)")
+    return [r.as_dict() for r in finished]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import every CSV / CSV.gz under a path, one contact per file.")
+    parser.add_argument("path", help="directory to scan recursively, or a single file")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=simple_ingest.CHUNK_SIZE, help="rows per chunk / transaction")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help=f"parsed chunks buffered for the writer (default: {QUEUE_CHUNKS_PER_WORKER} per worker)")
+    args = parser.parse_args()
+
+    paths = discover_files(args.path)
+    if not paths:
+        parser.error(f"no {' / '.join(EXTENSIONS)} files found under {args.path}")
+    simple_ingest.init_db()
+    print(f"Importing {len(paths)} files with {args.workers or os.cpu_count()} workers...")
+    summary = ingest_paths(paths, workers=args.workers, chunksize=args.chunksize, queue_size=args.queue_size)
+    raise SystemExit(1 if any(r["error"] for r in summary) else 0)
@@ -0,0 +1,129 @@
+# model_catalog.py
+# Disk cache for Gemini model discovery.
+# genai.list_models() is a network round trip, and the answer changes rarely, so
+# the discovered catalog and the model we picked from it are kept in a small JSON
+# file with a TTL. Fresh entries are used as-is; stale ones are still returned
+# immediately while a background thread refreshes them; and if discovery fails,
+# the last known-good choice is used instead of falling back to mock output.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_PATH = os.getenv("BONDKEEPER_MODEL_CACHE", ".bondkeeper_model_cache.json")
+CACHE_TTL_SECONDS = int(os.getenv("MODEL_CACHE_TTL", str(6 * 3600)))
+
+_refresh_lock = threading.Lock()
+_refreshing = False
+# the last entry this process saved: still used if the file cannot be written
+_saved = None
+
+
+def fingerprint(api_key, preferences):
+    """Identify the account + preference list a cached choice was made for."""
+    raw = (api_key or "") + "\n" + "\n".join(preferences)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_cache(path=CACHE_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        entry = None
+    if _saved is not None and (entry is None or _saved.get("fetched_at", 0) > entry.get("fetched_at", 0)):
+        return _saved
+    return entry
+
+
+def save_cache(entry, path=CACHE_PATH):
+    """Store `entry` on disk; if that fails (read-only dir, disk full) keep it in memory only."""
+    global _saved
+    _saved = entry
+    # write-then-rename so a concurrent reader never sees a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _discover(discover, choose, key):
+    """Run discovery; store and return the choice, or None if discovery failed."""
+    available = discover()
+    if not available:
+        return None
+    chosen = choose(available)
+    if chosen:
+        save_cache({
+            "fingerprint": key,
+            "fetched_at": time.time(),
+            "models": available,
+            "chosen": chosen,
+        })
+    return chosen
+
+
+def _refresh_in_background(discover, choose, key):
+    global _refreshing
+    with _refresh_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+
+    def run():
+        global _refreshing
+        try:
+            _discover(discover, choose, key)
+        except Exception:
+            pass  # keep serving the cached choice; next stale read retries
+        finally:
+            with _refresh_lock:
+                _refreshing = False
+
+    threading.Thread(target=run, name="model-catalog-refresh", daemon=True).start()
+
+
+def cached_models(key):
+    """The model list from the last discovery for `key`, or [] if there is none."""
+    entry = load_cache()
+    if not entry or entry.get("fingerprint") != key:
+        return []
+    return entry.get("models") or []
+
+
+def cached_model(discover, choose, key, ttl=CACHE_TTL_SECONDS):
+    """Return the model to use, calling discover() only when the cache requires it.
+
+    discover() returns the list of available model names (empty on failure) and
+    choose(names) picks one of them. `key` is a fingerprint() of the account and
+    preferences; a cache written for a different key is ignored.
+    """
+    entry = load_cache()
+    if entry and entry.get("fingerprint") != key:
+        entry = None
+
+    if entry and entry.get("chosen"):
+        if time.time() - entry.get("fetched_at", 0) > ttl:
+            _refresh_in_background(discover, choose, key)
+        return entry["chosen"]
+
+    chosen = _discover(discover, choose, key)
+    if chosen:
+        return chosen
+    # Discovery failed. The last known-good choice (even one made for an older key or
+    # preference list) is a better bet than mock output; the call site still falls
+    # back to mock if the model then rejects the request.
+    stale = load_cache()
+    return stale.get("chosen") if stale else None
@@ -0,0 +1,181 @@
+# model_router.py
+# Picks the model for each generation from measured behaviour instead of a fixed
+# priority list. Every API call records its latency and outcome (ok / quota /
+# error) in model_calls. route() then:
+#   - sends short prompts (<= SHORT_PROMPT_TOKENS) to the flash tier first and
+#     longer ones to the pro tier first, where the warm/neutral quality matters;
+#   - moves models that are currently unhealthy (recent 429s, high quota-error
+#     rate or p95 latency over the SLO in the rolling window) to the back;
+#   - returns the remaining models in order as the failover chain the caller
+#     walks when a call hits a quota error.
+# The decision (tier, reason, per-model stats) is attached to the generation's
+# trace and to SuggestionResult.route.
+#
+# Quotas and latency belong to the API key, not to a user, so model_calls always
+# lives in the default database (DB_PATH), whichever shard a request runs in.
+#
+# Run:
+#   python model_router.py                    # rolling stats per model
+#   python model_router.py --prompt-tokens 80 # plus the route such a prompt gets
+
+import argparse
+import os
+import time
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+
+import repository
+
+load_dotenv()
+
+SHORT_PROMPT_TOKENS = int(os.getenv("ROUTER_SHORT_PROMPT_TOKENS", "400"))
+WINDOW_CALLS = 100            # rolling window per model: at most this many calls...
+WINDOW_SECONDS = 15 * 60      # ...from this far back, so a sidelined model is retried later
+RETENTION_SECONDS = 24 * 3600
+QUOTA_COOLDOWN_SECONDS = 60   # a 429 this recent takes the model out of rotation
+MAX_QUOTA_RATE = 0.2          # share of quota errors in the window that marks a model unhealthy
+MIN_CALLS_FOR_RATE = 5
+LATENCY_SLO_P95_MS = float(os.getenv("ROUTER_P95_SLO_MS", "20000"))
+MAX_FAILOVERS = 2
+
+SQL_RECORD = "INSERT INTO model_calls(model, ts, latency_ms, outcome) VALUES (?,?,?,?)"
+SQL_PRUNE = "DELETE FROM model_calls WHERE ts < ?"
+SQL_WINDOW = """
+    SELECT ts, latency_ms, outcome FROM model_calls
+    WHERE model=? AND ts >= ? ORDER BY ts DESC LIMIT ?
+"""
+SQL_MODELS = "SELECT DISTINCT model FROM model_calls"
+
+
+def _pool():
+    """The shared database's pool (see the note on shards above)."""
+    return repository.get_pool(repository.DB_PATH)
+
+
+def tier_of(model_name):
+    return "flash" if "flash" in (model_name or "").lower() else "pro"
+
+
+def record(model_name, latency_ms, outcome):
+    """Store one call's latency and outcome ("ok", "quota" or "error")."""
+    now = time.time()
+    with _pool().transaction() as conn:
+        conn.execute(SQL_RECORD, (model_name, now, latency_ms, outcome))
+        conn.execute(SQL_PRUNE, (now - RETENTION_SECONDS,))
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def model_stats(conn, model_name, now=None):
+    """Rolling stats for a model over its last WINDOW_CALLS calls within WINDOW_SECONDS."""
+    now = now or time.time()
+    rows = conn.execute(SQL_WINDOW, (model_name, now - WINDOW_SECONDS, WINDOW_CALLS)).fetchall()
+    latencies = sorted(latency for _, latency, outcome in rows if outcome == "ok")
+    quota = [ts for ts, _, outcome in rows if outcome == "quota"]
+    errors = sum(1 for _, _, outcome in rows if outcome == "error")
+    return {
+        "calls": len(rows),
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "quota_rate": len(quota) / len(rows) if rows else 0.0,
+        "error_rate": errors / len(rows) if rows else 0.0,
+        "last_quota_age_s": now - max(quota) if quota else None,
+    }
+
+
+def unhealthy_reason(stats):
+    """Why a model should not be first choice right now, or None if it is healthy."""
+    if stats["last_quota_age_s"] is not None and stats["last_quota_age_s"] < QUOTA_COOLDOWN_SECONDS:
+        return "recent_quota_error"
+    if stats["calls"] >= MIN_CALLS_FOR_RATE and stats["quota_rate"] > MAX_QUOTA_RATE:
+        return "quota_rate"
+    if stats["p95_ms"] is not None and stats["p95_ms"] > LATENCY_SLO_P95_MS:
+        return "slow_p95"
+    return None
+
+
+@dataclass
+class Route:
+    model: str
+    tier: str
+    reason: str
+    prompt_tokens: int
+    failover: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+    @property
+    def chain(self):
+        """The chosen model followed by at most MAX_FAILOVERS fallbacks."""
+        return [self.model] + self.failover[:MAX_FAILOVERS]
+
+    def as_dict(self):
+        return {"model": self.model, "tier": self.tier, "reason": self.reason,
+                "prompt_tokens": self.prompt_tokens, "failover": self.failover[:MAX_FAILOVERS],
+                "stats": self.stats}
+
+
+def route(prompt_tokens, candidates):
+    """Choose among `candidates` (available models, best first) for a prompt of this size.
+
+    Returns a Route, or None if there are no candidates.
+    """
+    if not candidates:
+        return None
+    want = "flash" if prompt_tokens <= SHORT_PROMPT_TOKENS else "pro"
+    now = time.time()
+    with _pool().connection() as conn:
+        stats = {m: model_stats(conn, m, now) for m in candidates}
+    health = {m: unhealthy_reason(stats[m]) for m in candidates}
+    # healthy before unhealthy, wanted tier before the other, then the given preference
+    ordered = sorted(candidates, key=lambda m: (health[m] is not None, tier_of(m) != want,
+                                                candidates.index(m)))
+    chosen = ordered[0]
+    if health[chosen]:
+        reason = f"all_unhealthy:{health[chosen]}"
+    elif tier_of(chosen) == want:
+        reason = "short_prompt" if want == "flash" else "long_prompt"
+    else:
+        reason = f"no_healthy_{want}"
+    skipped = {m: health[m] for m in candidates if health[m]}
+    if skipped:
+        reason += " skipped=" + ",".join(f"{m}:{why}" for m, why in skipped.items())
+    return Route(model=chosen, tier=tier_of(chosen), reason=reason, prompt_tokens=prompt_tokens,
+                 failover=ordered[1:], stats={m: stats[m] for m in ordered[:MAX_FAILOVERS + 1]})
+
+
+def _ms(value):
+    return f"{value:.0f}ms" if value is not None else "n/a"
+
+
+def all_stats():
+    with _pool().connection() as conn:
+        models = [r[0] for r in conn.execute(SQL_MODELS)]
+        return {m: model_stats(conn, m) for m in sorted(models)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show model router stats and decisions.")
+    parser.add_argument("--prompt-tokens", type=int, help="show the route for a prompt of this size")
+    parser.add_argument("--models", help="comma-separated candidates (default: models with recorded calls)")
+    args = parser.parse_args()
+
+    stats = all_stats()
+    if not stats:
+        print("No calls recorded yet.")
+    for model, s in stats.items():
+        print(f"{model:40s} {tier_of(model):5s} calls={s['calls']:<4d} p50={_ms(s['p50_ms'])} "
+              f"p95={_ms(s['p95_ms'])} quota={s['quota_rate']:.0%} errors={s['error_rate']:.0%} "
+              f"{unhealthy_reason(s) or 'healthy'}")
+    if args.prompt_tokens is not None:
+        candidates = args.models.split(",") if args.models else list(stats)
+        decision = route(args.prompt_tokens, candidates)
+        if decision is None:
+            print("No candidate models.")
+        else:
+            print(f"\n{args.prompt_tokens} tokens -> {decision.model} ({decision.reason}); "
+                  f"failover: {', '.join(decision.failover[:MAX_FAILOVERS]) or 'none'}")
@@ -0,0 +1,237 @@
+# precompute.py
+# Background worker that generates suggestions before anyone asks for them.
+# It watches contact_health for contacts with unanswered inbound messages whose
+# ready suggestion is missing or older than their latest message, queues a job
+# per contact in the jobs table, and works the queue:
+#   - a job is claimed with a lease (lease_owner / lease_expires); a worker that
+#     dies mid-job simply lets the lease expire and another worker reclaims it
+#   - failures are retried with jittered exponential backoff, up to MAX_ATTEMPTS
+#   - the result lands in ready_suggestions, stamped with the contact's
+#     (messages, last_ts) so readers can tell whether it is still current
+# The Streamlit app shows a current ready suggestion instantly and only generates
+# live on a miss. Several workers can share one database.
+#
+# A worker serves the current database (BONDKEEPER_USER's shard, or BONDKEEPER_DB);
+# with --all-shards it serves the default database and every workspace shard,
+# looking for new shards on each cycle.
+#
+# Run:
+#   python precompute.py                 # poll forever
+#   python precompute.py --once          # scan + drain the queue, then exit
+#   python precompute.py --all-shards    # every user / workspace database
+#   python precompute.py --fake          # local fake model, no API calls
+
+import argparse
+import json
+import os
+import socket
+import time
+
+import repository
+import simple_prompt_call as spc
+from batch_generate import backoff_delay
+
+JOB_KIND = "suggest"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 4
+POLL_SECONDS = float(os.getenv("PRECOMPUTE_POLL_SECONDS", "10"))
+SCAN_LIMIT = 100          # contacts queued per scan, most urgent first
+DONE_RETENTION_SECONDS = 24 * 3600
+FAILED_COOLDOWN_SECONDS = 3600  # a contact whose job gave up is not re-queued before this
+
+# contacts waiting on a reply whose ready suggestion is missing or out of date, and
+# that are not being worked on (or recently given up on) already
+SQL_NEEDS_SUGGESTION = """
+    SELECT h.contact_id FROM contact_health h
+    LEFT JOIN ready_suggestions r ON r.contact_id = h.contact_id
+    WHERE h.unanswered_inbound > 0
+      AND (r.contact_id IS NULL OR r.messages IS NOT h.messages OR r.last_ts IS NOT h.last_ts)
+      AND NOT EXISTS (
+          SELECT 1 FROM jobs j WHERE j.kind = ?1 AND j.contact_id = h.contact_id
+          AND (j.status = 'running' OR (j.status = 'failed' AND j.updated_at > ?2)))
+    ORDER BY h.urgency_key DESC LIMIT ?3
+"""
+# at most one queued job per (kind, contact) thanks to the partial unique index
+SQL_ENQUEUE = """
+    INSERT OR IGNORE INTO jobs(kind, contact_id, status, attempts, run_after, created_at, updated_at)
+    VALUES (?, ?, 'queued', 0, ?, ?, ?)
+"""
+SQL_NEXT_JOB = """
+    SELECT job_id, contact_id, attempts FROM jobs
+    WHERE kind = ?1 AND ((status = 'queued' AND run_after <= ?2) OR (status = 'running' AND lease_expires < ?2))
+    ORDER BY run_after LIMIT 1
+"""
+SQL_CLAIM = """
+    UPDATE jobs SET status='running', attempts=attempts + 1, lease_owner=?, lease_expires=?, updated_at=?
+    WHERE job_id=?
+"""
+SQL_DONE = "UPDATE jobs SET status='done', last_error=NULL, updated_at=? WHERE job_id=? AND lease_owner=?"
+# OR REPLACE: if the contact was queued again meanwhile, this retry takes its place
+SQL_RETRY = """
+    UPDATE OR REPLACE jobs SET status='queued', run_after=?, last_error=?, lease_owner=NULL,
+                               lease_expires=NULL, updated_at=?
+    WHERE job_id=? AND lease_owner=?
+"""
+SQL_FAIL = "UPDATE jobs SET status='failed', last_error=?, updated_at=? WHERE job_id=? AND lease_owner=?"
+SQL_PRUNE = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?"
+SQL_HEALTH_STAMP = "SELECT messages, last_ts FROM contact_health WHERE contact_id=?"
+SQL_STORE_READY = """
+    INSERT INTO ready_suggestions(contact_id, messages, last_ts, model, result, created_at)
+    VALUES (?,?,?,?,?,?)
+    ON CONFLICT(contact_id) DO UPDATE SET messages=excluded.messages, last_ts=excluded.last_ts,
+        model=excluded.model, result=excluded.result, created_at=excluded.created_at
+"""
+SQL_GET_READY = """
+    SELECT r.model, r.result FROM ready_suggestions r
+    JOIN contact_health h ON h.contact_id = r.contact_id
+    WHERE r.contact_id = ? AND r.messages IS h.messages AND r.last_ts IS h.last_ts
+"""
+SQL_QUEUE_COUNTS = "SELECT status, COUNT(*) FROM jobs WHERE kind=? GROUP BY status"
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def scan(limit=SCAN_LIMIT):
+    """Queue a job for each contact that needs a fresh suggestion. Returns how many were added."""
+    now = time.time()
+    with repository.transaction() as conn:
+        ids = [r[0] for r in conn.execute(SQL_NEEDS_SUGGESTION,
+                                          (JOB_KIND, now - FAILED_COOLDOWN_SECONDS, limit))]
+        return conn.executemany(SQL_ENQUEUE, [(JOB_KIND, cid, now, now, now) for cid in ids]).rowcount
+
+
+def claim(owner, lease_seconds=LEASE_SECONDS):
+    """Lease the next due job; returns (job_id, contact_id, attempt) or None."""
+    now = time.time()
+    with repository.transaction() as conn:
+        row = conn.execute(SQL_NEXT_JOB, (JOB_KIND, now)).fetchone()
+        if row is None:
+            return None
+        job_id, contact_id, attempts = row
+        conn.execute(SQL_CLAIM, (owner, now + lease_seconds, now, job_id))
+    return job_id, contact_id, attempts + 1
+
+
+def generate(contact_id, call=None, model_name=None):
+    """Generate suggestions and return the SuggestionResult; raises unless a real answer came back."""
+    result = spc.get_suggestions(contact_id, use_mock=False, call=call, model_name=model_name)
+    if result.source not in ("model", "cache"):
+        raise RuntimeError(f"no usable suggestion ({result.fallback_reason or result.source}): "
+                           f"{result.error or ''}".strip())
+    return result
+
+
+def complete(job_id, owner, contact_id, result, stamp):
+    """Store the ready suggestion and close the job (no-op if our lease was lost)."""
+    now = time.time()
+    with repository.transaction() as conn:
+        if conn.execute(SQL_DONE, (now, job_id, owner)).rowcount != 1:
+            return False
+        messages, last_ts = stamp
+        conn.execute(SQL_STORE_READY, (contact_id, messages, last_ts, result.model,
+                                       json.dumps(result.as_dict()), now))
+    return True
+
+
+def fail(job_id, owner, attempt, error, max_attempts=MAX_ATTEMPTS):
+    """Requeue with backoff, or mark failed after the last attempt. Returns True if retried."""
+    now = time.time()
+    with repository.transaction() as conn:
+        if attempt < max_attempts:
+            conn.execute(SQL_RETRY, (now + backoff_delay(attempt - 1), error, now, job_id, owner))
+            return True
+        conn.execute(SQL_FAIL, (error, now, job_id, owner))
+        return False
+
+
+def run_one(owner, call=None, model_name=None, progress=print):
+    """Claim and run a single job. Returns False when the queue has nothing due."""
+    job = claim(owner)
+    if job is None:
+        return False
+    job_id, contact_id, attempt = job
+    # stamp before generating: messages that arrive meanwhile make the result stale
+    with repository.connection() as conn:
+        stamp = conn.execute(SQL_HEALTH_STAMP, (contact_id,)).fetchone() or (None, None)
+    try:
+        result = generate(contact_id, call, model_name)
+    except Exception as e:
+        retried = fail(job_id, owner, attempt, str(e))
+        progress(f"  contact {contact_id}: attempt {attempt} failed ({e})"
+                 + ("; will retry" if retried else "; giving up"))
+        return True
+    if complete(job_id, owner, contact_id, result, stamp):
+        progress(f"  contact {contact_id}: ready ({result.model}, {result.source})")
+    return True
+
+
+def run_cycle(owner, call=None, model_name=None, progress=print):
+    """Scan and drain the current database's queue once. Returns how many jobs ran."""
+    added = scan()
+    if added:
+        progress(f"Queued {added} contacts in {repository.current_db_path()}")
+    ran = 0
+    while run_one(owner, call, model_name, progress):
+        ran += 1
+    with repository.transaction() as conn:
+        conn.execute(SQL_PRUNE, (time.time() - DONE_RETENTION_SECONDS,))
+    return ran
+
+
+def run_worker(once=False, poll=POLL_SECONDS, call=None, model_name=None, progress=print, all_shards=False):
+    """Scan and drain the queue, then sleep `poll` seconds and repeat (or return if `once`).
+
+    With `all_shards`, every cycle visits repository.all_db_paths() in turn.
+    """
+    owner = worker_id()
+    progress(f"Precompute worker {owner} started")
+    while True:
+        ran = 0
+        for path in repository.all_db_paths() if all_shards else [repository.current_db_path()]:
+            with repository.use_db_path(path):
+                ran += run_cycle(owner, call, model_name, progress)
+        if once:
+            return ran
+        time.sleep(poll)
+
+
+def get_ready(contact_id):
+    """The precomputed SuggestionResult for a contact if it is still current, else None."""
+    with repository.connection() as conn:
+        row = conn.execute(SQL_GET_READY, (contact_id,)).fetchone()
+    if row is None:
+        return None
+    model, result = row
+    return spc.SuggestionResult.from_dict(json.loads(result), model=model, source="precomputed")
+
+
+def queue_counts():
+    with repository.connection() as conn:
+        return dict(conn.execute(SQL_QUEUE_COUNTS, (JOB_KIND,)).fetchall())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute suggestions for contacts awaiting a reply.")
+    parser.add_argument("--once", action="store_true", help="scan and drain the queue once, then exit")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between scans")
+    parser.add_argument("--all-shards", action="store_true",
+                        help="serve the default database and every user / workspace shard")
+    parser.add_argument("--fake", action="store_true", help="use the local fake model instead of Gemini")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    call = model_name = None
+    if args.fake:
+        from fake_model import FakeModel
+        call = FakeModel(latency=args.fake_latency, error_rate=args.fake_error_rate)
+        model_name = "fake/bondkeeper-fake"
+    try:
+        run_worker(once=args.once, poll=args.poll, call=call, model_name=model_name, all_shards=args.all_shards)
+    except KeyboardInterrupt:
+        print("Stopped. A job in progress is picked up again when its lease expires.")
+    for path in repository.all_db_paths() if args.all_shards else [repository.current_db_path()]:
+        with repository.use_db_path(path):
+            print(f"Queue ({path}): {queue_counts()}")
@@ -0,0 +1,452 @@
+# repository.py
+# Shared data-access layer for bondkeeper.db.
+# All modules (CLI scripts and the Streamlit app) get their connections from here
+# instead of calling sqlite3.connect themselves. Connections are created once,
+# configured with the pragmas below, migrated to the latest schema, and then
+# reused from a small pool, so per-request setup cost goes away and concurrent
+# readers/writers wait on busy_timeout instead of failing with "database is locked".
+#
+# Sharding: each user or workspace can have its own database file (shard_path),
+# so one user's large import never holds the write lock another user is waiting
+# on. The shard in use is per context (use_shard / set_shard, or BONDKEEPER_USER
+# for CLI scripts); everything that calls connection()/transaction() follows it.
+# Pools for recently used shards stay open, at most MAX_OPEN_SHARDS of them.
+
+import contextvars
+import glob
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import archive
+from schema import contact_key, migrate
+
+load_dotenv()
+
+DB_PATH = os.getenv("BONDKEEPER_DB", "bondkeeper.db")
+POOL_SIZE = int(os.getenv("BONDKEEPER_POOL_SIZE", "4"))
+SHARD_DIR = os.getenv("BONDKEEPER_SHARD_DIR", "shards")
+DEFAULT_USER = os.getenv("BONDKEEPER_USER", "")
+MAX_OPEN_SHARDS = int(os.getenv("BONDKEEPER_MAX_OPEN_SHARDS", "16"))
+BUSY_TIMEOUT_MS = 5000
+
+# Applied to every new connection. WAL lets readers proceed while a writer commits;
+# synchronous=NORMAL is durable against application crashes under WAL.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+]
+
+# Statement texts are module constants so each connection's statement cache
+# (cached_statements) reuses the prepared statement instead of re-parsing.
+SQL_GET_CONTACT = "SELECT name, notes FROM contacts WHERE contact_id=?"
+SQL_LIST_CONTACTS = "SELECT contact_id, name FROM contacts ORDER BY contact_id DESC"
+SQL_RECENT_MESSAGES = """
+    SELECT conv_id, ts, timestamp, direction, text
+    FROM conversations
+    WHERE contact_id=?
+    ORDER BY ts DESC, conv_id DESC LIMIT ?
+"""
+SQL_COUNT_CONTACTS = "SELECT COUNT(*) FROM contacts WHERE (?1 = '' OR name LIKE ?2 ESCAPE '\\')"
+# One query for a whole page of the contacts panel: the page of contacts, most
+# urgent first (walking the contact_health urgency index), and for each of them
+# its latest `per_contact` messages (found through the contact/ts index, so cost
+# does not grow with history length) numbered with ROW_NUMBER().
+SQL_CONTACT_PREVIEWS = """
+    WITH page AS (
+        SELECT c.contact_id, c.name, h.last_ts, h.inbound, h.outbound, h.unanswered_inbound,
+               h.median_reply_secs, h.urgency_key
+        FROM contact_health h JOIN contacts c ON c.contact_id = h.contact_id
+        WHERE (?1 = '' OR c.name LIKE ?2 ESCAPE '\\')
+        ORDER BY h.urgency_key DESC, h.contact_id DESC LIMIT ?3 OFFSET ?4
+    ),
+    ranked AS (
+        SELECT p.contact_id, m.timestamp, m.direction, m.text,
+               ROW_NUMBER() OVER (PARTITION BY p.contact_id ORDER BY m.ts DESC, m.conv_id DESC) AS rn
+        FROM page p
+        JOIN conversations m ON m.conv_id IN (
+            SELECT conv_id FROM conversations
+            WHERE contact_id = p.contact_id
+            ORDER BY ts DESC, conv_id DESC LIMIT ?5
+        )
+    )
+    SELECT p.contact_id, p.name, p.last_ts, p.inbound, p.outbound, p.unanswered_inbound,
+           p.median_reply_secs, p.urgency_key, r.rn, r.timestamp, r.direction, r.text
+    FROM page p
+    LEFT JOIN ranked r ON r.contact_id = p.contact_id
+    ORDER BY p.urgency_key DESC, p.contact_id DESC, r.rn
+"""
+SQL_GET_COUNTER = "SELECT value FROM meta WHERE key=?"
+SQL_INCR_COUNTER = """INSERT INTO meta(key, value) VALUES (?1, ?2)
+                      ON CONFLICT(key) DO UPDATE SET value = value + ?2"""
+SQL_INSERT_CONTACT = "INSERT INTO contacts(name, notes, contact_key) VALUES (?,?,?)"
+SQL_UPSERT_CONTACT = """INSERT INTO contacts(name, notes, contact_key) VALUES (?,?,?)
+                        ON CONFLICT(contact_key) DO NOTHING"""
+SQL_CONTACT_BY_KEY = "SELECT contact_id FROM contacts WHERE contact_key=?"
+# every contact has a health row; health.py fills it in
+SQL_ADD_HEALTH_ROW = "INSERT OR IGNORE INTO contact_health(contact_id) VALUES (?)"
+# (contact_id, msg_hash) is unique, so re-imported messages are skipped, not duplicated
+SQL_INSERT_MESSAGE = """INSERT OR IGNORE INTO conversations(contact_id, timestamp, ts, direction, text, msg_hash)
+                        VALUES (?,?,?,?,?,?)"""
+SQL_HAS_FTS = "SELECT 1 FROM sqlite_master WHERE name='conversations_fts'"
+SQL_MAX_CONV_ID = "SELECT COALESCE(MAX(conv_id), 0) FROM conversations"
+# conv_ids must stay unique across the hot table and the archive tier. SQLite numbers
+# new rows from MAX(conv_id) + 1, which can fall below archived ids once the newest
+# hot rows are gone (a split moved a contact out, or a shard received only archived
+# history); a placeholder row at the archive's newest conv_id keeps new rows above it.
+SQL_ARCHIVED_MAX_CONV_ID = "SELECT COALESCE(MAX(max_conv_id), 0) FROM archived_contacts"
+SQL_ADD_CONV_ID_FLOOR = "INSERT INTO conversations(conv_id) VALUES (?)"
+SQL_DROP_CONV_ID_FLOOR = "DELETE FROM conversations WHERE conv_id=?"
+SQL_DEFER_FTS = "INSERT OR REPLACE INTO meta(key, value) VALUES ('fts_deferred', 1)"
+SQL_UNDEFER_FTS = "DELETE FROM meta WHERE key='fts_deferred'"
+SQL_DELETE_MESSAGES = "DELETE FROM conversations WHERE conv_id IN ({})"
+SQL_FTS_DELETE = """INSERT INTO conversations_fts(conversations_fts, rowid, text)
+                    SELECT 'delete', conv_id, text FROM conversations WHERE conv_id IN ({})"""
+DELETE_BATCH = 500
+SQL_FTS_CATCH_UP = "INSERT INTO conversations_fts(rowid, text) SELECT conv_id, text FROM conversations WHERE conv_id > ?"
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections that can be shared across threads.
+
+    Each connection is used by one thread at a time (checked out via connection()),
+    which is what check_same_thread=False requires of us. Connections run in
+    autocommit mode; use transaction() for multi-statement writes.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._migrated = False
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            if not self._migrated:
+                migrate(conn)
+                self._migrated = True
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=BUSY_TIMEOUT_MS / 1000)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if self._closed:
+                conn.close()
+                with self._lock:
+                    self._created -= 1
+            else:
+                self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Check out a connection and run the block inside BEGIN/COMMIT."""
+        with self.connection() as conn:
+            with transaction_on(conn, immediate):
+                yield conn
+
+    def close(self):
+        """Close idle connections; ones still checked out are closed when returned."""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+@contextmanager
+def transaction_on(conn, immediate=True):
+    """Run the block inside BEGIN/COMMIT on an already checked-out connection."""
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# --- Shards
+
+_current_shard = contextvars.ContextVar("bondkeeper_shard", default=None)
+
+
+def shard_path(user):
+    """Database file for a user or workspace name; the empty name is DB_PATH.
+
+    Names are case-insensitive. The file name is a readable slug plus a hash of
+    the name, so any name maps to a safe, unique path under SHARD_DIR.
+    """
+    user = (user or "").strip().casefold()
+    if not user:
+        return DB_PATH
+    slug = re.sub(r"[^a-z0-9]+", "-", user).strip("-")[:40] or "user"
+    digest = hashlib.sha1(user.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(SHARD_DIR, f"{slug}-{digest}.db")
+
+
+def current_db_path():
+    """The database file connection() uses in this context."""
+    path = _current_shard.get()
+    return path if path is not None else shard_path(DEFAULT_USER)
+
+
+def set_shard(user):
+    """Route this context (thread / Streamlit script run) to `user`'s shard. Returns its path."""
+    path = shard_path(user)
+    _current_shard.set(path)
+    return path
+
+
+def all_db_paths():
+    """The default database and every shard file that exists, default first."""
+    shards = sorted(glob.glob(os.path.join(SHARD_DIR, "*.db")))
+    return ([DB_PATH] if os.path.exists(DB_PATH) else []) + shards
+
+
+def set_db_path(path):
+    """Route this context to an explicit database file (benchmarks, tools)."""
+    _current_shard.set(path)
+    return path
+
+
+@contextmanager
+def use_db_path(path):
+    """Route connection()/transaction() to the database file `path` inside the block."""
+    token = _current_shard.set(path)
+    try:
+        yield path
+    finally:
+        _current_shard.reset(token)
+
+
+def use_shard(user):
+    """Route connection()/transaction() to `user`'s shard inside the block."""
+    return use_db_path(shard_path(user))
+
+
+_pools = OrderedDict()
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    """Return the process-wide pool for `path` (default: the current shard), creating it on
+    first use. The least recently used pools beyond MAX_OPEN_SHARDS are closed."""
+    path = path or current_db_path()
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is not None:
+            _pools.move_to_end(path)
+            return pool
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        pool = _pools[path] = ConnectionPool(path)
+        while len(_pools) > MAX_OPEN_SHARDS:
+            _pools.popitem(last=False)[1].close()
+        return pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def transaction():
+    return get_pool().transaction()
+
+
+# --- Data access
+
+def get_contact(contact_id):
+    """Return (name, notes) for a contact, or None if it does not exist."""
+    with connection() as conn:
+        return conn.execute(SQL_GET_CONTACT, (contact_id,)).fetchone()
+
+
+def list_contacts():
+    with connection() as conn:
+        return conn.execute(SQL_LIST_CONTACTS).fetchall()
+
+
+def recent_messages(contact_id, limit=5):
+    """Latest `limit` messages for a contact as (timestamp, direction, text), newest first.
+
+    Archived messages are merged in when the hot table alone cannot answer.
+    """
+    with connection() as conn:
+        rows = archive.newest(conn, contact_id, conn.execute(SQL_RECENT_MESSAGES, (contact_id, limit)).fetchall(),
+                              limit)
+    return [row[2:] for row in rows]
+
+
+def _like_pattern(search):
+    escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def count_contacts(search=""):
+    search = search.strip()
+    with connection() as conn:
+        return conn.execute(SQL_COUNT_CONTACTS, (search, _like_pattern(search))).fetchone()[0]
+
+
+def contact_previews(search="", limit=25, offset=0, per_contact=2):
+    """One page of contacts matching `search` (by name), most urgent first.
+
+    Returns [(contact_id, name, [(timestamp, direction, text), ...], health), ...] with
+    up to `per_contact` latest messages each. `health` is a dict of the contact_health
+    columns (values are None until health.py has computed the contact).
+    """
+    search = search.strip()
+    with connection() as conn:
+        rows = conn.execute(SQL_CONTACT_PREVIEWS,
+                            (search, _like_pattern(search), limit, offset, per_contact)).fetchall()
+    page = []
+    for (cid, name, last_ts, inbound, outbound, unanswered, median_reply, urgency_key,
+         rn, timestamp, direction, text) in rows:
+        if not page or page[-1][0] != cid:
+            health = {"last_ts": last_ts, "inbound": inbound, "outbound": outbound,
+                      "unanswered_inbound": unanswered, "median_reply_secs": median_reply,
+                      "urgency_key": urgency_key}
+            page.append((cid, name, [], health))
+        if rn is not None:
+            page[-1][2].append((timestamp, direction, text))
+    return page
+
+
+def get_counter(key):
+    with connection() as conn:
+        row = conn.execute(SQL_GET_COUNTER, (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def incr_counter(conn, key, n=1):
+    conn.execute(SQL_INCR_COUNTER, (key, n))
+
+
+def data_version():
+    """Counter bumped by writes (ingest); use it as a cache key for derived views."""
+    return get_counter("data_version")
+
+
+def bump_data_version(conn):
+    incr_counter(conn, "data_version")
+
+
+def create_contact(conn, name, notes="", key=None):
+    contact_id = conn.execute(SQL_INSERT_CONTACT, (name, notes, key)).lastrowid
+    conn.execute(SQL_ADD_HEALTH_ROW, (contact_id,))
+    return contact_id
+
+
+def resolve_contact(conn, name, key=None, notes=""):
+    """Return (contact_id, created) for the contact with `key` (default: derived from name)."""
+    key = key or contact_key(name)
+    created = conn.execute(SQL_UPSERT_CONTACT, (name, notes, key)).rowcount == 1
+    contact_id = conn.execute(SQL_CONTACT_BY_KEY, (key,)).fetchone()[0]
+    if created:
+        conn.execute(SQL_ADD_HEALTH_ROW, (contact_id,))
+    return contact_id, created
+
+
+def insert_messages(conn, rows):
+    """Insert (contact_id, timestamp, ts, direction, text, msg_hash) rows on `conn`.
+
+    Rows already present for the contact are skipped. Returns the number inserted.
+    Must run inside a transaction: the FTS index is brought up to date with one
+    set-based insert instead of the per-row trigger, and the flag that suspends
+    the trigger must never be visible to other connections.
+    """
+    if not conn.in_transaction:
+        raise RuntimeError("insert_messages must be called inside a transaction")
+    has_fts = conn.execute(SQL_HAS_FTS).fetchone() is not None
+    # conv_id is a plain rowid and we hold the write lock, so new rows are above this
+    last_id = conn.execute(SQL_MAX_CONV_ID).fetchone()[0]
+    floor = conn.execute(SQL_ARCHIVED_MAX_CONV_ID).fetchone()[0]
+    if has_fts:
+        # also keeps the placeholder row out of the FTS index
+        conn.execute(SQL_DEFER_FTS)
+    try:
+        if floor > last_id:
+            conn.execute(SQL_ADD_CONV_ID_FLOOR, (floor,))
+        added = conn.executemany(SQL_INSERT_MESSAGE, rows).rowcount
+        if floor > last_id:
+            conn.execute(SQL_DROP_CONV_ID_FLOOR, (floor,))
+    finally:
+        if has_fts:
+            conn.execute(SQL_UNDEFER_FTS)
+    if has_fts and added:
+        conn.execute(SQL_FTS_CATCH_UP, (last_id,))
+    return added
+
+
+def delete_messages(conn, conv_ids):
+    """Delete messages by conv_id on `conn`. Returns the number deleted.
+
+    Like insert_messages this must run inside a transaction: the FTS entries are
+    removed with one set-based statement per batch instead of the per-row trigger.
+    """
+    if not conn.in_transaction:
+        raise RuntimeError("delete_messages must be called inside a transaction")
+    conv_ids = list(conv_ids)
+    has_fts = conn.execute(SQL_HAS_FTS).fetchone() is not None
+    deleted = 0
+    if has_fts:
+        conn.execute(SQL_DEFER_FTS)
+    try:
+        for i in range(0, len(conv_ids), DELETE_BATCH):
+            batch = conv_ids[i:i + DELETE_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            if has_fts:
+                conn.execute(SQL_FTS_DELETE.format(placeholders), batch)
+            deleted += conn.execute(SQL_DELETE_MESSAGES.format(placeholders), batch).rowcount
+    finally:
+        if has_fts:
+            conn.execute(SQL_UNDEFER_FTS)
+    return deleted
@@ -0,0 +1,490 @@
+# schema.py
+# Versioned schema for bondkeeper.db.
+# Each entry in MIGRATIONS upgrades the database by exactly one version. migrate()
+# applies the missing ones in order and records them in schema_migrations, so an
+# existing database is upgraded in place and a new one is built from scratch.
+
+import hashlib
+import sqlite3
+import time
+
+
+def _create_base_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS contacts(
+        contact_id INTEGER PRIMARY KEY, 
+        name TEXT, 
+        notes TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS conversations(
+        conv_id INTEGER PRIMARY KEY, 
+        contact_id INTEGER,
+        timestamp TEXT,
+        direction TEXT,
+        text TEXT
+    )
+    """)
+
+
+def to_epoch(values):
+    """Parse timestamps (mixed date formats or epoch numbers) into epoch seconds.
+
+    Returns a list of ints, with None for anything unparseable. Naive datetimes are
+    treated as UTC so the ordering is consistent across formats.
+    """
+    import pandas as pd  # deferred: only ingest and migrations parse timestamps
+    raw = pd.Series(list(values), dtype=object)
+    text = raw.where(raw.notna(), None).astype(str).str.strip()
+    numeric = pd.to_numeric(text.where(text.str.fullmatch(r"\d+(\.\d+)?"), None), errors="coerce")
+    # values above ~year 5000 in seconds are epoch milliseconds
+    numeric = numeric.where(numeric < 1e11, numeric / 1000)
+
+    parsed = pd.to_datetime(text.where(numeric.isna(), None), errors="coerce", format="mixed", utc=True)
+    # go through datetime64[s] so the result does not depend on pandas' parse resolution
+    as_seconds = parsed.dt.tz_convert(None).to_numpy(dtype="datetime64[s]").astype("int64")
+    seconds = pd.Series(as_seconds, dtype="float64").where(parsed.notna().to_numpy())
+    seconds = seconds.where(numeric.isna(), numeric.floordiv(1))
+    return [None if pd.isna(s) else int(s) for s in seconds]
+
+
+def contact_key(name):
+    """Stable key for matching a contact across imports: case- and whitespace-insensitive name."""
+    return " ".join(str(name).split()).casefold()
+
+
+def _hash64(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+def message_hash(t, raw, direction, text, occurrence=0):
+    """Content hash of one message; `occurrence` numbers identical messages (0 = first)."""
+    key = f"{t if t is not None else raw}\x1f{direction}\x1f{text}"
+    return _hash64(key if occurrence == 0 else f"{key}\x1f#{occurrence}")
+
+
+_STAMP = "stamp"  # key in `seen` for the timestamp being counted (hash keys are ints)
+_NO_STAMP = object()
+
+
+def message_hashes(ts, timestamps, directions, texts, seen=None):
+    """Content hash per message, as signed 64-bit ints (compact to index).
+
+    Uses the parsed epoch ts when there is one, so the same message exported with
+    a different date format still matches; otherwise the raw timestamp text.
+
+    Messages that repeat exactly (an "ok" twice on a date-only timestamp) are
+    numbered in file order, so each keeps its own hash; the first one hashes as
+    before. `seen` carries the counts from chunk to chunk: pass the same dict for
+    every chunk of one file. Re-importing the same (or a longer) export then gives
+    the same hashes, and only the new messages are written.
+
+    Repeats share their timestamp, so only the current run of messages with one
+    timestamp is counted and `seen` stays small however long the file is. Exports
+    are chronological; a repeat that comes back after a different timestamp
+    starts again at 0 and is taken for the earlier message.
+    """
+    seen = {} if seen is None else seen
+    out = []
+    for t, raw, direction, text in zip(ts, timestamps, directions, texts):
+        stamp = t if t is not None else raw
+        if seen.get(_STAMP, _NO_STAMP) != stamp:
+            seen.clear()
+            seen[_STAMP] = stamp
+        first = message_hash(t, raw, direction, text)
+        occurrence = seen.get(first, 0)
+        seen[first] = occurrence + 1
+        out.append(first if occurrence == 0 else message_hash(t, raw, direction, text, occurrence))
+    return out
+
+
+def _add_epoch_ts(conn, batch_size=50_000):
+    conn.execute("ALTER TABLE conversations ADD COLUMN ts INTEGER")
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT conv_id, timestamp FROM conversations
+            WHERE conv_id > ? ORDER BY conv_id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        ids = [r[0] for r in rows]
+        conn.executemany("UPDATE conversations SET ts=? WHERE conv_id=?",
+                         zip(to_epoch(r[1] for r in rows), ids))
+        last_id = ids[-1]
+    # Recent-message lookups (get_context, contact previews) become an index seek
+    # on contact_id followed by a walk of the first n entries.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_contact_ts "
+                 "ON conversations(contact_id, ts DESC)")
+
+
+def _add_meta(conn):
+    # Small key/value counters; data_version is bumped by every write that changes
+    # what the UI shows, so caches can key on it.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS meta(
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('data_version', 0)")
+
+
+def _add_suggestion_cache(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS suggestion_cache(
+        cache_key TEXT PRIMARY KEY,
+        contact_id INTEGER,
+        model TEXT,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_suggestion_cache_contact ON suggestion_cache(contact_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_suggestion_cache_last_used ON suggestion_cache(last_used)")
+
+
+def _add_batch_runs(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS batch_runs(
+        run_id INTEGER PRIMARY KEY,
+        model TEXT,
+        status TEXT,
+        created_at REAL,
+        finished_at REAL
+    )
+    """)
+    # one row per contact in a run; status is pending/done/failed
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS batch_items(
+        run_id INTEGER,
+        contact_id INTEGER,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        updated_at REAL,
+        PRIMARY KEY(run_id, contact_id)
+    )
+    """)
+
+
+def _add_contact_summaries(conn):
+    # rolling summary of the history older than a contact's recent window;
+    # (covered_ts, covered_conv_id) is the newest message folded in so far
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS contact_summaries(
+        contact_id INTEGER PRIMARY KEY,
+        covered_ts INTEGER,
+        covered_conv_id INTEGER,
+        message_count INTEGER,
+        inbound_count INTEGER,
+        first_ts INTEGER,
+        last_ts INTEGER,
+        highlights TEXT,
+        updated_at REAL
+    )
+    """)
+
+
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+        INSERT INTO conversations_fts(rowid, text) VALUES (new.conv_id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, text) VALUES ('delete', old.conv_id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF text ON conversations BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, text) VALUES ('delete', old.conv_id, old.text);
+        INSERT INTO conversations_fts(rowid, text) VALUES (new.conv_id, new.text);
+    END""",
+]
+
+
+def _add_fts(conn):
+    # External-content FTS5 index over conversations.text: the text is stored once
+    # (in conversations) and the triggers keep the index in step with every insert,
+    # delete and edit, including ingest's executemany batches.
+    try:
+        conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+            text,
+            content='conversations',
+            content_rowid='conv_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e).lower():
+            raise
+        return  # SQLite built without FTS5; search.py falls back to LIKE
+    for trigger in FTS_TRIGGERS:
+        conn.execute(trigger)
+    conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+
+
+def _add_dedup_keys(conn, batch_size=50_000):
+    conn.execute("ALTER TABLE contacts ADD COLUMN contact_key TEXT")
+    # earlier versions created a new contact per import; the oldest contact with a
+    # given name takes the key, later duplicates keep NULL (allowed by the index)
+    seen = set()
+    keys = []
+    for contact_id, name in conn.execute("SELECT contact_id, name FROM contacts ORDER BY contact_id").fetchall():
+        key = contact_key(name or "")
+        if key not in seen:
+            seen.add(key)
+            keys.append((key, contact_id))
+    conn.executemany("UPDATE contacts SET contact_key=? WHERE contact_id=?", keys)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_key ON contacts(contact_key)")
+
+    conn.execute("ALTER TABLE conversations ADD COLUMN msg_hash INTEGER")
+    seen = set()
+    repeats = {}  # contact_id -> message_hashes counts: repeats are numbered per contact
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT conv_id, contact_id, ts, timestamp, direction, text FROM conversations
+            WHERE conv_id > ? ORDER BY conv_id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        hashes = [message_hashes([ts], [timestamp], [direction], [text], repeats.setdefault(contact_id, {}))[0]
+                  for _, contact_id, ts, timestamp, direction, text in rows]
+        updates = []
+        for r, h in zip(rows, hashes):
+            # rows that already repeat within a contact keep NULL rather than being deleted
+            if (r[1], h) not in seen:
+                seen.add((r[1], h))
+                updates.append((h, r[0]))
+        conn.executemany("UPDATE conversations SET msg_hash=? WHERE conv_id=?", updates)
+        last_id = rows[-1][0]
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_contact_hash "
+                 "ON conversations(contact_id, msg_hash)")
+
+
+# Bulk inserts (repository.insert_messages) set meta 'fts_deferred' inside their
+# transaction and index the new rows in one INSERT ... SELECT afterwards, which is
+# several times faster than one trigger-driven FTS insert per row. Every other
+# writer still goes through the trigger.
+FTS_DEFERRABLE_INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations
+    WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key='fts_deferred') BEGIN
+        INSERT INTO conversations_fts(rowid, text) VALUES (new.conv_id, new.text);
+    END"""
+
+
+def _defer_fts_on_bulk_insert(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='conversations_fts'").fetchone():
+        return
+    conn.execute("DROP TRIGGER IF EXISTS conversations_fts_ai")
+    conn.execute(FTS_DEFERRABLE_INSERT_TRIGGER)
+
+
+def _add_contact_health(conn):
+    # materialised by health.py; a row with updated_at NULL is waiting to be computed
+    # (health.refresh_stale). urgency_key sorts contacts by urgency at any point in time.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS contact_health(
+        contact_id INTEGER PRIMARY KEY,
+        last_ts INTEGER,
+        messages INTEGER,
+        inbound INTEGER,
+        outbound INTEGER,
+        unanswered_inbound INTEGER,
+        median_reply_secs REAL,
+        urgency_key REAL,
+        updated_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_health_urgency "
+                 "ON contact_health(urgency_key DESC, contact_id DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_health_stale ON contact_health(contact_id) "
+                 "WHERE updated_at IS NULL")
+    conn.execute("INSERT OR IGNORE INTO contact_health(contact_id) SELECT contact_id FROM contacts")
+
+
+def _add_model_calls(conn):
+    # one row per model API call, read by model_router as a rolling window per model
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS model_calls(
+        call_id INTEGER PRIMARY KEY,
+        model TEXT,
+        ts REAL,
+        latency_ms REAL,
+        outcome TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_model_calls_model_ts ON model_calls(model, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_model_calls_ts ON model_calls(ts)")
+
+
+def _add_jobs(conn):
+    # durable work queue (precompute.py); a job is leased by one worker at a time
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs(
+        job_id INTEGER PRIMARY KEY,
+        kind TEXT,
+        contact_id INTEGER,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        run_after REAL,
+        lease_owner TEXT,
+        lease_expires REAL,
+        last_error TEXT,
+        created_at REAL,
+        updated_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(kind, status, run_after)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_one_queued ON jobs(kind, contact_id) "
+                 "WHERE status = 'queued'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_contact ON jobs(kind, contact_id, status)")
+    # latest precomputed suggestion per contact, stamped with the contact_health
+    # (messages, last_ts) it was generated for
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ready_suggestions(
+        contact_id INTEGER PRIMARY KEY,
+        messages INTEGER,
+        last_ts INTEGER,
+        model TEXT,
+        result TEXT,
+        created_at REAL
+    )
+    """)
+
+
+# the delete counterpart of FTS_DEFERRABLE_INSERT_TRIGGER, for compaction's bulk deletes
+FTS_DEFERRABLE_DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations
+    WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key='fts_deferred') BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, text) VALUES ('delete', old.conv_id, old.text);
+    END"""
+
+
+def _add_archive(conn):
+    # one summary row per contact with a cold tier (compact.py / archive.py): the
+    # archive files hold the messages, this row says which generation is current
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archived_contacts(
+        contact_id INTEGER PRIMARY KEY,
+        generation INTEGER,
+        messages INTEGER,
+        inbound INTEGER,
+        first_ts INTEGER,
+        last_ts INTEGER,
+        max_conv_id INTEGER,
+        file_bytes INTEGER,
+        archived_at REAL
+    )
+    """)
+    # content hashes of archived messages, so re-importing an export does not bring
+    # them back into the hot table
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archived_hashes(
+        contact_id INTEGER,
+        msg_hash INTEGER,
+        PRIMARY KEY (contact_id, msg_hash)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS conversations_skip_archived BEFORE INSERT ON conversations
+        WHEN EXISTS (SELECT 1 FROM archived_hashes WHERE contact_id = new.contact_id AND msg_hash = new.msg_hash)
+        BEGIN SELECT RAISE(IGNORE); END""")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='conversations_fts'").fetchone():
+        conn.execute("DROP TRIGGER IF EXISTS conversations_fts_ad")
+        conn.execute(FTS_DEFERRABLE_DELETE_TRIGGER)
+
+
+SQL_HASH_TAKEN = """SELECT 1 FROM conversations WHERE contact_id=?1 AND msg_hash=?2
+                    UNION ALL SELECT 1 FROM archived_hashes WHERE contact_id=?1 AND msg_hash=?2"""
+
+
+def _number_repeated_messages(conn, batch_size=50_000):
+    # migration 8 left exact repeats within a contact without a hash; give them the
+    # numbered hashes message_hashes() now computes, so re-importing their export
+    # matches them instead of inserting them again
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT conv_id, contact_id, ts, timestamp, direction, text FROM conversations
+            WHERE msg_hash IS NULL AND conv_id > ? ORDER BY conv_id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        for conv_id, contact_id, ts, timestamp, direction, text in rows:
+            occurrence = 1
+            while True:
+                h = message_hash(ts, timestamp, direction, text, occurrence)
+                if not conn.execute(SQL_HASH_TAKEN, (contact_id, h)).fetchone():
+                    break
+                occurrence += 1
+            conn.execute("UPDATE conversations SET msg_hash=? WHERE conv_id=?", (h, conv_id))
+        last_id = rows[-1][0]
+
+
+def _add_conv_id_to_contact_ts_index(conn):
+    # recent-message reads break ts ties by conv_id, as the archive tier does; with
+    # conv_id in the index that order still comes straight from an index walk
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_contact_ts_conv "
+                 "ON conversations(contact_id, ts DESC, conv_id DESC)")
+    conn.execute("DROP INDEX IF EXISTS idx_conversations_contact_ts")
+
+
+# (version, description, step). Steps run inside the migration's transaction, so they
+# must not commit (no executescript).
+MIGRATIONS = [
+    (1, "base contacts/conversations tables", _create_base_tables),
+    (2, "epoch ts column + (contact_id, ts DESC) index", _add_epoch_ts),
+    (3, "meta counters table (data_version)", _add_meta),
+    (4, "suggestion cache", _add_suggestion_cache),
+    (5, "batch generation checkpoints", _add_batch_runs),
+    (6, "rolling contact summaries", _add_contact_summaries),
+    (7, "FTS5 index over conversations.text", _add_fts),
+    (8, "contact keys + message content hashes for idempotent re-import", _add_dedup_keys),
+    (9, "let bulk inserts index FTS set-based", _defer_fts_on_bulk_insert),
+    (10, "materialised relationship-health scores", _add_contact_health),
+    (11, "per-model call latency/outcome log for routing", _add_model_calls),
+    (12, "job queue + precomputed suggestions", _add_jobs),
+    (13, "cold-tier archive summaries, archived message hashes, deferrable FTS delete", _add_archive),
+    (14, "hashes for exactly repeated messages", _number_repeated_messages),
+    (15, "(contact_id, ts DESC, conv_id DESC) index", _add_conv_id_to_contact_ts_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at INTEGER
+    )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Bring the database up to LATEST_VERSION. Returns the list of versions applied."""
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+    conn.commit()
+
+    applied = []
+    for version, description, step in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock before re-checking, so two processes
+        # starting at once cannot both apply the same step.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.execute("ROLLBACK")
+                continue
+            step(conn)
+            conn.execute("INSERT INTO schema_migrations(version, description, applied_at) VALUES (?,?,?)",
+                         (version, description, int(time.time())))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,145 @@
+# search.py
+# Full-text search over conversations, backed by the conversations_fts FTS5 index
+# (schema migration 7). Results are ranked by bm25 and come with a highlighted
+# snippet. If SQLite was built without FTS5, a LIKE scan is used instead.
+# When the hot table has fewer hits than asked for, archived messages
+# (archive.py) are scanned too and listed after them, newest first.
+#
+# Run:
+#   python search.py "coffee soon"
+#   python search.py --rebuild        # re-index an existing database from scratch
+#   python search.py --optimize       # merge index segments after very large imports
+
+import argparse
+import re
+
+import archive
+import repository
+
+# snippet() wraps matched terms in these; callers swap them for real markup
+# after escaping the text (see highlight_html)
+MARK_START = "\x02"
+MARK_END = "\x03"
+SNIPPET_TOKENS = 16
+
+SQL_SEARCH = f"""
+    SELECT c.conv_id, c.contact_id, k.name, c.timestamp, c.direction,
+           snippet(conversations_fts, 0, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_TOKENS}),
+           conversations_fts.rank
+    FROM conversations_fts
+    JOIN conversations c ON c.conv_id = conversations_fts.rowid
+    JOIN contacts k ON k.contact_id = c.contact_id
+    WHERE conversations_fts MATCH ?1 AND (?2 IS NULL OR c.contact_id = ?2)
+    ORDER BY conversations_fts.rank
+    LIMIT ?3
+"""
+SQL_SEARCH_LIKE = """
+    SELECT c.conv_id, c.contact_id, k.name, c.timestamp, c.direction, c.text, 0
+    FROM conversations c
+    JOIN contacts k ON k.contact_id = c.contact_id
+    WHERE c.text LIKE ?1 ESCAPE '\\' AND (?2 IS NULL OR c.contact_id = ?2)
+    ORDER BY c.ts DESC
+    LIMIT ?3
+"""
+
+
+def fts_available(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name='conversations_fts'").fetchone()
+    return row is not None
+
+
+def to_fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, the last as a prefix."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+SQL_CONTACT_NAME = "SELECT name FROM contacts WHERE contact_id=?"
+
+
+def cold_snippet(text, patterns, tokens=SNIPPET_TOKENS):
+    """A snippet of an archived message around its first match, marked like FTS5 snippet()."""
+    words = (text or "").split()
+    first = next((i for i, w in enumerate(words) if any(p.search(w) for p in patterns)), 0)
+    start = max(0, first - tokens // 2)
+    shown = [re.sub("|".join(p.pattern for p in patterns), lambda m: MARK_START + m.group(0) + MARK_END,
+                    w, flags=re.I) for w in words[start:start + tokens]]
+    return ("…" if start else "") + " ".join(shown) + ("…" if start + tokens < len(words) else "")
+
+
+def search_archived(conn, query, limit, contact_id=None):
+    """Hits from the cold tier, in the same shape as search_messages() (score 0)."""
+    words = re.findall(r"\w+", query)
+    patterns = [re.compile(rf"\b{re.escape(w)}" + ("" if i == len(words) - 1 else r"\b"), re.I)
+                for i, w in enumerate(words)]
+    hits = []
+    for conv_id, cid, _, timestamp, direction, text in archive.search(conn, patterns, contact_id, limit):
+        name = conn.execute(SQL_CONTACT_NAME, (cid,)).fetchone()
+        hits.append({"conv_id": conv_id, "contact_id": cid, "name": name[0] if name else None,
+                     "timestamp": timestamp, "direction": direction,
+                     "snippet": cold_snippet(text, patterns), "score": 0})
+    return hits
+
+
+def search_messages(query, limit=20, contact_id=None):
+    """Return up to `limit` matches for `query` (best first) as dicts.
+
+    Each hit has conv_id, contact_id, name, timestamp, direction, snippet (with
+    MARK_START/MARK_END around matched terms) and score (lower is better;
+    archived hits come last with score 0).
+    """
+    fts_query = to_fts_query(query)
+    if fts_query is None:
+        return []
+    with repository.connection() as conn:
+        if fts_available(conn):
+            rows = conn.execute(SQL_SEARCH, (fts_query, contact_id, limit)).fetchall()
+        else:
+            pattern = "%" + query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = conn.execute(SQL_SEARCH_LIKE, (pattern, contact_id, limit)).fetchall()
+        keys = ("conv_id", "contact_id", "name", "timestamp", "direction", "snippet", "score")
+        hits = [dict(zip(keys, row)) for row in rows]
+        if len(hits) < limit:
+            hits += search_archived(conn, query, limit - len(hits), contact_id)
+    return hits
+
+
+def highlight_html(snippet, escape):
+    """Escape a snippet with `escape` (e.g. html.escape) and turn the markers into <mark>."""
+    return escape(snippet or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def rebuild_index():
+    """Rebuild conversations_fts from the conversations table."""
+    with repository.transaction() as conn:
+        conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+
+
+def optimize_index():
+    with repository.transaction() as conn:
+        conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('optimize')")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search BondKeeper conversations.")
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--contact", type=int, help="only search this contact id")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the full-text index")
+    parser.add_argument("--optimize", action="store_true", help="merge full-text index segments")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_index()
+        print("Full-text index rebuilt.")
+    if args.optimize:
+        optimize_index()
+        print("Full-text index optimized.")
+    if args.query:
+        for hit in search_messages(args.query, args.limit, args.contact):
+            snippet = hit["snippet"].replace(MARK_START, "[").replace(MARK_END, "]")
+            print(f"{hit['name']} (id={hit['contact_id']}) [{hit['timestamp']}] {hit['direction']}: {snippet}")
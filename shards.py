@@ -0,0 +1,200 @@
+# shards.py
+# Tooling for per-user / per-workspace databases (see repository.shard_path).
+# `split` copies contacts out of the current database into their user's shard:
+# the contact, its messages (conv_ids kept, so similarity vectors and archives
+# stay valid), the derived tables (health, summary, ready and cached
+# suggestions, archive summary + hashes) and its vector and archive files. With
+# --move they are then removed from the source.
+# Either file may end up without its newest hot rows (a contact that was only
+# archived, or one moved away); repository.insert_messages numbers new messages
+# above the archived conv_ids, so ids stay unique across both tiers.
+#
+# A shard should only receive contacts split from one source database: contact
+# ids, contact keys and conv_ids are kept, and a clash aborts that user's copy.
+#
+# Run:
+#   python shards.py path alice                       # the file a user maps to
+#   python shards.py list                             # shards and their sizes
+#   python shards.py split --map users.csv --move     # CSV columns: contact_id,user
+#   python shards.py split --user alice --contact 3 --contact 4
+
+import argparse
+import csv
+import glob
+import os
+import shutil
+from collections import defaultdict
+
+import archive
+import repository
+import similarity
+
+# tables keyed by contact_id whose rows move with the contact; contacts and
+# conversations come first and are inserted without OR REPLACE so clashes fail
+COPY_TABLES = ["contacts", "conversations", "contact_health", "contact_summaries", "ready_suggestions",
+               "suggestion_cache", "archived_contacts", "archived_hashes"]
+SQL_CREATE_IDS = "CREATE TEMP TABLE IF NOT EXISTS split_ids(contact_id INTEGER PRIMARY KEY)"
+SQL_ADD_ID = "INSERT OR IGNORE INTO temp.split_ids(contact_id) VALUES (?)"
+SQL_DROP_IDS = "DROP TABLE IF EXISTS temp.split_ids"
+IN_SPLIT = "contact_id IN (SELECT contact_id FROM temp.split_ids)"
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+
+
+def _file_copies(source, target, contact_ids, archived):
+    """(src, dst) pairs for the contacts' vector files and current archive generation."""
+    pairs = []
+    src_vectors, dst_vectors = f"{source}.vectors", f"{target}.vectors"
+    src_archive, dst_archive = f"{source}.archive", f"{target}.archive"
+    for cid in contact_ids:
+        for path in glob.glob(os.path.join(src_vectors, f"{cid}.v*")):
+            pairs.append((path, os.path.join(dst_vectors, os.path.basename(path))))
+        if cid in archived:
+            base = archive.segment_base(src_archive, cid, archived[cid])
+            for suffix in (".cols", ".text"):
+                pairs.append((base + suffix, os.path.join(dst_archive, os.path.basename(base) + suffix)))
+    return pairs
+
+
+def copy_contacts(source, target, contact_ids):
+    """Copy `contact_ids` with everything that belongs to them from `source` into `target`.
+
+    Returns (contacts, messages) copied. Runs in one transaction on the target.
+    """
+    with repository.get_pool(source).connection():
+        pass  # make sure the source is migrated to the same schema as the target
+    with repository.get_pool(target).connection() as conn:
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        try:
+            conn.execute(SQL_CREATE_IDS)
+            conn.execute("DELETE FROM temp.split_ids")
+            conn.executemany(SQL_ADD_ID, [(cid,) for cid in contact_ids])
+            with repository.transaction_on(conn):
+                archived = dict(conn.execute(f"SELECT contact_id, generation FROM src.archived_contacts "
+                                             f"WHERE {IN_SPLIT}").fetchall())
+                # files first: extra files are harmless if the transaction fails
+                for src, dst in _file_copies(source, target, contact_ids, archived):
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    shutil.copyfile(src, dst)
+                copied = {}
+                for table in COPY_TABLES:
+                    cols = ", ".join(_columns(conn, table))
+                    verb = "INSERT" if table in ("contacts", "conversations") else "INSERT OR REPLACE"
+                    if table == "conversations":
+                        # index the copied text set-based, as insert_messages does
+                        conn.execute(repository.SQL_DEFER_FTS)
+                    cur = conn.execute(f"{verb} INTO main.{table}({cols}) SELECT {cols} FROM src.{table} "
+                                       f"WHERE {IN_SPLIT}")
+                    copied[table] = cur.rowcount
+                    if table == "conversations":
+                        conn.execute(repository.SQL_UNDEFER_FTS)
+                        if conn.execute(repository.SQL_HAS_FTS).fetchone():
+                            conn.execute(f"INSERT INTO conversations_fts(rowid, text) "
+                                         f"SELECT conv_id, text FROM main.conversations WHERE {IN_SPLIT}")
+                repository.bump_data_version(conn)
+        finally:
+            conn.execute(SQL_DROP_IDS)
+            conn.execute("DETACH DATABASE src")
+    return copied["contacts"], copied["conversations"]
+
+
+def remove_contacts(contact_ids):
+    """Delete `contact_ids` and everything derived from them from the current database."""
+    with repository.connection() as conn:
+        with repository.transaction_on(conn):
+            archived = {}
+            for cid in contact_ids:
+                info = archive.summary(conn, cid)
+                if info:
+                    archived[cid] = info["generation"]
+                conv_ids = [r[0] for r in conn.execute("SELECT conv_id FROM conversations WHERE contact_id=?",
+                                                       (cid,))]
+                repository.delete_messages(conn, conv_ids)
+                for table in COPY_TABLES[2:] + ["jobs", "contacts"]:
+                    conn.execute(f"DELETE FROM {table} WHERE contact_id=?", (cid,))
+            repository.bump_data_version(conn)
+        directory = archive.archive_dir(conn)
+    for cid in contact_ids:
+        for path in glob.glob(os.path.join(similarity.vector_dir(), f"{cid}.v*")):
+            os.remove(path)
+        if cid in archived:
+            archive.remove_stale(directory, cid, keep_generation=None)
+
+
+def split(assignments, move=False, progress=print):
+    """Copy (and with `move`, remove) contacts into their users' shards.
+
+    `assignments` maps user -> contact ids in the current database. Each user is
+    copied in its own transaction; a user whose copy fails is reported and skipped.
+    Returns {user: (contacts, messages) copied} for the users that succeeded.
+    """
+    source = repository.current_db_path()
+    done = {}
+    for user, contact_ids in assignments.items():
+        target = repository.shard_path(user)
+        if os.path.abspath(target) == os.path.abspath(source):
+            progress(f"  {user}: already the current database, skipped")
+            continue
+        contact_ids = sorted(set(contact_ids))
+        try:
+            contacts, messages = done[user] = copy_contacts(source, target, contact_ids)
+        except Exception as e:
+            progress(f"  {user}: FAILED ({type(e).__name__}: {e}); nothing copied")
+            continue
+        if move:
+            remove_contacts(contact_ids)
+        missing = f" ({len(contact_ids) - contacts} not found)" if contacts < len(contact_ids) else ""
+        progress(f"  {user}: {contacts} contacts{missing}, {messages:,} messages -> {target}")
+    return done
+
+
+def list_shards():
+    """[(path, bytes, contacts)] for the default database and every shard file."""
+    out = []
+    for path in repository.all_db_paths():
+        with repository.get_pool(path).connection() as conn:
+            contacts = conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+        out.append((path, os.path.getsize(path), contacts))
+    return out
+
+
+def read_map(path):
+    """{user: [contact_id, ...]} from a contact_id,user CSV (user names are case-insensitive)."""
+    assignments = defaultdict(list)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            assignments[row["user"].strip().casefold()].append(int(row["contact_id"]))
+    return assignments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-user database shards.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    path_cmd = sub.add_parser("path", help="show the database file for a user or workspace")
+    path_cmd.add_argument("user")
+    sub.add_parser("list", help="list the default database and all shards")
+    split_cmd = sub.add_parser("split", help="copy contacts from the current database into user shards")
+    split_cmd.add_argument("--map", help="CSV with columns contact_id,user")
+    split_cmd.add_argument("--user", help="target user for --contact")
+    split_cmd.add_argument("--contact", type=int, action="append", help="contact id (repeatable)")
+    split_cmd.add_argument("--move", action="store_true", help="remove the contacts from the source afterwards")
+    args = parser.parse_args()
+
+    if args.command == "path":
+        print(repository.shard_path(args.user))
+    elif args.command == "list":
+        for path, size, contacts in list_shards():
+            print(f"{path:50s} {size / 1e6:8.1f} MB  {contacts:,} contacts")
+    else:
+        if args.map:
+            assignments = read_map(args.map)
+        elif args.user and args.contact:
+            assignments = {args.user: args.contact}
+        else:
+            parser.error("give --map, or --user with one or more --contact")
+        print(f"Splitting {repository.current_db_path()} into {len(assignments)} shards...")
+        done = split(assignments, move=args.move)
+        print(f"{len(done)}/{len(assignments)} users done.")
+        raise SystemExit(0 if len(done) == len(assignments) else 1)
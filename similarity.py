@@ -0,0 +1,226 @@
+# similarity.py
+# Local similarity index over each contact's messages, so the prompt can include
+# relevant older messages (e.g. an old "Coffee soon?" thread) and not only the
+# most recent ones.
+#   - embed(): a deterministic, offline embedding -- hashed word, word-prefix and
+#     word-pair features folded into DIM dimensions and L2-normalised. No model
+#     download, no API calls; the same text always gives the same vector.
+#   - vectors live next to the (shard) database in <db>.vectors/, one pair of append-only
+#     files per contact: <id>.v1.vec (float32 rows) and <id>.v1.ids (conv_ids).
+#     Ingest appends the new messages in batches; readers memory-map the files.
+#   - search() scores a query against a contact's vectors newest-first in blocks
+#     and stops when SEARCH_BUDGET_MS is used up, so retrieval stays within a few
+#     milliseconds however long the history is.
+#
+# Run:
+#   python similarity.py 4 "coffee soon"      # most similar messages for contact 4
+#   python similarity.py --rebuild            # re-index every contact from scratch
+
+import argparse
+import os
+import re
+import shutil
+import time
+import zlib
+from functools import lru_cache
+
+import archive
+import repository
+import tracing
+
+VERSION = 1                 # bump when embed() changes: old files are then ignored
+DIM = 128
+EMBED_BATCH = 5000          # messages embedded and appended per transaction
+SEARCH_BLOCK_ROWS = 8192    # rows scored between budget checks
+SEARCH_BUDGET_MS = float(os.getenv("SIMILARITY_BUDGET_MS", "5"))
+MIN_SIMILARITY = 0.2
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+    a an and are as at be been but by do for from had has have i i'm i've it it's its
+    me my of on or our so that the this to was we were will with you you're your
+""".split())
+PREFIX_CHARS = 5            # "meeting" and "meetings" share the "meeti" feature
+
+SQL_TO_INDEX = """
+    SELECT conv_id, text FROM conversations
+    WHERE contact_id=? AND conv_id > ?
+    ORDER BY conv_id LIMIT ?
+"""
+SQL_CONTACT_IDS = "SELECT contact_id FROM contacts ORDER BY contact_id"
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature(feature):
+    """(dimension, sign) for a feature string; crc32 keeps it stable across runs."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % DIM, 1.0 if h & 0x80000000 else -1.0
+
+
+@lru_cache(maxsize=1 << 14)
+def _features(text):
+    """(dimensions, signed weights) of a text; chats repeat short messages a lot, hence the cache."""
+    words = [w for w in WORD.findall((text or "").lower()) if w not in STOPWORDS]
+    feats = [(w, 1.0) for w in words]
+    feats += [("~" + w[:PREFIX_CHARS], 0.5) for w in words if len(w) > PREFIX_CHARS]
+    feats += [(a + " " + b, 0.5) for a, b in zip(words, words[1:])]
+    dims, weights = [], []
+    for feature, weight in feats:
+        dim, sign = _feature(feature)
+        dims.append(dim)
+        weights.append(sign * weight)
+    return tuple(dims), tuple(weights)
+
+
+def embed(texts):
+    """L2-normalised float32 vectors, shape (len(texts), DIM); texts without words give zeros."""
+    import numpy as np  # deferred: only ingest and prompt building need it
+
+    flat, weights = [], []
+    for row, text in enumerate(texts):
+        dims, signed = _features(text)
+        offset = row * DIM
+        flat.extend(offset + d for d in dims)
+        weights.extend(signed)
+    n = len(texts)
+    vectors = np.bincount(np.asarray(flat, dtype=np.int64), weights=weights,
+                          minlength=n * DIM).reshape(n, DIM).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def vector_dir():
+    return f"{repository.current_db_path()}.vectors"
+
+
+def _paths(contact_id):
+    base = os.path.join(vector_dir(), f"{contact_id}.v{VERSION}")
+    return base + ".vec", base + ".ids"
+
+
+def _row_count(vec_path, ids_path):
+    """Rows present in both files (a crash between the two appends leaves extra vectors)."""
+    if not os.path.exists(ids_path) or not os.path.exists(vec_path):
+        return 0
+    return min(os.path.getsize(ids_path) // 8, os.path.getsize(vec_path) // (DIM * 4))
+
+
+def load(contact_id):
+    """(conv_ids, vectors) memory-mapped read-only, or None if the contact has no vectors."""
+    import numpy as np
+
+    vec_path, ids_path = _paths(contact_id)
+    n = _row_count(vec_path, ids_path)
+    if n == 0:
+        return None
+    ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(n,))
+    vectors = np.memmap(vec_path, dtype=np.float32, mode="r", shape=(n, DIM))
+    return ids, vectors
+
+
+def index_contact(conn, contact_id, batch=EMBED_BATCH):
+    """Embed and append the contact's messages not indexed yet. Returns how many were added.
+
+    Each batch runs in its own write transaction on `conn`, which also serialises
+    appends from concurrent ingests of the same contact.
+    """
+    import numpy as np
+
+    vec_path, ids_path = _paths(contact_id)
+    os.makedirs(vector_dir(), exist_ok=True)
+    added = 0
+    while True:
+        with repository.transaction_on(conn):
+            n = _row_count(vec_path, ids_path)
+            last = 0
+            if n:
+                last = int(np.memmap(ids_path, dtype=np.int64, mode="r", shape=(n,))[-1])
+            rows = conn.execute(SQL_TO_INDEX, (contact_id, last, batch)).fetchall()
+            # archived messages too, e.g. after a --rebuild
+            rows = sorted(rows + archive.after_conv_id(conn, contact_id, last, batch))[:batch]
+            if not rows:
+                return added
+            vectors = embed([text for _, text in rows])
+            # vectors first: a row id is only ever visible once its vector is on disk
+            with open(vec_path, "ab") as f:
+                f.truncate(n * DIM * 4)
+                f.write(vectors.tobytes())
+            with open(ids_path, "ab") as f:
+                f.truncate(n * 8)
+                f.write(np.fromiter((conv_id for conv_id, _ in rows), dtype=np.int64,
+                                    count=len(rows)).tobytes())
+        added += len(rows)
+
+
+def search(contact_id, query, k=5, budget_ms=SEARCH_BUDGET_MS, min_similarity=MIN_SIMILARITY):
+    """Top-k [(conv_id, similarity)] for `query`, best first.
+
+    Scores the newest rows first and stops once `budget_ms` is spent, so on a
+    very long history the oldest messages may not be considered.
+    """
+    import numpy as np
+
+    loaded = load(contact_id)
+    if loaded is None:
+        return []
+    query_vec = embed([query])[0]
+    if not query_vec.any():
+        return []
+    ids, vectors = loaded
+    start = time.perf_counter()
+    best_ids, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    end = len(ids)
+    while end > 0:
+        begin = max(0, end - SEARCH_BLOCK_ROWS)
+        scores = vectors[begin:end] @ query_vec
+        keep = np.flatnonzero(scores >= min_similarity)
+        if keep.size > k:
+            keep = keep[np.argpartition(scores[keep], -k)[-k:]]
+        best_ids = np.concatenate([best_ids, ids[begin:end][keep]])
+        best_scores = np.concatenate([best_scores, scores[keep]])
+        end = begin
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            break
+    order = np.argsort(-best_scores, kind="stable")[:k]
+    tracing.annotate(similarity_rows=len(ids) - end, similarity_truncated=end > 0)
+    return [(int(best_ids[i]), float(best_scores[i])) for i in order]
+
+
+def rebuild(progress=print):
+    """Drop every vector file and index all contacts again."""
+    shutil.rmtree(vector_dir(), ignore_errors=True)
+    total = 0
+    with repository.connection() as conn:
+        ids = [r[0] for r in conn.execute(SQL_CONTACT_IDS)]
+        for i, cid in enumerate(ids, 1):
+            total += index_contact(conn, cid)
+            if progress and (i % 1000 == 0 or i == len(ids)):
+                progress(f"  {i:,}/{len(ids):,} contacts, {total:,} messages")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local similarity search over a contact's messages.")
+    parser.add_argument("contact_id", nargs="?", type=int)
+    parser.add_argument("query", nargs="?")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--rebuild", action="store_true", help="re-index every contact from scratch")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        count = rebuild()
+        print(f"Indexed {count:,} messages in {time.perf_counter() - start:.2f}s")
+    if args.contact_id is not None and args.query:
+        with repository.connection() as conn:
+            index_contact(conn, args.contact_id)
+            start = time.perf_counter()
+            hits = search(args.contact_id, args.query, args.k, budget_ms=float("inf"))
+            elapsed = (time.perf_counter() - start) * 1000
+            for conv_id, score in hits:
+                row = conn.execute("SELECT conv_id, ts, timestamp, direction, text FROM conversations "
+                                   "WHERE conv_id=?", (conv_id,)).fetchone()
+                _, _, timestamp, direction, text = row or archive.by_ids(conn, args.contact_id, [conv_id])[conv_id]
+                print(f"{score:.2f} [{timestamp}] {direction}: {text}")
+        print(f"{len(hits)} hits in {elapsed:.1f}ms")
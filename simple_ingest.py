@@ -1,47 +1,190 @@
-import pandas as pd
-import sqlite3
+import argparse
+import contextvars
+import threading
+import time
+import traceback
 
-DB = "bondkeeper.db"
+import health
+import repository
+import similarity
+import suggestion_cache
+import tracing
+from schema import message_hashes, to_epoch
+
+# Rows read from the CSV and written per transaction. Memory use is bounded by
+# this, not by the size of the input file.
+CHUNK_SIZE = 50_000
+
+CSV_COLUMNS = ["timestamp", "direction", "text"]
 
 def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS contacts(
-        contact_id INTEGER PRIMARY KEY, 
-        name TEXT, 
-        notes TEXT
-    )
-    """)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS conversations(
-        conv_id INTEGER PRIMARY KEY, 
-        contact_id INTEGER,
-        timestamp TEXT,
-        direction TEXT,
-        text TEXT
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-def ingest(csv_path, contact_name):
-    df = pd.read_csv(csv_path)
-
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-
-    cur.execute("INSERT INTO contacts(name, notes) VALUES (?,?)", (contact_name, ""))
-    cid = cur.lastrowid
-
-    for _, r in df.iterrows():
-        cur.execute("""INSERT INTO conversations(contact_id, timestamp, direction, text)
-                       VALUES (?,?,?,?)""",
-                    (cid, r['timestamp'], r['direction'], r['text']))
-    conn.commit()
-    conn.close()
-    print(f"Imported {len(df)} messages for {contact_name} (ID={cid})")
+    # the pool migrates the schema when it opens its first connection
+    with repository.connection():
+        pass
+
+def iter_chunks(csv_path, chunksize=CHUNK_SIZE):
+    """Yield the CSV as DataFrames of at most `chunksize` rows, with NaN turned into None.
+
+    `csv_path` may also be an open file-like object (e.g. an uploaded buffer).
+    Compressed files (.gz etc.) are decompressed on the fly, based on the extension.
+    """
+    import pandas as pd  # deferred so importing this module (e.g. from the UI) stays cheap
+    reader = pd.read_csv(csv_path, usecols=CSV_COLUMNS, dtype=str, chunksize=chunksize)
+    for chunk in reader:
+        yield chunk.astype(object).where(chunk.notna(), None)
+
+def normalize_chunk(chunk, seen=None):
+    """Turn a raw chunk into (timestamp, ts, direction, text, msg_hash) tuples ready to insert.
+
+    Pass the same `seen` dict for every chunk of a file (see schema.message_hashes).
+    """
+    ts = to_epoch(chunk["timestamp"])
+    hashes = message_hashes(ts, chunk["timestamp"], chunk["direction"], chunk["text"], seen)
+    return list(zip(chunk["timestamp"], ts, chunk["direction"], chunk["text"], hashes))
+
+def write_chunk(conn, contact_id, rows):
+    """Insert normalised rows for one contact in their own transaction. Returns the number added."""
+    with tracing.span("write_chunk", rows=len(rows)):
+        with repository.transaction_on(conn):
+            added = repository.insert_messages(conn, ((contact_id, *row) for row in rows))
+            if added:
+                suggestion_cache.invalidate_contact(conn, contact_id)
+                repository.bump_data_version(conn)
+    return added
+
+def ingest(csv_path, contact_name, chunksize=CHUNK_SIZE, synchronous="NORMAL", contact_key=None,
+           progress=None, cancel=None):
+    """Stream `csv_path` (a path or file-like object) into the database, one transaction per chunk.
+
+    The contact is matched by `contact_key` (default: its normalised name) and
+    created only if new. Messages already stored for the contact are skipped, so
+    re-importing an updated export only writes the new rows.
+
+    `progress(rows, inserted)` is called after every chunk. If the `cancel` event
+    is set, the import stops before the next chunk; chunks already written stay
+    (re-importing later picks up where it stopped).
+
+    Returns a dict with contact_id, inserted, skipped, cancelled and the trace.
+    """
+    cancelled = False
+    with tracing.trace("ingest", contact=contact_name) as t:
+        start = time.perf_counter()
+        with repository.connection() as conn:
+            # synchronous is per-connection; put the pool default back before returning it
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+            try:
+                with repository.transaction_on(conn):
+                    cid, created = repository.resolve_contact(conn, contact_name, contact_key)
+                    if created:
+                        repository.bump_data_version(conn)
+
+                total = inserted = 0
+                chunks = iter_chunks(csv_path, chunksize)
+                seen = {}
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        cancelled = True
+                        break
+                    with tracing.span("parse_chunk"):
+                        chunk = next(chunks, None)
+                        rows = normalize_chunk(chunk, seen) if chunk is not None else None
+                    if rows is None:
+                        break
+                    inserted += write_chunk(conn, cid, rows)
+                    total += len(rows)
+                    if progress is not None:
+                        progress(total, inserted)
+                if inserted or created:
+                    with tracing.span("health"), repository.transaction_on(conn):
+                        health.update_contacts(conn, [cid])
+                if inserted:
+                    with tracing.span("similarity_index"):
+                        similarity.index_contact(conn, cid)
+            finally:
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else float("inf")
+        skipped = total - inserted
+        tracing.annotate(contact_id=cid, rows=total, inserted=inserted, skipped=skipped, rows_per_sec=rate,
+                         cancelled=cancelled)
+    print(f"Imported {inserted} new messages for {contact_name} (ID={cid}), skipped {skipped} already present, "
+          f"in {elapsed:.2f}s ({rate:,.0f} rows/sec)" + (" [cancelled]" if cancelled else ""))
+    return {"contact_id": cid, "inserted": inserted, "skipped": skipped, "cancelled": cancelled,
+            "trace": t.to_dict()}
+
+class IngestJob:
+    """Runs ingest() on a background thread so a UI can poll it and cancel it.
+
+    `source` is a path or file-like object; pass the upload's `size` in bytes to
+    get a progress fraction from how far the reader has got into the buffer.
+    """
+
+    def __init__(self, source, contact_name, size=None, **kwargs):
+        self.contact_name = contact_name
+        self.size = size
+        self.rows = 0
+        self.inserted = 0
+        self.bytes_read = 0
+        self.report = None
+        self.error = None
+        self._source = source
+        self._kwargs = kwargs
+        self._cancel = threading.Event()
+        # the thread writes to the shard that was current when the job was created
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), name=f"ingest-{contact_name}",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.report = ingest(self._source, self.contact_name, progress=self._progress,
+                                 cancel=self._cancel, **self._kwargs)
+        except Exception:
+            self.error = traceback.format_exc()
+
+    def _progress(self, rows, inserted):
+        self.rows, self.inserted = rows, inserted
+        if hasattr(self._source, "tell"):
+            self.bytes_read = self._source.tell()
+
+    @property
+    def fraction(self):
+        """Share of the input consumed so far (0..1), or None if the size is unknown."""
+        if self.done:
+            return 1.0
+        if not self.size:
+            return None
+        return min(self.bytes_read / self.size, 1.0)
+
+    @property
+    def done(self):
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return self.done
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Initialize the BondKeeper DB and optionally import a CSV.")
+    parser.add_argument("csv_path", nargs="?", help="CSV with columns timestamp,direction,text")
+    parser.add_argument("contact_name", nargs="?", help="Contact the messages belong to")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument("--contact-key", help="stable contact key (default: the normalised contact name)")
+    args = parser.parse_args()
+
     init_db()
     print("BondKeeper database initialized.")
+    if args.csv_path:
+        if not args.contact_name:
+            parser.error("contact_name is required when csv_path is given")
+        ingest(args.csv_path, args.contact_name, chunksize=args.chunksize,
+               synchronous=args.synchronous, contact_key=args.contact_key)
@@ -10,10 +10,25 @@
 #     USE_MOCK=1
 
 import os
-import sqlite3
+import re
 import json
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import Optional
 from dotenv import load_dotenv
 
+import context_builder
+import model_catalog
+import model_router
+import repository
+import suggestion_cache
+import tracing
+
 load_dotenv()
 
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
@@ -43,35 +58,41 @@ Return JSON only, no extra commentary. Example:
 { "short": "...", "neutral": "...", "warm": "...", "action": "..." }
 """
 
-DB = "bondkeeper.db"
-
-# Try import of Google GenAI SDK
+# The Google GenAI SDK (and the protobuf/grpc stack behind it) is imported on the
+# first real API call, not here: mock mode, cached answers and the UI's first
+# paint never pay for it. Only check that it is installed.
 try:
-    import google.generativeai as genai
-    from google.api_core import exceptions as google_exceptions
-    HAVE_GENAI = True
-except Exception:
-    genai = None
-    google_exceptions = None
+    HAVE_GENAI = find_spec("google.generativeai") is not None
+except (ImportError, ValueError):
     HAVE_GENAI = False
 
+_genai = None
+_genai_lock = threading.Lock()
+
+def load_genai():
+    """Import and configure the SDK once per process; returns the module."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                with tracing.span("sdk_import"):
+                    import google.generativeai as genai
+                    genai.configure(api_key=GEMINI_KEY)
+                _genai = genai
+    return _genai
+
+@lru_cache(maxsize=16)
+def get_model(model_name):
+    """Process-wide GenerativeModel per name. All of them share the SDK's configured
+    client, so its connection is reused instead of rebuilt on every generation."""
+    return load_genai().GenerativeModel(model_name)
+
 def get_context(contact_id):
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("SELECT name, notes FROM contacts WHERE contact_id=?", (contact_id,))
-    row = cur.fetchone()
+    row = repository.get_contact(contact_id)
     if row is None:
-        conn.close()
         raise ValueError(f"No contact found with ID {contact_id}. Please run ingestion first.")
     name, notes = row
-    cur.execute("""
-        SELECT timestamp, direction, text
-        FROM conversations
-        WHERE contact_id=?
-        ORDER BY timestamp DESC LIMIT 5
-    """, (contact_id,))
-    messages = cur.fetchall()
-    conn.close()
+    messages = repository.recent_messages(contact_id, limit=5)
     return name, notes, messages
 
 def list_available_model_names():
@@ -79,12 +100,7 @@ def list_available_model_names():
     if not HAVE_GENAI or not GEMINI_KEY:
         return []
     try:
-        # configure if required
-        try:
-            genai.configure(api_key=GEMINI_KEY)
-        except Exception:
-            pass
-        models = list(genai.list_models())
+        models = list(load_genai().list_models())
     except Exception:
         return []
 
@@ -97,98 +113,381 @@ def list_available_model_names():
         names.append(name)
     return names
 
-def choose_best_model():
-    """Pick the best preferred model that exists in the account; return model name or None."""
-    available = list_available_model_names()
-    if not available:
-        return None
-
+def pick_model(available):
+    """Pick the best preferred model from a list of available names, or None."""
     lowered = [a.lower() for a in available]
     # Try matching preferred models in order
     for pref in PREFERRED_MODELS:
-        for name in available:
-            if pref.lower() == name.lower() or pref.lower() in name.lower():
+        pref = pref.lower()
+        for name, ln in zip(available, lowered):
+            if pref == ln or pref in ln:
                 return name
     # Fallback heuristics: pick first model with 'gemini' or 'bison' in the name
-    for name in available:
-        ln = name.lower()
+    for name, ln in zip(available, lowered):
         if "gemini" in ln or "bison" in ln or "text" in ln:
             return name
     return None
 
-def generate_suggestions(contact_id=1):
-    # gather context
-    name, notes, messages = get_context(contact_id)
-    user_prompt = f"Contact: {name}\nNotes: {notes}\nRecent messages: {messages}\n\nTask: return JSON with short, neutral, warm, action."
+def preferred_available(available):
+    """The available models that match PREFERRED_MODELS, one per preference, best first."""
+    out = []
+    lowered = [a.lower() for a in available]
+    for pref in PREFERRED_MODELS:
+        pref = pref.lower()
+        match = next((name for name, ln in zip(available, lowered) if ln == pref), None) \
+            or next((name for name, ln in zip(available, lowered) if pref in ln), None)
+        if match and match not in out:
+            out.append(match)
+    return out
 
-    # forced mock mode
-    if USE_MOCK:
-        print("USE_MOCK is enabled — returning mock suggestions.")
-        print(json.dumps({
-            "short": "Hey — checking in. Coffee this week?",
-            "neutral": "I heard you're swamped. If you'd like, I can help break the task into small steps and assist.",
-            "warm": "I'm really sorry things have been tough. I'm here for you — want to talk Friday evening and make a plan?",
-            "action": "Propose a 30-minute check-in call and share a 3-step plan."
-        }, indent=2))
-        return
+def choose_best_model():
+    """Pick the best preferred model that exists in the account; return model name or None.
 
-    # missing library or key => show prompt + mock for reproducibility
+    The choice is cached on disk (see model_catalog.py), so warm calls skip
+    list_models() entirely.
+    """
     if not HAVE_GENAI or not GEMINI_KEY:
-        print("=== GEMINI SDK or API KEY MISSING ===")
-        print("SYSTEM_INSTRUCTION:\n", SYSTEM_INSTRUCTION)
-        print("\nUSER_PROMPT:\n", user_prompt)
-        print("\nMock JSON (for Kaggle/demo):")
-        print(json.dumps({
-            "short": "Hey — checking in. Coffee this week?",
-            "neutral": "I heard you're swamped. If you'd like, I can help break the task into small steps and assist.",
-            "warm": "I'm really sorry things have been tough. I'm here for you — want to talk Friday evening and make a plan?",
-            "action": "Propose a 30-minute check-in call and share a 3-step plan."
-        }, indent=2))
-        return
+        return None
+    return model_catalog.cached_model(list_available_model_names, pick_model,
+                                      model_catalog.fingerprint(GEMINI_KEY, PREFERRED_MODELS))
 
-    # choose model
-    model_name = choose_best_model()
-    if not model_name:
-        print("No suitable model discovered. Falling back to mock output.")
-        print(json.dumps({
-            "short": "Hey — checking in. Coffee this week?",
-            "neutral": "I heard you're swamped. If you'd like, I can help break the task into small steps and assist.",
-            "warm": "I'm really sorry things have been tough. I'm here for you — want to talk Friday evening and make a plan?",
-            "action": "Propose a 30-minute check-in call and share a 3-step plan."
-        }, indent=2))
+def routing_candidates():
+    """Models model_router may choose from: the account's preferred models, best first."""
+    best = choose_best_model()  # also makes sure the catalog has been discovered
+    if not best:
+        return []
+    models = model_catalog.cached_models(model_catalog.fingerprint(GEMINI_KEY, PREFERRED_MODELS))
+    return preferred_available(models) or [best]
+
+def record_call(model_name, start, outcome):
+    """Feed one call's latency/outcome to the router; never fails the generation."""
+    try:
+        model_router.record(model_name, (time.perf_counter() - start) * 1000, outcome)
+    except sqlite3.Error:
+        pass
+
+def record_failure(model_name, start, exc):
+    """Record a failed call; returns True if it was a quota error (worth failing over)."""
+    quota = is_quota_error(exc)
+    record_call(model_name, start, "quota" if quota else "error")
+    return quota
+
+def build_prompt(contact_id):
+    """Prompt for a contact: recent turns within CONTEXT_TOKEN_BUDGET plus a summary of older history."""
+    with tracing.span("context"):
+        context = context_builder.build_context(contact_id)
+    prompt = context_builder.build_prompt_text(*context)
+    tracing.annotate(prompt_tokens_est=context_builder.estimate_tokens(prompt))
+    return prompt
+
+def _record_usage(resp):
+    """Copy the SDK's token counts (if the response has them) onto the current trace."""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
         return
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if prompt_tokens is not None:
+        tracing.annotate(prompt_tokens=prompt_tokens)
+    if response_tokens is not None:
+        tracing.annotate(response_tokens=response_tokens)
+
+def call_model(model_name, user_prompt):
+    """Send one prompt to `model_name` and return the response text. Raises on API errors."""
+    with tracing.span("model_client"):
+        model = get_model(model_name)
+    with tracing.span("generate_content"):
+        resp = model.generate_content(SYSTEM_INSTRUCTION + "\n\n" + user_prompt)
+    _record_usage(resp)
+    return getattr(resp, "text", None) or str(resp)
+
+def stream_model(model_name, user_prompt):
+    """Like call_model, but yields text chunks as the model produces them."""
+    with tracing.span("model_client"):
+        model = get_model(model_name)
+    with tracing.span("generate_content"):
+        start = time.perf_counter()
+        resp = model.generate_content(SYSTEM_INSTRUCTION + "\n\n" + user_prompt, stream=True)
+        for chunk in resp:
+            text = getattr(chunk, "text", None)
+            if text:
+                if start is not None:
+                    tracing.annotate(first_chunk_ms=(time.perf_counter() - start) * 1000)
+                    start = None
+                yield text
+    _record_usage(resp)
+
+def is_quota_error(exc):
+    """Heuristic check for quota/billing (HTTP 429) errors."""
+    # only look at the SDK's exception types if something already imported them
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is not None and isinstance(exc, google_exceptions.ResourceExhausted):
+        return True
+    err_str = str(exc).lower()
+    return ("quota" in err_str) or ("resourceexhausted" in err_str) or ("429" in err_str)
+
+# --- Result parsing
+
+SUGGESTION_FIELDS = ("short", "neutral", "warm", "action")
 
-    print(f"Selected model: {model_name}")
+MOCK_SUGGESTIONS = {
+    "short": "Hey — checking in. Coffee this week?",
+    "neutral": "I heard you're swamped. If you'd like, I can help break the task into small steps and assist.",
+    "warm": "I'm really sorry things have been tough. I'm here for you — want to talk Friday evening and make a plan?",
+    "action": "Propose a 30-minute check-in call and share a 3-step plan."
+}
 
-    # Attempt real API call with graceful fallback
+@dataclass
+class SuggestionResult:
+    """Suggestions for one contact plus where they came from.
+
+    source is "model", "cache", "mock", "raw" (model answered but not with JSON) or
+    "precomputed" (read from ready_suggestions, see precompute.py).
+    fallback_reason says why mock output was used: "use_mock", "missing_key",
+    "no_model", "quota" or "error".
+    """
+    short: str = ""
+    neutral: str = ""
+    warm: str = ""
+    action: str = ""
+    model: Optional[str] = None
+    source: str = "model"
+    fallback_reason: Optional[str] = None
+    error: Optional[str] = None
+    raw: Optional[str] = None
+    prompt: Optional[str] = None
+    route: Optional[dict] = None
+    trace: Optional[dict] = field(default=None, repr=False)
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        return cls(**{f: str(data.get(f) or "") for f in SUGGESTION_FIELDS}, **kwargs)
+
+    def as_dict(self):
+        return {f: getattr(self, f) for f in SUGGESTION_FIELDS}
+
+def _strip_fences(text):
+    # models often wrap JSON in ```json ... ``` despite the instruction
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text
+
+def parse_suggestion_json(text):
+    """Parse a complete model answer into a dict. Raises ValueError if it is not a JSON object."""
+    parsed = json.loads(_strip_fences(text))
+    if not isinstance(parsed, dict):
+        raise ValueError("model output is not a JSON object")
+    return parsed
+
+_FIELD_START = re.compile(r'"(%s)"\s*:\s*"' % "|".join(SUGGESTION_FIELDS))
+
+def parse_partial_json(text):
+    """Best-effort extraction of the suggestion fields from a JSON prefix.
+
+    Returns {field: text so far}; a field whose closing quote has not arrived yet
+    holds the partial string.
+    """
+    fields = {}
+    for m in _FIELD_START.finditer(text):
+        i = m.end()
+        chars = []
+        while i < len(text):
+            c = text[i]
+            if c == '"':
+                break
+            if c == "\\":
+                if i + 1 >= len(text):
+                    break  # escape sequence split across chunks
+                if text[i + 1] == "u":
+                    if i + 6 > len(text):
+                        break
+                    chars.append(text[i:i + 6])
+                    i += 6
+                    continue
+                chars.append(text[i:i + 2])
+                i += 2
+                continue
+            chars.append(c)
+            i += 1
+        try:
+            fields[m.group(1)] = json.loads('"' + "".join(chars) + '"')
+        except ValueError:
+            fields[m.group(1)] = "".join(chars)
+    return fields
+
+# --- Generation API
+
+def _prepare(contact_id, use_mock, model_name=None, injected=False, user_prompt=None):
+    """Shared front half of get_suggestions/stream_suggestions.
+
+    Returns (result, None, None, None) when the answer is already known (mock or cache),
+    otherwise (None, models, user_prompt, cache_key) where models is the chosen model
+    followed by its failover chain, and cache_key is for the chosen model.
+    """
+    user_prompt = user_prompt or build_prompt(contact_id)
+    if use_mock:
+        return SuggestionResult.from_dict(MOCK_SUGGESTIONS, source="mock", fallback_reason="use_mock",
+                                          prompt=user_prompt), None, None, None
+    if not injected and (not HAVE_GENAI or not GEMINI_KEY):
+        return SuggestionResult.from_dict(MOCK_SUGGESTIONS, source="mock", fallback_reason="missing_key",
+                                          prompt=user_prompt), None, None, None
+    with tracing.span("choose_model"):
+        if model_name:
+            chain = [model_name]
+        else:
+            route = model_router.route(context_builder.estimate_tokens(user_prompt), routing_candidates())
+            chain = route.chain if route else []
+            if route:
+                tracing.annotate(route=route.as_dict())
+    model_name = chain[0] if chain else None
+    if not model_name:
+        return SuggestionResult.from_dict(MOCK_SUGGESTIONS, source="mock", fallback_reason="no_model",
+                                          prompt=user_prompt), None, None, None
+    # identical (model, instruction, prompt) => identical answer; skip the API call
+    key = suggestion_cache.cache_key(model_name, SYSTEM_INSTRUCTION, user_prompt)
+    with tracing.span("cache_lookup"):
+        cached = suggestion_cache.get(key)
+    if cached is not None:
+        return SuggestionResult.from_dict(cached, model=model_name, source="cache",
+                                          prompt=user_prompt), None, None, None
+    return None, chain, user_prompt, key
+
+def _finish(contact_id, model_name, user_prompt, key, text):
     try:
-        genai.configure(api_key=GEMINI_KEY)
-        model = genai.GenerativeModel(model_name)
-        resp = model.generate_content(SYSTEM_INSTRUCTION + "\n\n" + user_prompt)
-        text = getattr(resp, "text", None) or str(resp)
-        # Try to parse JSON if model returned JSON string
+        with tracing.span("parse"):
+            parsed = parse_suggestion_json(text)
+    except ValueError:
+        return SuggestionResult(model=model_name, source="raw", raw=text, prompt=user_prompt)
+    with tracing.span("cache_store"):
+        suggestion_cache.put(key, contact_id, model_name, parsed)
+    return SuggestionResult.from_dict(parsed, model=model_name, source="model", raw=text, prompt=user_prompt)
+
+def _failed(model_name, user_prompt, exc):
+    return SuggestionResult.from_dict(MOCK_SUGGESTIONS, model=model_name, source="mock",
+                                      fallback_reason="quota" if is_quota_error(exc) else "error",
+                                      error=str(exc), prompt=user_prompt)
+
+def _annotate_result(result):
+    tracing.annotate(source=result.source, model=result.model, prompt_chars=len(result.prompt or ""))
+    if result.fallback_reason:
+        tracing.annotate(fallback_reason=result.fallback_reason)
+    elif result.source == "raw":
+        tracing.annotate(fallback_reason="parse_failure")
+    if result.raw is not None:
+        tracing.annotate(response_chars=len(result.raw))
+
+def get_suggestions(contact_id=1, use_mock=None, call=None, model_name=None, user_prompt=None):
+    """Generate suggestions for a contact and return a SuggestionResult.
+
+    Never raises for model/API problems; those come back as mock output with
+    fallback_reason set. Raises ValueError for an unknown contact.
+    `call(model_name, user_prompt) -> text` replaces the Gemini call (e.g. with
+    fake_model.FakeModel); `model_name` skips model discovery; `user_prompt` is a
+    prompt the caller already built with build_prompt(contact_id).
+    The stage timings of the run are attached as result.trace.
+    """
+    with tracing.trace("generate", contact_id=contact_id) as t:
+        result = _get_suggestions(contact_id, use_mock, call, model_name, user_prompt)
+        _annotate_result(result)
+    result.trace = t.to_dict()
+    result.route = t.attrs.get("route")
+    return result
+
+def _get_suggestions(contact_id, use_mock, call, model_name, user_prompt=None):
+    use_mock = USE_MOCK if use_mock is None else use_mock
+    result, chain, user_prompt, key = _prepare(contact_id, use_mock, model_name, call is not None, user_prompt)
+    if result is not None:
+        return result
+    for i, model_name in enumerate(chain):
+        start = time.perf_counter()
         try:
-            parsed = json.loads(text)
-            print(json.dumps(parsed, indent=2))
-        except Exception:
-            # If not JSON, print raw text
-            print("Model output (raw):")
-            print(text)
-    except Exception as e:
-        # detect quota/billing errors heuristically
-        err_str = str(e).lower()
-        is_quota = ("quota" in err_str) or ("resourceexhausted" in err_str) or ("429" in err_str)
-        print("API call failed:", e)
-        if is_quota:
+            text = (call or call_model)(model_name, user_prompt)
+        except Exception as e:
+            if record_failure(model_name, start, e) and i + 1 < len(chain):
+                tracing.annotate(failovers=i + 1)
+                continue  # quota: the next model in the chain has its own quota
+            return _failed(model_name, user_prompt, e)
+        record_call(model_name, start, "ok")
+        if i:
+            key = suggestion_cache.cache_key(model_name, SYSTEM_INSTRUCTION, user_prompt)
+        return _finish(contact_id, model_name, user_prompt, key, text)
+
+def stream_suggestions(contact_id=1, use_mock=None):
+    """Generator version of get_suggestions.
+
+    Yields SuggestionResult snapshots whose fields fill in as the model streams
+    its JSON; the last one yielded is the final result (with .trace set). Mock
+    and cached answers are yielded once.
+    """
+    pending = None
+    with tracing.trace("generate", contact_id=contact_id, streaming=True) as t:
+        # hold back one snapshot so the final one can carry the finished trace
+        for snapshot in _stream_suggestions(contact_id, use_mock):
+            if pending is not None:
+                yield pending
+            pending = snapshot
+        _annotate_result(pending)
+    pending.trace = t.to_dict()
+    pending.route = t.attrs.get("route")
+    yield pending
+
+def _stream_suggestions(contact_id, use_mock):
+    use_mock = USE_MOCK if use_mock is None else use_mock
+    result, chain, user_prompt, key = _prepare(contact_id, use_mock)
+    if result is not None:
+        yield result
+        return
+    for i, model_name in enumerate(chain):
+        text = ""
+        start = time.perf_counter()
+        try:
+            for chunk in stream_model(model_name, user_prompt):
+                text += chunk
+                yield SuggestionResult.from_dict(parse_partial_json(text), model=model_name,
+                                                 source="model", prompt=user_prompt)
+        except Exception as e:
+            # fail over only before anything was shown
+            if record_failure(model_name, start, e) and not text and i + 1 < len(chain):
+                tracing.annotate(failovers=i + 1)
+                continue
+            yield _failed(model_name, user_prompt, e)
+            return
+        record_call(model_name, start, "ok")
+        if i:
+            key = suggestion_cache.cache_key(model_name, SYSTEM_INSTRUCTION, user_prompt)
+        yield _finish(contact_id, model_name, user_prompt, key, text)
+        return
+
+def generate_suggestions(contact_id=1):
+    """CLI helper: generate suggestions for a contact and print them."""
+    result = get_suggestions(contact_id)
+    if result.fallback_reason == "use_mock":
+        print("USE_MOCK is enabled — returning mock suggestions.")
+    elif result.fallback_reason == "missing_key":
+        print("=== GEMINI SDK or API KEY MISSING ===")
+        print("SYSTEM_INSTRUCTION:\n", SYSTEM_INSTRUCTION)
+        print("\nUSER_PROMPT:\n", result.prompt)
+        print("\nMock JSON (for Kaggle/demo):")
+    elif result.fallback_reason == "no_model":
+        print("No suitable model discovered. Falling back to mock output.")
+    elif result.fallback_reason in ("quota", "error"):
+        print("API call failed:", result.error)
+        if result.fallback_reason == "quota":
             print("Quota/billing issue detected. Falling back to mock output.")
         else:
             print("Falling back to mock output due to error.")
-        print(json.dumps({
-            "short": "Hey — checking in. Coffee this week?",
-            "neutral": "I heard you're swamped. If you'd like, I can help break the task into small steps and assist.",
-            "warm": "I'm really sorry things have been tough. I'm here for you — want to talk Friday evening and make a plan?",
-            "action": "Propose a 30-minute check-in call and share a 3-step plan."
-        }, indent=2))
+    else:
+        print(f"Selected model: {result.model}" + (" (cached)" if result.source == "cache" else ""))
+
+    if result.source == "raw":
+        print("Model output (raw):")
+        print(result.raw)
+    else:
+        print(json.dumps(result.as_dict(), indent=2))
+    return result
 
 if __name__ == "__main__":
     try:
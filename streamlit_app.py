@@ -1,10 +1,14 @@
 # streamlit_app.py (comfy, colorful UI)
 import streamlit as st
-import pandas as pd
-import sqlite3
-import io, sys, traceback, os, json
-from simple_ingest import init_db, ingest
-from simple_prompt_call import generate_suggestions as llm_generate
+import traceback, os, io, json, html, time
+import health
+import precompute
+import repository
+import search
+import suggestion_cache
+import tracing
+from simple_ingest import IngestJob, init_db
+from simple_prompt_call import stream_suggestions
 
 # --- Page config
 st.set_page_config(
@@ -113,9 +117,46 @@ with st.container():
         unsafe_allow_html=True,
     )
 
+# --- Background CSV import: progress is polled by a fragment, so only this part
+# of the page reruns while the import thread works.
+IMPORT_CHUNK_SIZE = 10_000
+
+@st.fragment(run_every=0.5)
+def import_progress():
+    repository.set_shard(st.session_state.get("workspace", ""))  # fragment runs skip the script top
+    job = st.session_state.get("import_job")
+    if job is None:
+        return
+    if not job.done:
+        fraction = job.fraction
+        st.progress(fraction or 0.0, text=f"Importing {job.contact_name}: {job.rows:,} rows read, "
+                                           f"{job.inserted:,} new")
+        if st.button("Cancel import"):
+            job.cancel()
+        return
+    del st.session_state["import_job"]
+    if job.error:
+        st.session_state["import_message"] = ("error", "Import failed:\n" + job.error)
+    else:
+        report = job.report
+        st.session_state["last_trace"] = report["trace"]
+        text = (f"Imported {report['inserted']} new messages for {job.contact_name} "
+                f"({report['skipped']} already present)")
+        if report["cancelled"]:
+            st.session_state["import_message"] = ("warning", text + ". Cancelled; import again to finish.")
+        else:
+            st.session_state["import_message"] = ("success", text)
+    st.rerun()  # full rerun so the contacts panel and caches see the new data
+
 # --- Sidebar settings
 with st.sidebar:
     st.header("Controls")
+    # every workspace has its own database file (see repository.shard_path);
+    # ?workspace=name in the URL preselects one
+    if "workspace" not in st.session_state:
+        st.session_state["workspace"] = st.query_params.get("workspace", "")
+    st.text_input("Workspace", key="workspace", placeholder="default", help="Each workspace has its own database")
+    repository.set_shard(st.session_state["workspace"])
     if st.button("Initialize Database"):
         try:
             init_db()
@@ -129,20 +170,24 @@ with st.sidebar:
     uploaded = st.file_uploader("Upload message CSV", type=["csv"])
     contact_name = st.text_input("Contact Name (for import)", value="")
 
-    if st.button("Import messages"):
+    if st.button("Import messages", disabled="import_job" in st.session_state):
         if not uploaded:
             st.error("Upload a CSV first.")
         elif not contact_name.strip():
             st.error("Enter contact name before importing.")
         else:
-            try:
-                df = pd.read_csv(uploaded)
-                df.to_csv("uploaded_messages.csv", index=False)
-                ingest("uploaded_messages.csv", contact_name.strip())
-                st.success(f"Imported messages for {contact_name.strip()}")
-            except Exception:
-                st.error("Import failed")
-                st.text(traceback.format_exc())
+            # the upload is parsed straight from memory, chunk by chunk, on a background
+            # thread; nothing is written to disk and each session gets its own job
+            buffer = io.BytesIO(uploaded.getvalue())
+            st.session_state["import_job"] = IngestJob(buffer, contact_name.strip(), size=uploaded.size,
+                                                       chunksize=IMPORT_CHUNK_SIZE).start()
+            st.session_state.pop("import_message", None)
+
+    if "import_job" in st.session_state:
+        import_progress()
+    elif "import_message" in st.session_state:
+        level, text = st.session_state["import_message"]
+        getattr(st, level)(text)
 
     st.markdown("---")
     st.markdown("**Demo Options**")
@@ -153,6 +198,47 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("Made with ❤️ — Keep relationships real")
 
+# --- Optional /metrics endpoint for Prometheus (once per server process)
+@st.cache_resource
+def start_metrics_server(port):
+    return tracing.serve_metrics(port)
+
+if os.getenv("BONDKEEPER_METRICS_PORT"):
+    start_metrics_server(int(os.getenv("BONDKEEPER_METRICS_PORT")))
+
+# --- Cached data for the contacts panel. `version` is repository.data_version(),
+# which ingest bumps, so cached pages are dropped as soon as the data changes;
+# `shard` keeps workspaces with the same version number apart.
+CONTACTS_PAGE_SIZE = 25
+SEARCH_RESULTS = 20
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def count_contacts_cached(shard, version, name_filter):
+    return repository.count_contacts(name_filter)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_contact_page(shard, version, name_filter, page):
+    return repository.contact_previews(name_filter, limit=CONTACTS_PAGE_SIZE,
+                                       offset=(page - 1) * CONTACTS_PAGE_SIZE)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def search_cached(shard, version, query):
+    return search.search_messages(query, limit=SEARCH_RESULTS)
+
+def health_badge(h):
+    """One muted line summarising a contact's health row (empty if not computed yet)."""
+    if not h or h["urgency_key"] is None:
+        return ""
+    now = time.time()
+    parts = [f"urgency {health.urgency(h['urgency_key'], now):.0f}",
+             f"{(now - h['last_ts']) / health.DAY:.0f}d since last"]
+    if h["unanswered_inbound"]:
+        parts.append(f"{h['unanswered_inbound']} unanswered")
+    parts.append(f"{h['inbound']}/{h['outbound']} in/out")
+    if h["median_reply_secs"] is not None:
+        parts.append(f"replies in ~{h['median_reply_secs'] / 3600:.1f}h")
+    return f"<div class='small-muted'>{' · '.join(parts)}</div>"
+
 # --- Main content area
 col1, col2 = st.columns([1, 1.4], gap="large")
 
@@ -160,73 +246,84 @@ col1, col2 = st.columns([1, 1.4], gap="large")
 with col1:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Contacts")
+    contact_search = st.text_input("Search contacts", value="", placeholder="Name contains…")
     try:
-        conn = sqlite3.connect("bondkeeper.db")
-        cur = conn.cursor()
-        cur.execute("SELECT contact_id, name FROM contacts ORDER BY contact_id DESC")
-        contacts = cur.fetchall()
-        conn.close()
+        health.refresh_stale()  # contacts created since the last health update
+        version = repository.data_version()
+        total = count_contacts_cached(repository.current_db_path(), version, contact_search)
     except Exception:
-        contacts = []
+        version, total = None, 0
 
-    if not contacts:
-        st.info("No contacts found. Import messages to populate contacts.")
+    if not total:
+        if contact_search.strip():
+            st.info("No contacts match your search.")
+        else:
+            st.info("No contacts found. Import messages to populate contacts.")
     else:
-        for cid, name in contacts:
-            # fetch 2 latest messages preview for UI
-            conn = sqlite3.connect("bondkeeper.db")
-            cur = conn.cursor()
-            cur.execute("SELECT timestamp, direction, text FROM conversations WHERE contact_id=? ORDER BY timestamp DESC LIMIT 2", (cid,))
-            msgs = cur.fetchall()
-            conn.close()
-            preview = "<br/>".join([f"<span style='font-size:13px;color:var(--muted)'>[{m[0]}] {m[1]}: {m[2][:80]}...</span>" for m in msgs])
-            st.markdown(f"<div class='contact-item'><b>{name}</b> <span class='small-muted'> — id={cid}</span><div style='margin-top:6px'>{preview}</div></div>", unsafe_allow_html=True)
+        pages = (total + CONTACTS_PAGE_SIZE - 1) // CONTACTS_PAGE_SIZE
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+        contacts = load_contact_page(repository.current_db_path(), version, contact_search, page)
+        # one markdown element per page instead of one per contact; most urgent first
+        items = []
+        for cid, name, msgs, h in contacts:
+            badge = health_badge(h)
+            preview = "<br/>".join([f"<span style='font-size:13px;color:var(--muted)'>[{html.escape(str(m[0]))}] {html.escape(str(m[1]))}: {html.escape((m[2] or '')[:80])}...</span>" for m in msgs])
+            items.append(f"<div class='contact-item'><b>{html.escape(name or '')}</b> <span class='small-muted'> — id={cid}</span>{badge}<div style='margin-top:6px'>{preview}</div></div>")
+        st.markdown("".join(items), unsafe_allow_html=True)
+        st.caption(f"{total} contacts")
     st.markdown('</div>', unsafe_allow_html=True)
 
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Quick Actions")
     contact_id = st.number_input("Contact ID to generate for", min_value=1, value=1, step=1)
     if st.button("Generate Suggestions", key="gen_main"):
-        # call llm and capture output
         try:
-            # capture printed stdout from backend
-            temp_out = io.StringIO()
-            old_stdout = sys.stdout
-            sys.stdout = temp_out
-            try:
-                # respect mock toggle in sidebar
-                if use_mock:
-                    os.environ["USE_MOCK"] = "1"
-                else:
-                    if "USE_MOCK" in os.environ:
-                        os.environ.pop("USE_MOCK")
-                llm_generate(contact_id)
-            finally:
-                sys.stdout = old_stdout
-            output = temp_out.getvalue()
-            if output:
-                st.success("Suggestions generated below")
-                # try to parse JSON from output
-                try:
-                    parsed = json.loads(output)
-                    st.markdown("<div style='margin-top:8px'><b>Short</b></div>", unsafe_allow_html=True)
-                    st.write(parsed.get("short",""))
-                    st.markdown("<div style='margin-top:8px'><b>Neutral</b></div>", unsafe_allow_html=True)
-                    st.write(parsed.get("neutral",""))
-                    st.markdown("<div style='margin-top:8px'><b>Warm</b></div>", unsafe_allow_html=True)
-                    st.write(parsed.get("warm",""))
-                    st.markdown("<div style='margin-top:8px'><b>Action</b></div>", unsafe_allow_html=True)
-                    st.info(parsed.get("action",""))
-                    st.markdown("<hr/>", unsafe_allow_html=True)
-                    st.markdown("<div class='json-card'>" + json.dumps(parsed, indent=2) + "</div>", unsafe_allow_html=True)
-                except Exception:
-                    # fallback: show raw
-                    st.code(output, language="json")
+            # placeholders are filled progressively as the model streams its JSON
+            status = st.empty()
+            status.info("Generating…")
+            slots = {}
+            for field, label in (("short", "Short"), ("neutral", "Neutral"), ("warm", "Warm"), ("action", "Action")):
+                st.markdown(f"<div style='margin-top:8px'><b>{label}</b></div>", unsafe_allow_html=True)
+                slots[field] = st.empty()
+            result = None
+            # a suggestion precomputed by precompute.py for the current messages is shown
+            # at once; only on a miss do we wait for a live model round trip
+            ready = None if use_mock else precompute.get_ready(contact_id)
+            for result in ([ready] if ready is not None else stream_suggestions(contact_id, use_mock=use_mock)):
+                for field in ("short", "neutral", "warm"):
+                    slots[field].write(getattr(result, field))
+                if result.action:
+                    slots["action"].info(result.action)
+
+            if result is not None and result.trace:
+                st.session_state["last_trace"] = result.trace
+            if result is None:
+                status.warning("No output returned. Check logs/terminal.")
+            elif result.source == "raw":
+                status.warning(f"{result.model} did not return JSON; raw output below.")
+                st.code(result.raw, language="json")
             else:
-                st.warning("No output returned. Check logs/terminal.")
+                if result.fallback_reason:
+                    status.warning(f"Showing mock suggestions ({result.fallback_reason.replace('_', ' ')})."
+                                   + (f" {result.error}" if result.error else ""))
+                else:
+                    status.success(f"Suggestions generated below ({result.model}"
+                                   + (", cached" if result.source == "cache" else "")
+                                   + (", precomputed" if result.source == "precomputed" else "") + ")")
+                st.markdown("<hr/>", unsafe_allow_html=True)
+                st.markdown("<div class='json-card'>" + html.escape(json.dumps(result.as_dict(), indent=2)) + "</div>", unsafe_allow_html=True)
         except Exception:
             st.error("Failed to generate suggestions.")
             st.text(traceback.format_exc())
+    try:
+        cache_stats = suggestion_cache.stats()
+        st.caption(f"Suggestion cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0%}) · {cache_stats['entries']} entries")
+        queue = precompute.queue_counts()
+        if queue:
+            st.caption("Precompute queue: " + " · ".join(f"{n} {state}" for state, n in sorted(queue.items())))
+    except Exception:
+        pass
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Right column: instructions + logs
@@ -245,18 +342,48 @@ with col2:
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.markdown('<div class="card">', unsafe_allow_html=True)
-    st.subheader("Last run output (debug)")
-    try:
-        # show small tail of streamlit_server.log if present - helpful when deployed
-        log_path = ".streamlit/logs/debug.log"
-        if os.path.exists(log_path):
-            with open(log_path, "r", encoding="utf-8", errors="ignore") as f:
-                lines = f.readlines()[-40:]
-                st.text("".join(lines))
+    st.subheader("Search messages")
+    query = st.text_input("Search all conversations", value="", placeholder="e.g. coffee, birthday, stressed")
+    if query.strip():
+        try:
+            hits = search_cached(repository.current_db_path(), repository.data_version(), query)
+        except Exception:
+            hits = []
+            st.error("Search failed")
+            st.text(traceback.format_exc())
+        if not hits:
+            st.info("No matching messages.")
         else:
-            st.text("No local debug log found. Use the terminal for live logs.")
-    except Exception:
-        st.text("Could not read logs.")
+            st.markdown("".join(
+                f"<div class='contact-item'><b>{html.escape(h['name'] or '')}</b> <span class='small-muted'> — id={h['contact_id']} · "
+                f"[{html.escape(str(h['timestamp']))}] {html.escape(str(h['direction']))}</span>"
+                f"<div style='margin-top:6px;font-size:13px'>{search.highlight_html(h['snippet'], html.escape)}</div></div>"
+                for h in hits), unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.subheader("Last run output (debug)")
+    last = st.session_state.get("last_trace")
+    if not last:
+        st.text("No run yet in this session. Generate suggestions or import a CSV.")
+    else:
+        attrs = last.get("attrs", {})
+        st.markdown(f"**{last['trace']}** · {last['duration_ms']:.0f} ms total"
+                    + (f" · fallback: `{attrs['fallback_reason']}`" if attrs.get("fallback_reason") else "")
+                    + (f" · routed to `{attrs['route']['model']}` ({attrs['route']['reason']})"
+                       if attrs.get("route") else ""))
+        # spans of the same stage (e.g. one per ingest chunk) are summed
+        stages = {}
+        for s in last.get("spans", []):
+            stage = stages.setdefault(s["name"], {"stage": s["name"], "calls": 0, "ms": 0.0})
+            stage["calls"] += 1
+            stage["ms"] += s["duration_ms"]
+        if stages:
+            st.dataframe([{**stage, "ms": round(stage["ms"], 1)} for stage in stages.values()],
+                         hide_index=True)
+        st.json(attrs, expanded=False)
+    with st.expander("Metrics (Prometheus format)"):
+        st.code(tracing.prometheus_text() or "# no metrics yet", language="text")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # footer
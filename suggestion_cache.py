@@ -0,0 +1,131 @@
+# suggestion_cache.py
+# Content-addressed cache of model suggestions, stored in bondkeeper.db.
+# The key is a hash of (model, system instruction, prompt): if none of those
+# changed, the model would be asked exactly the same question, so the stored
+# answer is returned instead. Entries expire after a TTL, the table is capped at
+# MAX_ENTRIES (least recently used evicted first), and ingest drops a contact's
+# entries when new messages arrive for it.
+#
+# Lookups only read. Bookkeeping is written lazily so cache hits do not queue on
+# the write lock: an entry's last_used is refreshed at most every TOUCH_SECONDS,
+# and hit/miss counts are kept in memory and written every COUNTER_FLUSH_SECONDS
+# (or with the next put).
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+import repository
+
+TTL_SECONDS = int(os.getenv("SUGGESTION_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_ENTRIES = int(os.getenv("SUGGESTION_CACHE_MAX_ENTRIES", "5000"))
+TOUCH_SECONDS = 60
+COUNTER_FLUSH_SECONDS = 30
+
+HITS_KEY = "suggestion_cache_hits"
+MISSES_KEY = "suggestion_cache_misses"
+
+SQL_LOOKUP = "SELECT response, created_at, last_used FROM suggestion_cache WHERE cache_key=?"
+SQL_TOUCH = "UPDATE suggestion_cache SET last_used=? WHERE cache_key=?"
+
+_pending = {}       # database path -> [hits, misses] not written yet
+_flushed_at = {}    # database path -> time.monotonic() of the last flush
+_pending_lock = threading.Lock()
+
+
+def cache_key(model_name, system_instruction, user_prompt):
+    h = hashlib.sha256()
+    for part in (model_name, system_instruction, user_prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _count(hit):
+    """Record a hit or miss in memory; returns True when the counts are due to be written."""
+    path = repository.current_db_path()
+    now = time.monotonic()
+    with _pending_lock:
+        counts = _pending.setdefault(path, [0, 0])
+        counts[0 if hit else 1] += 1
+        return now - _flushed_at.setdefault(path, now) > COUNTER_FLUSH_SECONDS
+
+
+def _flush_counts(conn, path=None):
+    """Write this process's pending hit/miss counts (inside a write transaction on `conn`)."""
+    path = path or repository.current_db_path()
+    with _pending_lock:
+        hits, misses = _pending.pop(path, (0, 0))
+        _flushed_at[path] = time.monotonic()
+    if hits:
+        repository.incr_counter(conn, HITS_KEY, hits)
+    if misses:
+        repository.incr_counter(conn, MISSES_KEY, misses)
+
+
+@atexit.register
+def _flush_at_exit():
+    for path in list(_pending):
+        try:
+            with repository.get_pool(path).transaction() as conn:
+                _flush_counts(conn, path)
+        except Exception:
+            pass  # statistics only
+
+
+def get(key, ttl=TTL_SECONDS):
+    """Return the cached suggestion dict for `key`, or None on a miss (expired entries miss)."""
+    now = time.time()
+    with repository.connection() as conn:
+        row = conn.execute(SQL_LOOKUP, (key,)).fetchone()
+    if row is not None and now - row[1] > ttl:
+        row = None  # replaced by the next put, or evicted
+    flush = _count(row is not None)
+    touch = row is not None and now - row[2] > TOUCH_SECONDS
+    if flush or touch:
+        with repository.transaction() as conn:
+            if touch:
+                conn.execute(SQL_TOUCH, (now, key))
+            _flush_counts(conn)
+    return json.loads(row[0]) if row is not None else None
+
+
+def put(key, contact_id, model_name, suggestion, max_entries=MAX_ENTRIES):
+    now = time.time()
+    with repository.transaction() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO suggestion_cache(cache_key, contact_id, model, response, created_at, last_used)
+            VALUES (?,?,?,?,?,?)
+        """, (key, contact_id, model_name, json.dumps(suggestion), now, now))
+        # LRU eviction: keep the `max_entries` most recently used rows
+        conn.execute("""
+            DELETE FROM suggestion_cache WHERE cache_key IN (
+                SELECT cache_key FROM suggestion_cache
+                ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+        _flush_counts(conn)
+
+
+def invalidate_contact(conn, contact_id):
+    """Drop cached suggestions for a contact (run inside the ingest transaction)."""
+    conn.execute("DELETE FROM suggestion_cache WHERE contact_id=?", (contact_id,))
+
+
+def stats():
+    with repository.connection() as conn:
+        entries = conn.execute("SELECT COUNT(*) FROM suggestion_cache").fetchone()[0]
+    with _pending_lock:
+        pending_hits, pending_misses = _pending.get(repository.current_db_path(), (0, 0))
+    hits = repository.get_counter(HITS_KEY) + pending_hits
+    misses = repository.get_counter(MISSES_KEY) + pending_misses
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        "entries": entries,
+    }
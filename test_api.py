@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+
+import api
+import repository
+from conftest import write_csv
+from fake_model import FakeModel
+from simple_ingest import ingest
+
+MODEL = "fake/test"
+
+
+async def request(port, method, target, headers=None, body=b""):
+    """One HTTP/1.1 request to the local server; returns (status, headers, json body)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"{method} {target} HTTP/1.1", "Connection: close", f"Content-Length: {len(body)}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    response_headers = dict(line.lower().split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), response_headers, json.loads(payload)
+
+
+def run_with_server(app, scenario):
+    """Serve `app` on a free port and run `scenario(port)` against it."""
+    async def main():
+        server = await asyncio.start_server(api.connection_handler(app), "127.0.0.1", 0)
+        async with server:
+            return await scenario(server.sockets[0].getsockname()[1])
+    return asyncio.run(main())
+
+
+def contacts(tmp_path, names):
+    return [ingest(write_csv(tmp_path / f"{name}.csv", [("2024-11-10 10:00", "inbound", f"hi from {name}")]),
+                   name)["contact_id"] for name in names]
+
+
+def test_burst_beyond_the_queue_gets_503_with_retry_after(db, tmp_path):
+    ids = contacts(tmp_path, ["Ravi", "Mira", "Sam", "Lee"])
+    app = api.Api(FakeModel(latency=0.3, jitter=0), MODEL, max_inflight=1, max_queued=1)
+
+    async def burst(port):
+        return await asyncio.gather(*(request(port, "POST", f"/contacts/{cid}/generate") for cid in ids))
+
+    responses = run_with_server(app, burst)
+    statuses = sorted(status for status, _, _ in responses)
+    assert statuses == [200, 200, 503, 503]
+    assert all(headers["retry-after"] == str(api.RETRY_AFTER_SECONDS)
+               for status, headers, _ in responses if status == 503)
+    assert app.stats["rejected"] == 2 and (app.stats["inflight"], app.stats["queued"]) == (0, 0)
+
+
+def test_queued_request_times_out_with_503(db, tmp_path):
+    ids = contacts(tmp_path, ["Ravi", "Mira"])
+    app = api.Api(FakeModel(latency=0.3, jitter=0), MODEL, max_inflight=1, max_queued=1, queue_timeout=0.05)
+
+    async def two(port):
+        return await asyncio.gather(*(request(port, "POST", f"/contacts/{cid}/generate") for cid in ids))
+
+    assert sorted(status for status, _, _ in run_with_server(app, two)) == [200, 503]
+    assert (app.stats["inflight"], app.stats["queued"]) == (0, 0)
+
+
+def test_identical_generate_requests_share_one_model_call(db, tmp_path):
+    cid, = contacts(tmp_path, ["Ravi"])
+    model = FakeModel(latency=0.3, jitter=0)
+    app = api.Api(model, MODEL)
+
+    async def same(port):
+        return await asyncio.gather(*(request(port, "POST", f"/contacts/{cid}/generate") for _ in range(5)))
+
+    responses = run_with_server(app, same)
+    assert [status for status, _, _ in responses] == [200] * 5
+    assert model.calls == 1 and app.stats["coalesced"] == 4
+    assert len({body["short"] for _, _, body in responses}) == 1
+
+
+def test_unknown_workspace_is_404_and_creates_no_file(db, tmp_path):
+    app = api.Api(FakeModel(latency=0), MODEL)
+    shard = repository.shard_path("nobody")
+
+    async def probe(port):
+        return [await request(port, "GET", "/contacts", {"X-BondKeeper-User": "nobody"}),
+                await request(port, "GET", "/contacts?workspace=nobody"),
+                await request(port, "POST", "/contacts/1/generate?workspace=nobody")]
+
+    assert [status for status, _, _ in run_with_server(app, probe)] == [404, 404, 404]
+    assert not os.path.exists(shard)
+
+    async def create(port):
+        csv = b"timestamp,direction,text\n2024-11-10,inbound,hi\n"
+        created = await request(port, "POST", "/ingest?contact=Ravi&workspace=nobody", body=csv)
+        listed = await request(port, "GET", "/contacts", {"X-BondKeeper-User": "nobody"})
+        return created, listed
+
+    created, listed = run_with_server(app, create)
+    assert created[0] == 200 and os.path.exists(shard)
+    assert listed[0] == 200 and [c["name"] for c in listed[2]["contacts"]] == ["Ravi"]
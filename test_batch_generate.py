@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import batch_generate
+import repository
+from conftest import write_csv
+from fake_model import FakeModel, FakeQuotaError
+from simple_ingest import ingest
+
+MODEL = "fake/test"
+
+
+class Recorder:
+    """Fake model that answers with the contact named in the prompt and records the names."""
+
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, model_name, user_prompt):
+        name = user_prompt.splitlines()[0].replace("Contact:", "").strip()
+        self.names.append(name)
+        return json.dumps({"short": f"hi {name}", "neutral": "hello", "warm": "hello friend", "action": "call"})
+
+
+def add_contact(tmp_path, name):
+    return ingest(write_csv(tmp_path / f"{name}.csv", [("2024-11-10 10:00", "inbound", f"hi from {name}")]),
+                  name)["contact_id"]
+
+
+def test_workers_read_the_callers_shard(db, tmp_path):
+    add_contact(tmp_path, "Ravi")  # contact 1 in the default database
+    with repository.use_shard("alice"):
+        cid = add_contact(tmp_path, "Mira")  # contact 1 in alice's shard
+        model = Recorder()
+        summary = batch_generate.run_batch([cid], model_name=MODEL, call=model, workers=2, rpm=6000,
+                                           progress=lambda msg: None)
+        assert summary["done"] == 1 and model.names == ["Mira"]
+        assert batch_generate.run_results(summary["run_id"])[cid]["short"] == "hi Mira"
+
+
+def items(run_id):
+    with repository.connection() as conn:
+        return conn.execute("SELECT c.name, i.status, i.attempts FROM batch_items i "
+                            "JOIN contacts c ON c.contact_id = i.contact_id WHERE run_id=? ORDER BY i.contact_id",
+                            (run_id,)).fetchall()
+
+
+def test_resume_finishes_an_interrupted_run_and_counts_attempts(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_generate, "backoff_delay", lambda attempt: 0)
+    for name in ("Ravi", "Mira", "Sam"):
+        add_contact(tmp_path, name)
+    model = FakeModel(latency=0, jitter=0)
+
+    def flaky(model_name, user_prompt):
+        if user_prompt.startswith("Contact: Mira"):
+            raise FakeQuotaError("429 Resource has been exhausted")
+        if user_prompt.startswith("Contact: Sam"):
+            raise KeyboardInterrupt  # Ctrl+C while Sam is being generated
+        return model(model_name, user_prompt)
+
+    with pytest.raises(KeyboardInterrupt):
+        batch_generate.run_batch(model_name=MODEL, call=flaky, workers=1, rpm=6000, max_retries=2,
+                                 progress=lambda msg: None)
+    assert items(1) == [("Ravi", "done", 1), ("Mira", "failed", 3), ("Sam", "pending", 0)]
+
+    summary = batch_generate.run_batch(run_id=1, call=model, workers=2, rpm=6000, progress=lambda msg: None)
+    assert (summary["status"], summary["done"], summary["failed"]) == ("done", 2, 0)
+    assert model.calls == 3  # Ravi once in the first run, then only Mira and Sam
+    assert items(1) == [("Ravi", "done", 1), ("Mira", "done", 4), ("Sam", "done", 1)]
+    assert sorted(batch_generate.run_results(1)) == [1, 2, 3]
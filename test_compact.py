@@ -0,0 +1,64 @@
+import compact
+import context_builder
+import health
+import repository
+import search
+from conftest import write_csv
+from schema import to_epoch
+from simple_ingest import ingest
+
+OLD = [(f"2023-{month:02d}-{day:02d} 09:00", direction, f"{word} number {month * 100 + day}")
+       for month in range(1, 13) for day in (3, 17)
+       for direction, word in (("inbound", "coffee"), ("outbound", "lunch"))]
+NEW = [("2025-02-01 09:00", "inbound", "coffee again?"), ("2025-02-02 09:00", "outbound", "sure")]
+CUTOFF = to_epoch(["2025-01-01"])[0]
+
+
+def views(contact_id):
+    """What the app reads for a contact: recent turns, prompt context, search hits and health."""
+    hits = [(h["conv_id"], h["timestamp"], h["direction"]) for h in search.search_messages("coffee", limit=100)]
+    with repository.connection() as conn:
+        scores = conn.execute("SELECT last_ts, messages, inbound, outbound, unanswered_inbound, "
+                              "median_reply_secs, urgency_key FROM contact_health WHERE contact_id=?",
+                              (contact_id,)).fetchone()
+    return (repository.recent_messages(contact_id, 10), context_builder.build_context(contact_id, budget=200),
+            sorted(hits), scores)
+
+
+def test_reads_are_unchanged_by_compaction(db, tmp_path):
+    cid = ingest(write_csv(tmp_path / "a.csv", OLD + NEW), "Ravi")["contact_id"]
+    health.rebuild(progress=None)
+    before = views(cid)
+
+    assert compact.compact(CUTOFF, progress=None) == len(OLD)
+    stats = compact.tier_stats()
+    assert (stats["hot_messages"], stats["cold_messages"]) == (len(NEW), len(OLD))
+    assert views(cid) == before
+    health.rebuild(progress=None)
+    assert views(cid) == before
+
+
+def test_reimport_skips_archived_messages(db, tmp_path):
+    path = write_csv(tmp_path / "a.csv", OLD + NEW)
+    cid = ingest(path, "Ravi")["contact_id"]
+    compact.compact(CUTOFF, progress=None)
+    report = ingest(path, "Ravi")
+    assert (report["inserted"], report["skipped"]) == (0, len(OLD) + len(NEW))
+    assert compact.tier_stats()["hot_messages"] == len(NEW)
+
+    # compacting again merges into a new generation without losing or repeating rows
+    # (the newest row by conv_id always stays hot, so something newer is imported after it)
+    ingest(write_csv(tmp_path / "b.csv", [("2024-06-01 09:00", "inbound", "late coffee"),
+                                          ("2025-03-01 09:00", "outbound", "see you")]), "Ravi")
+    assert compact.compact(CUTOFF, progress=None) == 1
+    assert len(repository.recent_messages(cid, 1000)) == len(OLD) + len(NEW) + 2
+
+
+def test_fts_index_stays_consistent(db, tmp_path):
+    ingest(write_csv(tmp_path / "a.csv", OLD + NEW), "Ravi")
+    compact.compact(CUTOFF, progress=None)
+    with repository.connection() as conn:
+        if search.fts_available(conn):
+            conn.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('integrity-check')")
+            indexed = conn.execute("SELECT COUNT(*) FROM conversations_fts").fetchone()[0]
+            assert indexed == len(NEW)
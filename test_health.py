@@ -0,0 +1,65 @@
+import pytest
+
+import health
+import repository
+from conftest import write_csv
+from simple_ingest import ingest
+
+DAY = health.DAY
+IN, OUT = "inbound", "outbound"
+
+
+def compute(messages):
+    """compute_health over (contact_id, ts, direction) tuples given in conv_id order."""
+    cids, ts, directions = zip(*messages)
+    return health.compute_health(cids, ts, directions)
+
+
+def test_runs_replies_and_ratio():
+    # contact 2's messages are interleaved with contact 1's and out of ts order
+    metrics = compute([(1, 0, IN), (2, 30, IN), (1, 100, IN), (2, 10, IN), (1, 400, OUT), (1, 1000, IN),
+                       (2, 20, IN), (1, 1600, OUT), (1, 2000, IN)])
+    # replies after 400s (to the run starting at 0) and 600s (to the run at 1000)
+    assert metrics[1] == {"last_ts": 2000, "messages": 6, "inbound": 4, "outbound": 2, "unanswered_inbound": 1,
+                          "median_reply_secs": 500.0,
+                          # 1 unanswered * 3 days + (4/2 - 1) * 2 days + 500s
+                          "urgency_key": 5 * DAY + 500 - 2000}
+    # only inbound: all unanswered, no reply latency, the full ratio bonus
+    assert metrics[2] == {"last_ts": 30, "messages": 3, "inbound": 3, "outbound": 0, "unanswered_inbound": 3,
+                          "median_reply_secs": None, "urgency_key": (3 * 3 + 2 * 3) * DAY - 30}
+
+
+def test_caps_and_contact_boundaries():
+    metrics = compute([(3, 5, OUT)] + [(4, t, IN) for t in range(7)]
+                      + [(5, 0, IN), (5, 10 * DAY, OUT)] + [(6, 0, IN), (7, 50, OUT), (8, 1, IN), (8, 2, IN)])
+    assert (metrics[3]["unanswered_inbound"], metrics[3]["urgency_key"]) == (0, -5)  # ratio 0 adds nothing
+    assert metrics[4]["unanswered_inbound"] == 7
+    assert metrics[4]["urgency_key"] == (3 * 5 + 2 * 3) * DAY - 6  # unanswered counted up to 5
+    assert metrics[5]["median_reply_secs"] == 10 * DAY
+    assert metrics[5]["urgency_key"] == 7 * DAY - 10 * DAY  # latency counted up to 7 days
+    # an outbound message of the next contact is not a reply, nor does it answer the next one
+    assert metrics[6]["median_reply_secs"] is None and metrics[7]["median_reply_secs"] is None
+    assert metrics[8]["unanswered_inbound"] == 2
+
+
+def test_even_split_median():
+    metrics = compute([(1, 0, IN), (1, 100, OUT), (1, 200, IN), (1, 500, OUT), (1, 600, IN), (1, 1200, OUT)])
+    assert metrics[1]["median_reply_secs"] == 300.0 and metrics[1]["unanswered_inbound"] == 0
+
+
+def test_stored_scores_skip_undated_messages_and_sort_by_urgency(db, tmp_path):
+    quiet = ingest(write_csv(tmp_path / "a.csv", [("2024-11-01 10:00", IN, "hey"),
+                                                  ("2024-11-01 10:10", OUT, "hi"),
+                                                  ("sometime", IN, "undated")]), "Quiet")["contact_id"]
+    waiting = ingest(write_csv(tmp_path / "b.csv", [("2024-11-01 10:00", IN, "hey"),
+                                                    ("2024-11-01 11:00", IN, "you there?")]), "Waiting")["contact_id"]
+    empty = ingest(write_csv(tmp_path / "c.csv", [("sometime", OUT, "undated")]), "Empty")["contact_id"]
+
+    top = health.top_contacts(10)
+    assert [row[0] for row in top] == [waiting, quiet, empty]
+    by_id = {row[0]: row for row in top}
+    assert by_id[quiet][3:8] == (2, 1, 1, 0, 600.0)  # messages, inbound, outbound, unanswered, median
+    assert by_id[empty][2:] == (None,) * 7
+    last_ts = by_id[waiting][2]
+    assert health.urgency(by_id[waiting][8], now=last_ts + 2 * DAY) == pytest.approx(2 + 3 * 2 + 2 * 3)
+    assert health.urgency(None) is None
@@ -0,0 +1,69 @@
+import time
+
+import model_router
+import repository
+
+PRO, FLASH, PRO_2 = "models/gemini-pro", "models/gemini-flash", "models/gemini-pro-2"
+CANDIDATES = [PRO, FLASH, PRO_2]
+SHORT, LONG = model_router.SHORT_PROMPT_TOKENS, model_router.SHORT_PROMPT_TOKENS + 1
+SLOW_MS = model_router.LATENCY_SLO_P95_MS + 1
+
+
+def calls(model, outcomes, age=0, latency_ms=500):
+    """Record synthetic calls for `model`, `age` seconds ago."""
+    ts = time.time() - age
+    with repository.get_pool(repository.DB_PATH).transaction() as conn:
+        conn.executemany(model_router.SQL_RECORD, [(model, ts, latency_ms, outcome) for outcome in outcomes])
+
+
+def test_prompt_size_picks_the_tier(db):
+    short = model_router.route(SHORT, CANDIDATES)
+    assert (short.model, short.tier, short.reason, short.chain) == (FLASH, "flash", "short_prompt", [FLASH, PRO, PRO_2])
+    long = model_router.route(LONG, CANDIDATES)
+    assert (long.model, long.tier, long.reason, long.chain) == (PRO, "pro", "long_prompt", [PRO, PRO_2, FLASH])
+    assert model_router.route(SHORT, []) is None
+
+
+def test_recent_quota_error_moves_a_model_back_until_the_cooldown_ends(db):
+    calls(FLASH, ["ok", "quota"], age=10)
+    decision = model_router.route(SHORT, CANDIDATES)
+    assert decision.chain == [PRO, PRO_2, FLASH]
+    assert decision.reason == f"no_healthy_flash skipped={FLASH}:recent_quota_error"
+    assert decision.stats[PRO]["calls"] == 0 and decision.stats[FLASH]["quota_rate"] == 0.5
+
+
+def test_old_quota_errors_count_by_rate(db):
+    age = model_router.QUOTA_COOLDOWN_SECONDS + 1
+    calls(PRO, ["ok"] * 7 + ["quota"] * 3, age=age)       # 30% of 10 calls
+    calls(PRO_2, ["ok"] * 2 + ["quota"] * 2, age=age)     # too few calls to judge
+    decision = model_router.route(LONG, CANDIDATES)
+    assert decision.chain == [PRO_2, FLASH, PRO]
+    assert decision.reason == f"long_prompt skipped={PRO}:quota_rate"
+
+
+def test_slow_p95_and_calls_outside_the_window(db):
+    calls(PRO, ["ok"] * 19, latency_ms=1000)
+    calls(PRO, ["ok"], latency_ms=SLOW_MS)                 # 1 in 20: over the SLO only at p95
+    calls(PRO_2, ["quota"] * 10, age=model_router.WINDOW_SECONDS + 1)
+    decision = model_router.route(LONG, CANDIDATES)
+    assert decision.chain == [PRO_2, FLASH, PRO]
+    assert decision.reason == f"long_prompt skipped={PRO}:slow_p95"
+    assert decision.stats[PRO]["p50_ms"] == 1000 and decision.stats[PRO_2]["calls"] == 0
+
+
+def test_all_unhealthy_keeps_the_tier_order(db):
+    for model in CANDIDATES:
+        calls(model, ["quota"])
+    decision = model_router.route(SHORT, CANDIDATES)
+    assert decision.chain == [FLASH, PRO, PRO_2]
+    assert decision.reason.startswith("all_unhealthy:recent_quota_error skipped=")
+
+
+def test_calls_recorded_in_any_shard_are_shared(db):
+    with repository.use_shard("alice"):
+        model_router.record(FLASH, 800, "quota")
+        with repository.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM model_calls").fetchone() == (0,)
+    with repository.use_shard("bob"):
+        assert model_router.route(SHORT, CANDIDATES).model == PRO
+    assert model_router.all_stats()[FLASH]["calls"] == 1
@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+
+import precompute
+import repository
+from conftest import write_csv
+from simple_ingest import ingest
+
+MODEL = "fake/test"
+
+
+def answer(model_name, user_prompt):
+    return json.dumps({"short": "hi", "neutral": "hello", "warm": "hello friend", "action": "call"})
+
+
+def failing(model_name, user_prompt):
+    raise RuntimeError("model down")
+
+
+def waiting_contact(tmp_path, name="Ravi", text="are you around?"):
+    """A contact whose last message is an unanswered inbound one; returns its id."""
+    rows = [("2024-11-09 10:00", "outbound", "hey"), ("2024-11-10 10:00", "inbound", text)]
+    return ingest(write_csv(tmp_path / f"{name}.csv", rows), name)["contact_id"]
+
+
+def job_row(contact_id):
+    with repository.connection() as conn:
+        return conn.execute("SELECT status, attempts, run_after, last_error FROM jobs WHERE contact_id=?",
+                            (contact_id,)).fetchone()
+
+
+def test_ready_suggestion_until_new_messages(db, tmp_path):
+    cid = waiting_contact(tmp_path)
+    assert precompute.scan() == 1
+    assert precompute.scan() == 0  # already queued
+    assert precompute.run_one("w1", answer, MODEL, progress=lambda msg: None)
+    assert not precompute.run_one("w1", answer, MODEL, progress=lambda msg: None)
+    assert job_row(cid)[0] == "done"
+    ready = precompute.get_ready(cid)
+    assert ready.source == "precomputed" and ready.short == "hi"
+
+    # a new message makes the stored suggestion stale, and the next scan queues it again
+    ingest(write_csv(tmp_path / "more.csv", [("2024-11-11 10:00", "inbound", "hello??")]), "Ravi")
+    assert precompute.get_ready(cid) is None
+    assert precompute.scan() == 1
+
+
+def test_failures_retry_with_backoff_then_give_up(db, tmp_path, monkeypatch):
+    cid = waiting_contact(tmp_path)
+    precompute.scan()
+    assert precompute.run_one("w1", failing, MODEL, progress=lambda msg: None)
+    status, attempts, run_after, error = job_row(cid)
+    assert (status, attempts) == ("queued", 1) and "model down" in error
+    assert run_after > time.time() and precompute.claim("w1") is None  # not due before its backoff
+
+    monkeypatch.setattr(precompute, "backoff_delay", lambda attempt: 0)
+    with repository.transaction() as conn:
+        conn.execute("UPDATE jobs SET run_after=0 WHERE contact_id=?", (cid,))
+    while precompute.run_one("w1", failing, MODEL, progress=lambda msg: None):
+        pass
+    assert job_row(cid)[:2] == ("failed", precompute.MAX_ATTEMPTS)
+    # a contact that was given up on is not queued again during the cooldown
+    assert precompute.scan() == 0
+
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_cannot_complete(db, tmp_path):
+    cid = waiting_contact(tmp_path)
+    precompute.scan()
+    job_id, contact_id, attempt = precompute.claim("dead-worker", lease_seconds=60)
+    assert precompute.claim("w2") is None  # leased
+
+    with repository.transaction() as conn:
+        conn.execute("UPDATE jobs SET lease_expires=? WHERE job_id=?", (time.time() - 1, job_id))
+    reclaimed = precompute.claim("w2")
+    assert reclaimed == (job_id, cid, attempt + 1)
+
+    result = precompute.generate(cid, answer, MODEL)
+    assert not precompute.complete(job_id, "dead-worker", cid, result, (2, None))
+    assert precompute.complete(job_id, "w2", cid, result, (2, None))
+
+
+@pytest.mark.parametrize("all_shards", [False, True])
+def test_worker_serves_every_shard_with_all_shards(db, tmp_path, all_shards):
+    waiting_contact(tmp_path)  # default database
+    for user in ("alice", "bob"):
+        with repository.use_shard(user):
+            waiting_contact(tmp_path, name=user)
+
+    ran = precompute.run_worker(once=True, call=answer, model_name=MODEL, progress=lambda msg: None,
+                                all_shards=all_shards)
+    assert ran == (3 if all_shards else 1)
+    for user in ("alice", "bob"):
+        with repository.use_shard(user):
+            assert (precompute.get_ready(1) is not None) == all_shards
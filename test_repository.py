@@ -0,0 +1,18 @@
+import repository
+from conftest import write_csv
+from simple_ingest import ingest
+
+SAME_TIME = [("2024-11-10 10:00", "inbound", "one"), ("2024-11-10 10:00", "outbound", "two"),
+             ("2024-11-10 10:00", "inbound", "three"), ("2024-11-10 10:00", "outbound", "four")]
+
+
+def test_previews_and_recent_messages_agree_on_ties(db, tmp_path):
+    cid = ingest(write_csv(tmp_path / "a.csv", SAME_TIME), "Ravi")["contact_id"]
+    (_, _, previews, _), = repository.contact_previews(per_contact=2)
+    assert previews == repository.recent_messages(cid, 2) == SAME_TIME[:1:-1]
+
+
+def test_recent_messages_are_read_in_index_order(db):
+    with repository.connection() as conn:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + repository.SQL_RECENT_MESSAGES, (1, 5))]
+    assert len(plan) == 1 and "USING INDEX idx_conversations_contact_ts_conv" in plan[0]
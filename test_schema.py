@@ -0,0 +1,57 @@
+import sqlite3
+
+import repository
+import schema
+import search
+
+# what the original simple_ingest.init_db created, before there were migrations
+BASELINE = [
+    "CREATE TABLE contacts(contact_id INTEGER PRIMARY KEY, name TEXT, notes TEXT)",
+    "CREATE TABLE conversations(conv_id INTEGER PRIMARY KEY, contact_id INTEGER, timestamp TEXT, "
+    "direction TEXT, text TEXT)",
+]
+INDEXES = {
+    "idx_contact_health_stale", "idx_contact_health_urgency", "idx_contacts_key", "idx_conversations_contact_hash",
+    "idx_conversations_contact_ts_conv", "idx_jobs_contact", "idx_jobs_due", "idx_jobs_one_queued",
+    "idx_model_calls_model_ts", "idx_model_calls_ts", "idx_suggestion_cache_contact",
+    "idx_suggestion_cache_last_used",
+}
+
+
+def schema_objects(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+
+
+def test_baseline_database_migrates_to_the_latest_version(db):
+    conn = sqlite3.connect(db, isolation_level=None)
+    for sql in BASELINE:
+        conn.execute(sql)
+    conn.execute("INSERT INTO contacts(name, notes) VALUES ('Ravi', '')")
+    conn.executemany("INSERT INTO conversations(contact_id, timestamp, direction, text) VALUES (1,?,?,?)",
+                     [("2024-11-10", "inbound", "coffee soon?"), ("2024-11-10", "inbound", "coffee soon?"),
+                      ("not a date", "outbound", "sure")])
+    conn.close()
+
+    with repository.connection() as conn:
+        assert schema.current_version(conn) == schema.LATEST_VERSION
+        versions = [r[0] for r in conn.execute("SELECT version FROM schema_migrations ORDER BY version")]
+        assert versions == [version for version, _, _ in schema.MIGRATIONS]
+        indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index' "
+                                              "AND name NOT LIKE 'sqlite_autoindex%'")}
+        assert indexes == INDEXES
+        rows = conn.execute("SELECT ts, msg_hash FROM conversations ORDER BY conv_id").fetchall()
+        assert rows[0][0] == rows[1][0] == schema.to_epoch(["2024-11-10"])[0] and rows[2][0] is None
+        assert None not in [h for _, h in rows] and len({h for _, h in rows}) == 3
+        assert conn.execute("SELECT contact_key FROM contacts").fetchone() == ("ravi",)
+        assert conn.execute("SELECT COUNT(*) FROM contact_health").fetchone() == (1,)
+    assert sorted(hit["conv_id"] for hit in search.search_messages("coffee")) == [1, 2]
+
+
+def test_migrating_again_changes_nothing(db):
+    with repository.connection() as conn:
+        before = schema_objects(conn), conn.execute("SELECT * FROM schema_migrations").fetchall()
+    # a second process opening the same file
+    conn = sqlite3.connect(db, isolation_level=None)
+    assert schema.migrate(conn) == []
+    assert (schema_objects(conn), conn.execute("SELECT * FROM schema_migrations").fetchall()) == before
+    conn.close()
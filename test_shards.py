@@ -0,0 +1,108 @@
+import os
+
+import compact
+import repository
+import search
+import shards
+from conftest import write_csv
+from schema import to_epoch
+from simple_ingest import ingest
+
+
+def contact_names():
+    return [name for _, name in repository.list_contacts()]
+
+
+def two_contacts(tmp_path):
+    rows = [(f"2023-0{month}-01 09:00", "inbound", f"note {month}") for month in range(1, 7)]
+    rows.append(("2025-01-01 09:00", "outbound", "hi"))
+    ravi = ingest(write_csv(tmp_path / "ravi.csv", rows), "Ravi")["contact_id"]
+    mira = ingest(write_csv(tmp_path / "mira.csv", rows), "Mira")["contact_id"]
+    return ravi, mira
+
+
+def test_shard_path_is_case_insensitive_and_safe(db):
+    assert repository.shard_path("") == repository.shard_path("  ") == db
+    assert repository.shard_path("Alice") == repository.shard_path(" alice ")
+    assert repository.shard_path("alice") != repository.shard_path("bob")
+    path = repository.shard_path("../../etc/passwd")
+    assert os.path.dirname(path) == repository.SHARD_DIR and os.path.basename(path).startswith("etc-passwd-")
+
+
+def test_use_shard_isolates_contacts(db, tmp_path):
+    ingest(write_csv(tmp_path / "a.csv", [("2024-11-10", "inbound", "hi")]), "Ravi")
+    with repository.use_shard("alice"):
+        ingest(write_csv(tmp_path / "b.csv", [("2024-11-10", "inbound", "hi")]), "Mira")
+        assert contact_names() == ["Mira"]
+        with repository.use_shard(""):
+            assert contact_names() == ["Ravi"]
+        assert repository.current_db_path() == repository.shard_path("alice")
+    assert contact_names() == ["Ravi"]
+    assert [contacts for _, _, contacts in shards.list_shards()] == [1, 1]
+
+
+def test_split_move_copies_everything_then_removes_it(db, tmp_path):
+    ravi, mira = two_contacts(tmp_path)
+    compact.compact(to_epoch(["2024-01-01"])[0], progress=None)
+    before = repository.recent_messages(ravi, 100)
+
+    done = shards.split({"alice": [ravi]}, move=True, progress=lambda msg: None)
+    assert done == {"alice": (1, 1)}  # one hot message; the rest is in the copied archive
+    assert contact_names() == ["Mira"]
+    assert repository.recent_messages(ravi, 100) == []
+    with repository.use_shard("alice"):
+        assert contact_names() == ["Ravi"]
+        assert repository.recent_messages(ravi, 100) == before
+        # re-importing the export into the shard finds every message already present
+        report = ingest(str(tmp_path / "ravi.csv"), "Ravi")
+        assert report["inserted"] == 0
+
+
+def test_copying_the_same_contacts_twice_fails_and_keeps_the_shard(db, tmp_path):
+    ravi, _ = two_contacts(tmp_path)
+    assert shards.split({"alice": [ravi]}, progress=lambda msg: None) == {"alice": (1, 7)}
+    messages = []
+    assert shards.split({"alice": [ravi]}, progress=messages.append) == {}
+    assert "FAILED" in messages[0]
+    with repository.use_shard("alice"):
+        assert len(repository.recent_messages(ravi, 100)) == 7
+
+
+def test_least_recently_used_pools_are_closed(db, monkeypatch):
+    monkeypatch.setattr(repository, "MAX_OPEN_SHARDS", 2)
+    first = repository.get_pool(repository.shard_path("a"))
+    repository.get_pool(repository.shard_path("b"))
+    repository.get_pool(repository.shard_path("a"))  # a is now the most recently used
+    repository.get_pool(repository.shard_path("c"))
+    assert list(repository._pools) == [repository.shard_path("a"), repository.shard_path("c")]
+    assert repository.get_pool(repository.shard_path("a")) is first
+
+
+def conv_ids(contact_id):
+    with repository.connection() as conn:
+        hot = [r[0] for r in conn.execute("SELECT conv_id FROM conversations WHERE contact_id=?", (contact_id,))]
+        archived = conn.execute("SELECT max_conv_id FROM archived_contacts WHERE contact_id=?",
+                                (contact_id,)).fetchone()
+    return hot, archived[0] if archived else 0
+
+
+def test_new_messages_are_numbered_above_archived_ones_after_a_split(db, tmp_path):
+    ravi, mira = two_contacts(tmp_path)
+    compact.compact(to_epoch(["2026-01-01"])[0], progress=None)  # Ravi entirely, Mira all but the newest row
+    dinner = write_csv(tmp_path / "dinner.csv", [("2026-02-01 19:00", "inbound", "dinner on friday?")])
+
+    shards.split({"alice": [ravi]}, progress=lambda msg: None)
+    with repository.use_shard("alice"):
+        assert conv_ids(ravi)[0] == []  # the shard holds only Ravi's archive
+        ingest(dinner, "Ravi")
+        (new_id,), archived_max = conv_ids(ravi)
+        assert new_id > archived_max
+        assert [hit["conv_id"] for hit in search.search_messages("dinner")] == [new_id]
+        assert len(repository.recent_messages(ravi, 100)) == 8
+
+    # --move can take the source's newest row with it
+    shards.split({"bob": [mira]}, move=True, progress=lambda msg: None)
+    ingest(dinner, "Ravi")
+    (new_id,), archived_max = conv_ids(ravi)
+    assert new_id > archived_max
+    assert [hit["conv_id"] for hit in search.search_messages("dinner")] == [new_id]
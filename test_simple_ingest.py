@@ -0,0 +1,82 @@
+import repository
+import schema
+from conftest import old_database, write_csv
+from simple_ingest import ingest
+
+REPEATS = [
+    ("2024-11-10", "inbound", "ok"),
+    ("2024-11-10", "outbound", "haha"),
+    ("2024-11-10", "inbound", "ok"),
+    ("2024-11-10", "outbound", "haha"),
+    ("2024-11-10", "inbound", "see you"),
+]
+
+
+def stored_texts(contact_id):
+    with repository.connection() as conn:
+        return [r[0] for r in conn.execute("SELECT text FROM conversations WHERE contact_id=? ORDER BY conv_id",
+                                           (contact_id,))]
+
+
+def test_repeated_messages_are_all_stored(db, tmp_path):
+    report = ingest(write_csv(tmp_path / "a.csv", REPEATS), "Ravi")
+    assert (report["inserted"], report["skipped"]) == (5, 0)
+    assert stored_texts(report["contact_id"]) == [text for _, _, text in REPEATS]
+
+
+def test_reimport_skips_repeats_across_chunks(db, tmp_path):
+    path = write_csv(tmp_path / "a.csv", REPEATS)
+    ingest(path, "Ravi", chunksize=2)
+    again = ingest(path, "Ravi", chunksize=3)
+    assert (again["inserted"], again["skipped"]) == (0, 5)
+
+    # a longer export of the same chat only adds the new repeat
+    longer = write_csv(tmp_path / "b.csv", REPEATS + [("2024-11-10", "inbound", "ok")])
+    report = ingest(longer, "Ravi", chunksize=2)
+    assert (report["inserted"], report["skipped"]) == (1, 5)
+    assert stored_texts(report["contact_id"]).count("ok") == 3
+
+
+def test_first_occurrence_keeps_the_plain_hash():
+    hashes = schema.message_hashes([1, 1], ["d", "d"], ["in", "in"], ["ok", "ok"])
+    assert hashes[0] == schema.message_hash(1, "d", "in", "ok")
+    assert hashes[1] == schema.message_hash(1, "d", "in", "ok", 1) != hashes[0]
+
+
+def test_migration_numbers_repeats_left_without_hash(db, tmp_path):
+    with repository.transaction() as conn:
+        cid, _ = repository.resolve_contact(conn, "Ravi")
+        # what migration 8 left behind: a repeat with a NULL hash
+        conn.executemany("INSERT INTO conversations(contact_id, timestamp, ts, direction, text, msg_hash) "
+                         "VALUES (?,?,?,?,?,?)",
+                         [(cid, "2024-11-10", 1731196800, "inbound", "ok",
+                           schema.message_hash(1731196800, "2024-11-10", "inbound", "ok")),
+                          (cid, "2024-11-10", 1731196800, "inbound", "ok", None)])
+        schema._number_repeated_messages(conn)
+        assert conn.execute("SELECT COUNT(*) FROM conversations WHERE msg_hash IS NULL").fetchone()[0] == 0
+    report = ingest(write_csv(tmp_path / "a.csv", [("2024-11-10", "inbound", "ok")] * 2), "Ravi")
+    assert report["inserted"] == 0
+
+
+def test_repeat_counts_only_cover_one_timestamp():
+    seen = {}
+    texts = ["ok", "ok", "yes", "no", "maybe", "hi", "hi"]
+    schema.message_hashes([1, 1, 1, 1, 1, 2, 2], ["d"] * 7, ["in"] * 7, texts, seen)
+    assert len(seen) == 2  # the current timestamp and one counter ("hi"), not every message so far
+    # the run of timestamp 2 continues into the next chunk
+    assert schema.message_hashes([2], ["d"], ["in"], ["hi"], seen) == [schema.message_hash(2, "d", "in", "hi", 2)]
+
+
+def test_migration_numbers_repeats_per_contact(db, tmp_path):
+    conn = old_database(db, 7)
+    conn.executemany("INSERT INTO contacts(contact_id, name) VALUES (?,?)", [(1, "Ravi"), (2, "Mira")])
+    ts = schema.to_epoch(["2024-11-10"])[0]
+    conn.executemany("INSERT INTO conversations(contact_id, timestamp, ts, direction, text) VALUES (?,?,?,?,?)",
+                     [(1, "2024-11-10", ts, "inbound", "ok"), (2, "2024-11-10", ts, "inbound", "ok")])
+    conn.close()
+
+    report = ingest(write_csv(tmp_path / "mira.csv", [("2024-11-10", "inbound", "ok")]), "Mira")
+    assert (report["contact_id"], report["inserted"], report["skipped"]) == (2, 0, 1)
+    with repository.connection() as conn:
+        rows = conn.execute("SELECT contact_id, text FROM conversations ORDER BY conv_id").fetchall()
+    assert rows == [(1, "ok"), (2, "ok")]
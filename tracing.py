@@ -0,0 +1,267 @@
+# tracing.py
+# Lightweight timing spans and metrics for the generation and ingest pipelines.
+#
+#   with tracing.trace("generate", contact_id=1) as t:
+#       with tracing.span("context"):
+#           ...
+#       tracing.annotate(prompt_tokens=123, fallback_reason="quota")
+#
+# Each finished trace is appended as one JSON line to METRICS_PATH and folded
+# into an in-process registry that renders Prometheus text format. Spans opened
+# outside a trace are no-ops, so library code can be instrumented unconditionally.
+#
+# Run a standalone /metrics endpoint that aggregates the JSONL file written by any
+# process (CLI scripts, Streamlit, batch runs):
+#   python tracing.py --port 9464
+
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_PATH = os.getenv("BONDKEEPER_METRICS_PATH", "bondkeeper_metrics.jsonl")
+
+# attrs that are summed into counters when a trace finishes
+COUNTED_ATTRS = ("prompt_tokens", "response_tokens", "rows")
+
+_current = contextvars.ContextVar("bondkeeper_trace", default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.duration_ms = None
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "trace_id": self.trace_id,
+            "ts": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+def escape_label(value):
+    """Escape backslash, double quote and newline, as the Prometheus text format requires."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """Aggregated metrics, rendered in Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}   # (metric, labels) -> value
+        self.summaries = {}  # (metric, labels) -> [count, sum]
+
+    def _inc(self, metric, labels, value=1):
+        key = (metric, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def _observe(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        entry = self.summaries.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += value
+
+    def record(self, t):
+        """Fold a finished trace (as produced by Trace.to_dict) into the metrics."""
+        name = t["trace"]
+        attrs = t.get("attrs") or {}
+        with self._lock:
+            self._observe("bondkeeper_trace_seconds", {"trace": name}, (t["duration_ms"] or 0) / 1000)
+            for s in t.get("spans", []):
+                self._observe("bondkeeper_stage_seconds", {"trace": name, "stage": s["name"]},
+                              s["duration_ms"] / 1000)
+            for attr in COUNTED_ATTRS:
+                if isinstance(attrs.get(attr), (int, float)):
+                    self._inc(f"bondkeeper_{attr}_total", {"trace": name}, attrs[attr])
+            route = attrs.get("route")
+            if isinstance(route, dict):
+                self._inc("bondkeeper_route_total", {"trace": name, "model": route.get("model"),
+                                                     "tier": route.get("tier")})
+            if attrs.get("failovers"):
+                self._inc("bondkeeper_failovers_total", {"trace": name}, attrs["failovers"])
+            if attrs.get("fallback_reason"):
+                self._inc("bondkeeper_fallback_total", {"trace": name, "reason": attrs["fallback_reason"]})
+            if attrs.get("error"):
+                self._inc("bondkeeper_errors_total", {"trace": name})
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            by_metric = {}
+            for (metric, labels), value in self.counters.items():
+                by_metric.setdefault(metric, ("counter", []))[1].append((labels, value))
+            for (metric, labels), value in self.summaries.items():
+                by_metric.setdefault(metric, ("summary", []))[1].append((labels, value))
+        for metric in sorted(by_metric):
+            kind, series = by_metric[metric]
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, value in sorted(series):
+                label_str = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels)
+                if kind == "counter":
+                    lines.append(f"{metric}{{{label_str}}} {value}")
+                else:
+                    lines.append(f"{metric}_count{{{label_str}}} {value[0]}")
+                    lines.append(f"{metric}_sum{{{label_str}}} {value[1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+_last = {}
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Start a trace; spans and annotations inside the block are attached to it."""
+    t = Trace(name, attrs)
+    token = _current.set(t)
+    try:
+        yield t
+    except Exception as e:
+        t.attrs.setdefault("error", repr(e))
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # generator closed from another context; nothing to restore there
+        t.duration_ms = (time.perf_counter() - t._t0) * 1000
+        finish(t)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage of the current trace (no-op outside a trace)."""
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        entry = {"name": name, "start_ms": (start - t._t0) * 1000, "duration_ms": (end - start) * 1000}
+        if attrs:
+            entry["attrs"] = attrs
+        t.spans.append(entry)
+
+
+def annotate(**attrs):
+    """Attach attributes (token counts, fallback reason, ...) to the current trace."""
+    t = _current.get()
+    if t is not None:
+        t.attrs.update(attrs)
+
+
+def current():
+    return _current.get()
+
+
+def finish(t):
+    data = t.to_dict()
+    registry.record(data)
+    _last[t.name] = data
+    if METRICS_PATH:
+        line = json.dumps(data, default=str)
+        with _write_lock:
+            try:
+                with open(METRICS_PATH, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass  # metrics must never break the pipeline
+
+
+def last_trace(name):
+    """The most recent finished trace called `name` in this process, as a dict."""
+    return _last.get(name)
+
+
+def prometheus_text():
+    return registry.prometheus_text()
+
+
+class JsonlFollower:
+    """Incrementally folds new lines of a metrics JSONL file into a Registry."""
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self.offset = 0
+        self.registry = Registry()
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    f.seek(self.offset)
+                    while True:
+                        line = f.readline()
+                        if not line.endswith("\n"):
+                            break  # partial line still being written
+                        self.offset = f.tell()
+                        try:
+                            self.registry.record(json.loads(line))
+                        except (ValueError, KeyError):
+                            continue
+            except OSError:
+                pass
+        return self.registry
+
+
+def serve_metrics(port=9464, text_fn=prometheus_text):
+    """Serve text_fn() at http://0.0.0.0:<port>/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = text_fn().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve /metrics aggregated from the metrics JSONL file.")
+    parser.add_argument("--port", type=int, default=9464)
+    parser.add_argument("--path", default=METRICS_PATH)
+    args = parser.parse_args()
+
+    follower = JsonlFollower(args.path)
+    serve_metrics(args.port, lambda: follower.refresh().prometheus_text())
+    print(f"Serving metrics from {args.path} at http://localhost:{args.port}/metrics (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass